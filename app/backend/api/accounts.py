@@ -1,9 +1,11 @@
-from fastapi import APIRouter, Depends, HTTPException, Request
+from fastapi import APIRouter, Depends, Header, HTTPException, Request, Response
+from fastapi.responses import StreamingResponse
 from motor.motor_asyncio import AsyncIOMotorDatabase
-from typing import List
+from typing import List, Optional
 
-from app.backend.models.account import Account, AccountCreate
-from app.backend.services import account_service
+from app.backend.models.account import Account, AccountSummary, AccountCreate
+from app.backend.services import account_service, concurrency, export_service, pagination, projection
+from app.backend.api import responses
 
 router = APIRouter()
 
@@ -16,16 +18,39 @@ async def create_account_endpoint(account: AccountCreate, db: AsyncIOMotorDataba
     return await account_service.create_account(db=db, account=account)
 
 @router.get("/accounts/", response_model=List[Account], tags=["accounts"])
-async def read_accounts_endpoint(skip: int = 0, limit: int = 100, db: AsyncIOMotorDatabase = Depends(get_database)):
-    accounts = await account_service.get_accounts(db=db, skip=skip, limit=limit)
-    return accounts
+async def read_accounts_endpoint(skip: int = 0, limit: int = 100, cursor: Optional[str] = None, view: projection.ListView = "full", fields: Optional[str] = None, db: AsyncIOMotorDatabase = Depends(get_database)):
+    try:
+        selected_fields = projection.resolve_fields(Account, AccountSummary, view=view, fields=fields)
+        if selected_fields is None:
+            accounts, next_cursor = await account_service.get_accounts_page(db=db, skip=skip, limit=limit, cursor=cursor)
+        else:
+            accounts, next_cursor = await account_service.get_accounts_projected_page(db=db, fields=selected_fields, skip=skip, limit=limit, cursor=cursor)
+    except (pagination.InvalidCursorError, projection.InvalidFieldsError) as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    headers = {"X-Next-Cursor": next_cursor} if next_cursor else None
+    # Projected pages do not match the full response model.
+    if selected_fields is not None and not fields:
+        accounts = [AccountSummary(**account) for account in accounts]
+    return responses.json_response(accounts, headers=headers)
+
+@router.get("/accounts/export", tags=["accounts"])
+async def export_accounts_endpoint(format: export_service.ExportFormat = "ndjson", gzip: bool = False, db: AsyncIOMotorDatabase = Depends(get_database)):
+    headers = {"Content-Disposition": f'attachment; filename="accounts.{format}"'}
+    if gzip:
+        headers["Content-Encoding"] = "gzip"
+    return StreamingResponse(
+        export_service.stream_export(db.accounts, fields=list(Account.model_fields), format=format, gzip=gzip),
+        media_type=export_service.MEDIA_TYPES[format],
+        headers=headers,
+    )
 
 @router.get("/accounts/{account_id}", response_model=Account, tags=["accounts"])
 async def read_account_endpoint(account_id: str, db: AsyncIOMotorDatabase = Depends(get_database)):
     db_account = await account_service.get_account(db=db, account_id=account_id)
     if db_account is None:
         raise HTTPException(status_code=404, detail="Account not found")
-    return db_account
+    return responses.json_response(db_account, headers={"ETag": concurrency.etag(db_account.version)})
 
 # I will add update and delete endpoints too, as they are part of CRUD.
 from pydantic import BaseModel
@@ -35,18 +60,22 @@ class AccountUpdate(BaseModel):
     is_active: bool | None = None
 
 @router.patch("/accounts/{account_id}", response_model=Account, tags=["accounts"])
-async def update_account_endpoint(account_id: str, account: AccountUpdate, db: AsyncIOMotorDatabase = Depends(get_database)):
-    update_data = account.dict(exclude_unset=True)
+async def update_account_endpoint(account_id: str, account: AccountUpdate, response: Response, if_match: Optional[str] = Header(None), db: AsyncIOMotorDatabase = Depends(get_database)):
+    update_data = account.model_dump(exclude_unset=True)
     if not update_data:
         raise HTTPException(status_code=400, detail="No update data provided")
+    try:
+        expected_version = concurrency.parse_if_match(if_match)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
-    success = await account_service.update_account(db=db, account_id=account_id, account_data=update_data)
-    if not success:
-        raise HTTPException(status_code=404, detail="Account not found or no changes made")
-
-    updated_account = await account_service.get_account(db=db, account_id=account_id)
+    try:
+        updated_account = await account_service.update_account(db=db, account_id=account_id, account_data=update_data, expected_version=expected_version)
+    except concurrency.VersionConflictError as e:
+        raise HTTPException(status_code=409, detail=str(e))
     if updated_account is None:
-        raise HTTPException(status_code=404, detail="Account not found after update")
+        raise HTTPException(status_code=404, detail="Account not found")
+    response.headers["ETag"] = concurrency.etag(updated_account.version)
     return updated_account
 
 
@@ -0,0 +1,47 @@
+from fastapi import APIRouter, Depends, Header, HTTPException, Request
+from fastapi.responses import PlainTextResponse
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from typing import Optional
+
+from app.backend.services import ai_service, auth, cache, index_service, profiling, stats_service
+
+async def require_admin_token(x_admin_token: Optional[str] = Header(None)):
+    if not auth.is_admin(x_admin_token):
+        raise HTTPException(status_code=403, detail="A valid X-Admin-Token is required")
+
+# Every admin endpoint can change or expose the state of the whole deployment.
+router = APIRouter(dependencies=[Depends(require_admin_token)])
+
+async def get_database(request: Request) -> AsyncIOMotorDatabase:
+    return request.app.mongodb
+
+@router.get("/admin/indexes", tags=["admin"])
+async def read_index_report_endpoint(db: AsyncIOMotorDatabase = Depends(get_database)):
+    return await index_service.get_index_report(db=db)
+
+@router.post("/admin/indexes/sync", tags=["admin"])
+async def sync_indexes_endpoint(db: AsyncIOMotorDatabase = Depends(get_database)):
+    return await index_service.ensure_indexes(db=db, rebuild=True)
+
+@router.post("/admin/stats/reconcile", tags=["admin"])
+async def reconcile_stats_endpoint(db: AsyncIOMotorDatabase = Depends(get_database)):
+    return await stats_service.reconcile(db=db)
+
+@router.get("/admin/cache", tags=["admin"])
+async def read_cache_stats_endpoint():
+    return cache.stats()
+
+@router.get("/admin/ai-cache", tags=["admin"])
+async def read_ai_cache_stats_endpoint():
+    return ai_service.stats()
+
+@router.get("/admin/profiles", tags=["admin"])
+async def read_profiles_endpoint(limit: int = 50, db: AsyncIOMotorDatabase = Depends(get_database)):
+    return await profiling.list_profiles(db=db, limit=limit)
+
+@router.get("/admin/profiles/{profile_id}", response_class=PlainTextResponse, tags=["admin"])
+async def read_profile_endpoint(profile_id: str, db: AsyncIOMotorDatabase = Depends(get_database)):
+    profile = await profiling.get_profile(db=db, profile_id=profile_id)
+    if profile is None:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    return PlainTextResponse(profile["collapsed"], headers={"Content-Disposition": f'attachment; filename="profile-{profile_id}.txt"'})
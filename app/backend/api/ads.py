@@ -1,13 +1,27 @@
-from fastapi import APIRouter, Depends, HTTPException, Request, BackgroundTasks
+import logging
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, Request, Response
+from fastapi.responses import StreamingResponse
 from motor.motor_asyncio import AsyncIOMotorDatabase
-from typing import List
+from typing import List, Literal, Optional
+from datetime import datetime, timezone
 from pydantic import BaseModel
 
-from app.backend.services import ai_service, ad_service, account_service, automation_service
-from app.backend.models.ad import Ad, AdCreate, AdUpdate
+from app.backend.services import ai_batch_service, ai_service, ad_service, account_service, auth, concurrency, expansion, export_service, image_service, job_queue, pagination, projection, scheduler_service, search_service
+from app.backend.models.ad import Ad, AdSearchResults, AdSummary, AdCreate, AdUpdate, AdBulkUpdate, AdBulkDelete
+from app.backend.models.bulk import BulkItemResult
+from app.backend.models.generation import AdTextBatch, AdTextBatchRequest
+from app.backend.api import responses
 
 router = APIRouter()
 
+logger = logging.getLogger(__name__)
+
+# Related resources that can be embedded with `expand=`.
+AD_RELATIONS = ("account",)
+
+# Upper bound on the number of items accepted by a single bulk request.
+MAX_BULK_ITEMS = 5000
+
 # Dependency to get the DB connection
 async def get_database(request: Request) -> AsyncIOMotorDatabase:
     return request.app.mongodb
@@ -15,11 +29,80 @@ async def get_database(request: Request) -> AsyncIOMotorDatabase:
 class AdTextGenerationRequest(BaseModel):
     prompt: str
 
+async def _stream_ad_text_events(prompt: str, db: AsyncIOMotorDatabase):
+    # Starlette cancels this generator when the client disconnects, which stops the generation.
+    chunks = []
+    try:
+        async for chunk in ai_service.stream_ad_text(prompt, db=db):
+            chunks.append(chunk)
+            yield responses.sse_event("token", {"text": chunk})
+    except Exception as e:
+        logger.error(f"Streaming ad text generation failed: {e}")
+        yield responses.sse_event("error", {"detail": "Text generation failed"})
+        return
+    yield responses.sse_event("done", {"generated_text": "".join(chunks)})
+
 @router.post("/ads/generate-text", tags=["ads"])
-async def generate_ad_text_endpoint(request: AdTextGenerationRequest):
-    generated_text = ai_service.generate_ad_text(request.prompt)
+async def generate_ad_text_endpoint(
+    request: AdTextGenerationRequest,
+    stream: bool = False,
+    accept: Optional[str] = Header(None),
+    db: AsyncIOMotorDatabase = Depends(get_database),
+):
+    if stream or "text/event-stream" in (accept or ""):
+        return StreamingResponse(
+            _stream_ad_text_events(request.prompt, db),
+            media_type="text/event-stream",
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        )
+    generated_text = await ai_service.generate_ad_text(request.prompt, db=db)
     return {"generated_text": generated_text}
 
+async def _stream_batch_events(batch: AdTextBatchRequest, db: AsyncIOMotorDatabase):
+    results = []
+    async for result in ai_batch_service.generate(db, batch.items):
+        results.append(result)
+        yield responses.sse_event("result", result)
+    written = await ai_batch_service.write_descriptions(db, results) if batch.write_to_ads else set()
+    yield responses.sse_event("done", {
+        "total": len(results),
+        "generated": sum(result.status == "generated" for result in results),
+        "written_ad_ids": sorted(written),
+    })
+
+@router.post("/ads/generate-text/batch", tags=["ads"])
+async def generate_ad_texts_batch_endpoint(
+    batch: AdTextBatchRequest,
+    response: Response,
+    mode: Literal["stream", "job"] = "stream",
+    db: AsyncIOMotorDatabase = Depends(get_database),
+):
+    if not batch.items:
+        raise HTTPException(status_code=400, detail="No items provided")
+    if len(batch.items) > ai_batch_service.max_items():
+        raise HTTPException(status_code=413, detail=f"At most {ai_batch_service.max_items()} items can be sent in one batch")
+
+    if mode == "job":
+        try:
+            created = await ai_batch_service.create_batch(db, batch.items, write_to_ads=batch.write_to_ads)
+        except job_queue.QueueFullError as e:
+            raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": "30"})
+        response.status_code = 202
+        return {"message": "Text generation has been queued.", "batch_id": created.id, "job_id": created.job_id}
+
+    return StreamingResponse(
+        _stream_batch_events(batch, db),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+@router.get("/ads/generate-text/batch/{batch_id}", response_model=AdTextBatch, tags=["ads"])
+async def read_ad_texts_batch_endpoint(batch_id: str, db: AsyncIOMotorDatabase = Depends(get_database)):
+    db_batch = await ai_batch_service.get_batch(db=db, batch_id=batch_id)
+    if db_batch is None:
+        raise HTTPException(status_code=404, detail="Batch not found")
+    return db_batch
+
 
 @router.post("/ads/", response_model=Ad, tags=["ads"])
 async def create_ad_endpoint(ad: AdCreate, db: AsyncIOMotorDatabase = Depends(get_database)):
@@ -29,31 +112,115 @@ async def create_ad_endpoint(ad: AdCreate, db: AsyncIOMotorDatabase = Depends(ge
         raise HTTPException(status_code=404, detail=f"Account with id {ad.account_id} not found")
     return await ad_service.create_ad(db=db, ad=ad)
 
+def _check_bulk_size(items: list):
+    if not items:
+        raise HTTPException(status_code=400, detail="No items provided")
+    if len(items) > MAX_BULK_ITEMS:
+        raise HTTPException(status_code=413, detail=f"At most {MAX_BULK_ITEMS} items can be sent in one bulk request")
+
+@router.post("/ads/bulk", response_model=List[BulkItemResult], tags=["ads"])
+async def create_ads_bulk_endpoint(ads: List[AdCreate], db: AsyncIOMotorDatabase = Depends(get_database)):
+    _check_bulk_size(ads)
+    return await ad_service.create_ads(db=db, ads=ads)
+
+@router.patch("/ads/bulk", response_model=List[BulkItemResult], tags=["ads"])
+async def update_ads_bulk_endpoint(ads: List[AdBulkUpdate], db: AsyncIOMotorDatabase = Depends(get_database)):
+    _check_bulk_size(ads)
+    return await ad_service.update_ads(db=db, ads=ads)
+
+@router.delete("/ads/bulk", response_model=List[BulkItemResult], tags=["ads"])
+async def delete_ads_bulk_endpoint(request: AdBulkDelete, db: AsyncIOMotorDatabase = Depends(get_database)):
+    _check_bulk_size(request.ids)
+    return await ad_service.delete_ads(db=db, ad_ids=request.ids)
+
 @router.get("/ads/", response_model=List[Ad], tags=["ads"])
-async def read_ads_endpoint(skip: int = 0, limit: int = 100, db: AsyncIOMotorDatabase = Depends(get_database)):
-    ads = await ad_service.get_ads(db=db, skip=skip, limit=limit)
-    return ads
+async def read_ads_endpoint(skip: int = 0, limit: int = 100, cursor: Optional[str] = None, view: projection.ListView = "full", fields: Optional[str] = None, expand: Optional[str] = None, db: AsyncIOMotorDatabase = Depends(get_database)):
+    try:
+        relations = expansion.parse_expand(expand, AD_RELATIONS)
+        if relations and (fields or view != "full"):
+            raise HTTPException(status_code=400, detail="expand cannot be combined with fields or view")
+        selected_fields = projection.resolve_fields(Ad, AdSummary, view=view, fields=fields)
+        if relations:
+            ads, next_cursor = await ad_service.get_ads_expanded_page(db=db, skip=skip, limit=limit, cursor=cursor)
+        elif selected_fields is None:
+            ads, next_cursor = await ad_service.get_ads_page(db=db, skip=skip, limit=limit, cursor=cursor)
+        else:
+            ads, next_cursor = await ad_service.get_ads_projected_page(db=db, fields=selected_fields, skip=skip, limit=limit, cursor=cursor)
+    except (pagination.InvalidCursorError, projection.InvalidFieldsError, expansion.InvalidExpandError) as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    headers = {"X-Next-Cursor": next_cursor} if next_cursor else None
+    # Projected and expanded pages do not match the full response model.
+    if selected_fields is not None and not fields:
+        ads = [AdSummary(**ad) for ad in ads]
+    return responses.json_response(ads, headers=headers)
+
+@router.get("/ads/export", tags=["ads"])
+async def export_ads_endpoint(format: export_service.ExportFormat = "ndjson", gzip: bool = False, account_id: Optional[str] = None, db: AsyncIOMotorDatabase = Depends(get_database)):
+    query = {"account_id": account_id} if account_id else None
+    headers = {"Content-Disposition": f'attachment; filename="ads.{format}"'}
+    if gzip:
+        headers["Content-Encoding"] = "gzip"
+    return StreamingResponse(
+        export_service.stream_export(db.ads, fields=list(Ad.model_fields), format=format, query=query, gzip=gzip),
+        media_type=export_service.MEDIA_TYPES[format],
+        headers=headers,
+    )
+
+@router.get("/ads/search", response_model=AdSearchResults, tags=["ads"])
+async def search_ads_endpoint(
+    q: Optional[str] = None,
+    category: Optional[str] = None,
+    subcategory: Optional[str] = None,
+    province: Optional[str] = None,
+    zone: Optional[str] = None,
+    account_id: Optional[str] = None,
+    price_min: Optional[float] = None,
+    price_max: Optional[float] = None,
+    sort: Optional[search_service.SearchSort] = None,
+    skip: int = Query(0, ge=0),
+    limit: int = Query(20, ge=1, le=100),
+    db: AsyncIOMotorDatabase = Depends(get_database),
+):
+    filters = {"category": category, "subcategory": subcategory, "province": province, "zone": zone, "account_id": account_id}
+    try:
+        results = await search_service.search_ads(db=db, q=q, filters=filters, price_min=price_min, price_max=price_max, sort=sort, skip=skip, limit=limit)
+    except search_service.InvalidSearchError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return responses.json_response(results)
 
 @router.get("/ads/{ad_id}", response_model=Ad, tags=["ads"])
-async def read_ad_endpoint(ad_id: str, db: AsyncIOMotorDatabase = Depends(get_database)):
-    db_ad = await ad_service.get_ad(db=db, ad_id=ad_id)
+async def read_ad_endpoint(ad_id: str, expand: Optional[str] = None, db: AsyncIOMotorDatabase = Depends(get_database)):
+    try:
+        relations = expansion.parse_expand(expand, AD_RELATIONS)
+    except expansion.InvalidExpandError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if relations:
+        db_ad = await ad_service.get_ad_expanded(db=db, ad_id=ad_id)
+    else:
+        db_ad = await ad_service.get_ad(db=db, ad_id=ad_id)
     if db_ad is None:
         raise HTTPException(status_code=404, detail="Ad not found")
-    return db_ad
+
+    return responses.json_response(db_ad, headers={"ETag": concurrency.etag(db_ad.version)})
 
 @router.patch("/ads/{ad_id}", response_model=Ad, tags=["ads"])
-async def update_ad_endpoint(ad_id: str, ad: AdUpdate, db: AsyncIOMotorDatabase = Depends(get_database)):
-    update_data = ad.dict(exclude_unset=True)
+async def update_ad_endpoint(ad_id: str, ad: AdUpdate, response: Response, if_match: Optional[str] = Header(None), db: AsyncIOMotorDatabase = Depends(get_database)):
+    update_data = ad.model_dump(exclude_unset=True)
     if not update_data:
         raise HTTPException(status_code=400, detail="No update data provided")
+    try:
+        expected_version = concurrency.parse_if_match(if_match)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
-    success = await ad_service.update_ad(db=db, ad_id=ad_id, ad_data=update_data)
-    if not success:
-        raise HTTPException(status_code=404, detail="Ad not found or no changes made")
-
-    updated_ad = await ad_service.get_ad(db=db, ad_id=ad_id)
+    try:
+        updated_ad = await ad_service.update_ad(db=db, ad_id=ad_id, ad_data=update_data, expected_version=expected_version)
+    except concurrency.VersionConflictError as e:
+        raise HTTPException(status_code=409, detail=str(e))
     if updated_ad is None:
-        raise HTTPException(status_code=404, detail="Ad not found after update")
+        raise HTTPException(status_code=404, detail="Ad not found")
+    response.headers["ETag"] = concurrency.etag(updated_ad.version)
     return updated_ad
 
 @router.delete("/ads/{ad_id}", status_code=204, tags=["ads"])
@@ -63,8 +230,8 @@ async def delete_ad_endpoint(ad_id: str, db: AsyncIOMotorDatabase = Depends(get_
         raise HTTPException(status_code=404, detail="Ad not found")
     return {}
 
-@router.post("/ads/{ad_id}/publish", tags=["ads"])
-async def publish_ad_endpoint(ad_id: str, background_tasks: BackgroundTasks, db: AsyncIOMotorDatabase = Depends(get_database)):
+@router.post("/ads/{ad_id}/publish", status_code=202, tags=["ads"])
+async def publish_ad_endpoint(ad_id: str, run_at: Optional[datetime] = None, db: AsyncIOMotorDatabase = Depends(get_database)):
     db_ad = await ad_service.get_ad(db=db, ad_id=ad_id)
     if db_ad is None:
         raise HTTPException(status_code=404, detail="Ad not found")
@@ -73,6 +240,117 @@ async def publish_ad_endpoint(ad_id: str, background_tasks: BackgroundTasks, db:
     if db_account is None:
         raise HTTPException(status_code=404, detail="Account for this ad not found")
 
-    background_tasks.add_task(automation_service.post_ad_to_wanuncios, db_account, db_ad)
+    if run_at is not None:
+        if run_at.tzinfo is not None:
+            run_at = run_at.astimezone(timezone.utc).replace(tzinfo=None)
+        job_id = await scheduler_service.schedule_job(db, "publish_ad", {"ad_id": ad_id}, run_at=run_at)
+        return {"message": f"Ad publishing has been scheduled for {run_at.isoformat()}.", "job_id": job_id}
+
+    try:
+        job = await job_queue.enqueue(db, "publish_ad", {"ad_id": ad_id})
+    except job_queue.QueueFullError as e:
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": "30"})
+    return {"message": "Ad publishing has been queued.", "job_id": job.id}
+
+@router.post("/ads/{ad_id}/images", status_code=201, tags=["ads"])
+async def upload_ad_image_endpoint(ad_id: str, request: Request, content_type: Optional[str] = Header(None), content_length: Optional[int] = Header(None), db: AsyncIOMotorDatabase = Depends(get_database)):
+    if not (content_type or "").startswith("image/"):
+        raise HTTPException(status_code=415, detail="The body must be an image, sent with an image/* Content-Type")
+    if content_length is not None and content_length > image_service.max_bytes():
+        raise HTTPException(status_code=413, detail=f"Images are limited to {image_service.max_bytes()} bytes")
+    if await ad_service.get_ad(db=db, ad_id=ad_id) is None:
+        raise HTTPException(status_code=404, detail="Ad not found")
+
+    try:
+        stored = await image_service.store_image(
+            db, request.stream(), content_type=content_type.split(";")[0].strip(),
+            reference=lambda sha256: ad_service.attach_image(db, ad_id, sha256),
+        )
+    except image_service.ImageTooLargeError as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except image_service.EmptyImageError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if stored is None:
+        raise HTTPException(status_code=404, detail="Ad not found")
+    image, created = stored
+    try:
+        variants = await image_service.ensure_variants(db, image["sha256"])
+    except Exception as e:
+        # The image is stored and attached; its variants are derived again on its first download.
+        logger.error(f"Variants of image {image['sha256']} could not be derived on upload: {e}")
+        variants = {}
+    return {**_image_links(ad_id, image, variants), "created": created}
+
+def _image_links(ad_id: str, image: dict, variants: dict) -> dict:
+    url = f"/api/ads/{ad_id}/images/{image['sha256']}"
+    return {
+        **image,
+        "url": url,
+        "variants": {name: {**variant, "url": f"{url}?variant={name}"} for name, variant in variants.items()},
+    }
+
+@router.get("/ads/{ad_id}/images", tags=["ads"])
+async def read_ad_images_endpoint(ad_id: str, db: AsyncIOMotorDatabase = Depends(get_database)):
+    db_ad = await ad_service.get_ad(db=db, ad_id=ad_id)
+    if db_ad is None:
+        raise HTTPException(status_code=404, detail="Ad not found")
+    hashes = [value for value in db_ad.images if image_service.is_image_hash(value)]
+    images = await image_service.get_images(db, hashes)
+    variants = await image_service.get_variants(db, hashes)
+    return [_image_links(ad_id, image, variants.get(image["sha256"], {})) for image in images]
+
+@router.get("/ads/{ad_id}/images/{sha256}", tags=["ads"])
+async def download_ad_image_endpoint(
+    ad_id: str,
+    sha256: str,
+    variant: Optional[str] = None,
+    range_header: Optional[str] = Header(None, alias="Range"),
+    if_none_match: Optional[str] = Header(None),
+    x_admin_token: Optional[str] = Header(None),
+    db: AsyncIOMotorDatabase = Depends(get_database),
+):
+    db_ad = await ad_service.get_ad(db=db, ad_id=ad_id)
+    if db_ad is None or sha256 not in db_ad.images:
+        raise HTTPException(status_code=404, detail="Image not found")
+    is_admin = auth.is_admin(x_admin_token)
+    try:
+        download = await image_service.get_download(db, sha256, variant=variant, include_original=is_admin)
+    except image_service.UnknownVariantError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except image_service.OriginalNotAllowedError as e:
+        raise HTTPException(status_code=403, detail=str(e))
+    if download is None:
+        raise HTTPException(status_code=404, detail="Image not found")
+
+    # The original never changes under its hash, so caches may keep it forever;
+    # shared caches only when it is served to everyone. Variants change with the
+    # variant settings and are revalidated daily.
+    if download.bucket_name != image_service.BUCKET_NAME:
+        cache_control = "public, max-age=86400"
+    else:
+        cache_control = "private, max-age=31536000, immutable" if is_admin else "public, max-age=31536000, immutable"
+    headers = {"ETag": download.etag, "Accept-Ranges": "bytes", "Cache-Control": cache_control}
+    if if_none_match and (if_none_match.strip() == "*" or download.etag in (value.strip() for value in if_none_match.split(","))):
+        return Response(status_code=304, headers=headers)
+
+    length = download.length
+    try:
+        byte_range = image_service.parse_range(range_header, length)
+    except image_service.InvalidRangeError as e:
+        raise HTTPException(status_code=416, detail=str(e), headers={"Content-Range": f"bytes */{length}"})
+    start, end = byte_range or (0, length - 1)
+    if byte_range:
+        headers["Content-Range"] = f"bytes {start}-{end}/{length}"
+    headers["Content-Length"] = str(end - start + 1)
+    return StreamingResponse(
+        image_service.stream_download(db, download, start=start, end=end),
+        status_code=206 if byte_range else 200,
+        media_type=download.content_type,
+        headers=headers,
+    )
 
-    return {"message": "Ad publishing has been started in the background."}
+@router.delete("/ads/{ad_id}/images/{sha256}", status_code=204, tags=["ads"])
+async def delete_ad_image_endpoint(ad_id: str, sha256: str, db: AsyncIOMotorDatabase = Depends(get_database)):
+    if not await ad_service.detach_image(db, ad_id, sha256):
+        raise HTTPException(status_code=404, detail="Image not found")
+    return Response(status_code=204)
@@ -0,0 +1,39 @@
+from fastapi import APIRouter, HTTPException
+from fastapi.responses import StreamingResponse
+from typing import List, Optional
+
+from app.backend.services import live_events
+from app.backend.api import responses
+
+router = APIRouter()
+
+async def _stream_events(collections: Optional[List[str]], account_id: Optional[str]):
+    # Subscribed before `ready` is sent, so the client misses nothing written after it.
+    subscription = live_events.subscribe(collections=collections, account_id=account_id)
+    try:
+        yield responses.sse_event("ready", {"source": live_events.source()})
+        while True:
+            try:
+                event = await subscription.next(timeout=live_events.heartbeat_seconds())
+            except OverflowError as e:
+                # The client fell too far behind: it has to reload its lists and reconnect.
+                yield responses.sse_event("overflow", {"detail": str(e)})
+                return
+            if event is None:
+                yield ": keep-alive\n\n"
+            else:
+                yield responses.sse_event("change", event)
+    finally:
+        live_events.unsubscribe(subscription)
+
+@router.get("/events", tags=["events"])
+async def stream_events_endpoint(collections: Optional[str] = None, account_id: Optional[str] = None):
+    selected = [name.strip() for name in collections.split(",") if name.strip()] if collections else None
+    unknown = set(selected or ()) - set(live_events.COLLECTIONS)
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown collections: {', '.join(sorted(unknown))}")
+    return StreamingResponse(
+        _stream_events(selected, account_id),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
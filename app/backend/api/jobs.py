@@ -0,0 +1,32 @@
+from fastapi import APIRouter, Depends, HTTPException, Request
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from typing import Optional
+from datetime import datetime, timedelta, timezone
+
+from app.backend.services import job_queue, job_runs
+from app.backend.models.job import Job, JobRunStatsReport
+
+router = APIRouter()
+
+# Dependency to get the DB connection
+async def get_database(request: Request) -> AsyncIOMotorDatabase:
+    return request.app.mongodb
+
+def _naive_utc(value: datetime) -> datetime:
+    return value.astimezone(timezone.utc).replace(tzinfo=None) if value.tzinfo else value
+
+@router.get("/job-runs/stats", response_model=JobRunStatsReport, tags=["jobs"])
+async def read_job_run_stats_endpoint(group_by: job_runs.RunGroup = "schedule", since: Optional[datetime] = None, until: Optional[datetime] = None, db: AsyncIOMotorDatabase = Depends(get_database)):
+    until = _naive_utc(until) if until else datetime.utcnow()
+    since = _naive_utc(since) if since else until - timedelta(hours=24)
+    if since >= until:
+        raise HTTPException(status_code=400, detail="since must be before until")
+    groups = await job_runs.get_run_stats(db=db, group_by=group_by, since=since, until=until)
+    return {"group_by": group_by, "since": since, "until": until, "groups": groups}
+
+@router.get("/jobs/{job_id}", response_model=Job, tags=["jobs"])
+async def read_job_endpoint(job_id: str, db: AsyncIOMotorDatabase = Depends(get_database)):
+    db_job = await job_queue.get_job(db=db, job_id=job_id)
+    if db_job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return db_job
@@ -0,0 +1,92 @@
+import time
+from datetime import datetime
+from fastapi import APIRouter, Depends, Request
+from fastapi.responses import PlainTextResponse
+from motor.motor_asyncio import AsyncIOMotorDatabase
+
+from app.backend.services import job_queue, job_store, live_events, metrics, scheduler_service
+
+router = APIRouter()
+
+REQUESTS = metrics.Counter("http_requests_total", "HTTP requests by route template and status.", ("method", "route", "status"))
+REQUEST_DURATION = metrics.Histogram("http_request_duration_seconds", "HTTP request latency by route template.", ("method", "route"))
+IN_FLIGHT = metrics.Gauge("http_requests_in_flight", "HTTP requests being served.")
+QUEUE_JOBS = metrics.Gauge("job_queue_jobs", "Jobs of the background queue by status.", ("status",))
+SCHEDULED_JOBS = metrics.Gauge("scheduled_jobs", "Timed jobs waiting in the job store.")
+DUE_SCHEDULES = metrics.Gauge("schedules_due", "Active schedules whose next run has passed.")
+SCHEDULER_RUNNING = metrics.Gauge("scheduler_running_tasks", "Schedule runs and timed jobs running in this process.")
+SCHEDULER_LEADER = metrics.Gauge("scheduler_leader", "1 if this process holds the scheduler lease.")
+EVENT_SUBSCRIBERS = metrics.Gauge("live_event_subscribers", "Clients of /api/events connected to this process.")
+
+# Dependency to get the DB connection
+async def get_database(request: Request) -> AsyncIOMotorDatabase:
+    return request.app.mongodb
+
+def route_template(scope) -> str:
+    """
+    The template of the route that served a request, e.g. /api/ads/{ad_id}, so
+    that ids never become label values: the path of the matched route. Whether
+    that path holds the prefix its router was included with depends on the
+    FastAPI version; when it does not, the prefix is the part of the request
+    path in front of what the route matched.
+    """
+    route = scope.get("route")
+    if route is None:
+        return "unmatched"
+    path, regex = getattr(route, "path", None), getattr(route, "path_regex", None)
+    if path is None or regex is None or regex.match(scope["path"]):
+        return path or "unmatched"
+    request_path = scope["path"]
+    for index in range(1, len(request_path)):
+        if request_path[index] == "/" and regex.match(request_path[index:]):
+            return request_path[:index] + path
+    return path
+
+class MetricsMiddleware:
+    """Pure ASGI middleware counting and timing HTTP requests by route template."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status = 500
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        IN_FLIGHT.inc()
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            IN_FLIGHT.dec()
+            template = route_template(scope)
+            REQUEST_DURATION.observe(scope["method"], template, value=time.perf_counter() - started)
+            REQUESTS.inc(scope["method"], template, str(status))
+
+async def _collect_queue_depth(db: AsyncIOMotorDatabase):
+    counts = {"queued": 0, "running": 0}
+    async for group in db[job_queue.COLLECTION_NAME].aggregate([
+        {"$match": {"status": {"$in": list(counts)}}},
+        {"$group": {"_id": "$status", "count": {"$sum": 1}}},
+    ]):
+        counts[group["_id"]] = group["count"]
+    for status, count in counts.items():
+        QUEUE_JOBS.set(status, value=count)
+    SCHEDULED_JOBS.set(value=await db[job_store.COLLECTION_NAME].count_documents({}))
+    DUE_SCHEDULES.set(value=await db.schedules.count_documents({"is_active": True, "next_republish_at": {"$lte": datetime.utcnow()}}))
+
+@router.get("/metrics", response_class=PlainTextResponse, include_in_schema=False)
+async def read_metrics_endpoint(db: AsyncIOMotorDatabase = Depends(get_database)):
+    if db is not None:
+        await _collect_queue_depth(db)
+    SCHEDULER_RUNNING.set(value=scheduler_service.running_count())
+    SCHEDULER_LEADER.set(value=1 if scheduler_service.is_leader() else 0)
+    EVENT_SUBSCRIBERS.set(value=live_events.subscriber_count())
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
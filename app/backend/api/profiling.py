@@ -0,0 +1,106 @@
+import asyncio
+import random
+import time
+import uuid
+import logging
+from urllib.parse import parse_qs
+
+from app.backend.services import auth, profiling
+
+logger = logging.getLogger(__name__)
+
+# Values of X-Profile or `profile` that ask for a profile; any other value is ignored.
+_MODES = {"1", "true", "inline"}
+
+class ProfilingMiddleware:
+    """
+    Pure ASGI middleware profiling single requests on demand. A request is
+    profiled when it carries a valid X-Admin-Token and either an X-Profile header
+    or a `profile` query parameter:
+
+      X-Profile: 1|true  the response is returned as usual with an X-Profile-Id
+                         header; the profile is downloaded from /api/admin/profiles/{id}
+      X-Profile: inline  the response body is replaced by the collapsed stacks
+
+    With PROFILE_SAMPLE_RATE set, that fraction of all requests is profiled and
+    saved as well. Other requests, including ones with any other X-Profile or
+    `profile` value (e.g. `0`), go straight through.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        mode, token = None, None
+        for name, value in scope["headers"]:
+            if name == b"x-profile":
+                mode = value.decode().strip().lower()
+            elif name == b"x-admin-token":
+                token = value.decode()
+        if mode is None and b"profile=" in scope["query_string"]:
+            mode = parse_qs(scope["query_string"].decode()).get("profile", [""])[0].strip().lower()
+
+        if mode in _MODES:
+            if not auth.is_admin(token):
+                await _send_text(send, 403, b"Profiling requires a valid X-Admin-Token\n")
+                return
+            await self._profile(scope, receive, send, inline=mode == "inline", sampled=False)
+        elif (rate := profiling.sample_rate()) > 0 and random.random() < rate:
+            await self._profile(scope, receive, send, inline=False, sampled=True)
+        else:
+            await self.app(scope, receive, send)
+
+    async def _profile(self, scope, receive, send, inline: bool, sampled: bool):
+        profile_id = str(uuid.uuid4())
+        status = 500
+        buffered = []
+
+        async def send_profiled(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                if not inline and not sampled:
+                    message = {**message, "headers": list(message.get("headers", [])) + [(b"x-profile-id", profile_id.encode())]}
+            if inline:
+                buffered.append(message) # Replaced by the profile below
+            else:
+                await send(message)
+
+        profiler = profiling.SamplingProfiler(asyncio.current_task(), root_code=self.__call__.__code__)
+        started = time.perf_counter()
+        profiler.start()
+        try:
+            await self.app(scope, receive, send_profiled)
+        finally:
+            stacks = profiler.stop()
+            duration_ms = (time.perf_counter() - started) * 1000
+
+        if inline:
+            headers = [
+                (b"x-profile-status", str(status).encode()),
+                (b"x-profile-duration-ms", f"{duration_ms:.1f}".encode()),
+                (b"x-profile-samples", str(sum(stacks.values())).encode()),
+            ]
+            await _send_text(send, 200, profiling.collapse(stacks).encode(), headers)
+            return
+
+        db = getattr(scope["app"], "mongodb", None)
+        if db is None:
+            logger.warning(f"Dropping profile of {scope['method']} {scope['path']}: no database.")
+            return
+        try:
+            await profiling.save_profile(db, profile_id, scope["method"], scope["path"], status, duration_ms, stacks, sampled=sampled)
+        except Exception as e:
+            logger.error(f"Could not save profile {profile_id}: {e}")
+
+async def _send_text(send, status: int, body: bytes, headers: list = ()):
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [(b"content-type", b"text/plain; charset=utf-8"), (b"content-length", str(len(body)).encode()), *headers],
+    })
+    await send({"type": "http.response.body", "body": body})
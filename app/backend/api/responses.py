@@ -0,0 +1,38 @@
+import json
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from pydantic import BaseModel
+from typing import Any, Optional
+
+try:
+    import orjson
+except ImportError: # Optional: without it responses are encoded with the standard library
+    orjson = None
+
+# Read endpoints return their models through json_response() rather than
+# letting FastAPI validate them against `response_model` again: the models are
+# built from our own documents (see model_construct in the services), so they
+# are serialised as they are, with orjson when it is installed.
+
+def _default(value: Any) -> Any:
+    if isinstance(value, BaseModel):
+        return value.model_dump()
+    return jsonable_encoder(value)
+
+class FastJSONResponse(JSONResponse):
+    def render(self, content: Any) -> bytes:
+        return orjson.dumps(content, default=_default)
+
+def json_response(content: Any, headers: Optional[dict] = None) -> JSONResponse:
+    """
+    Renders content without FastAPI's response validation: trusted models, or
+    content that does not fit the route's `response_model`, such as projected
+    documents.
+    """
+    if orjson is not None:
+        return FastJSONResponse(content=content, headers=headers)
+    return JSONResponse(content=jsonable_encoder(content), headers=headers)
+
+def sse_event(event: str, data: Any) -> str:
+    """One Server-Sent Event with a JSON payload."""
+    return f"event: {event}\ndata: {json.dumps(jsonable_encoder(data))}\n\n"
@@ -1,84 +1,105 @@
-from fastapi import APIRouter, Depends, HTTPException, Request
+from fastapi import APIRouter, Depends, Header, HTTPException, Request, Response
+from fastapi.responses import StreamingResponse
 from motor.motor_asyncio import AsyncIOMotorDatabase
-from typing import List
+from typing import List, Optional
 
-from app.backend.models.schedule import Schedule, ScheduleCreate, ScheduleUpdate
-from app.backend.services import schedule_service, ad_service, account_service, scheduler_service as sched_svc
+from app.backend.models.schedule import Schedule, ScheduleSummary, ScheduleCreate, ScheduleUpdate
+from app.backend.services import schedule_service, ad_service, concurrency, expansion, export_service, pagination, projection, scheduler_service as sched_svc
+from app.backend.api import responses
 
 router = APIRouter()
 
+# Related resources that can be embedded with `expand=`.
+SCHEDULE_RELATIONS = ("ad", "account")
+
 async def get_database(request: Request) -> AsyncIOMotorDatabase:
     return request.app.mongodb
 
 @router.post("/schedules/", response_model=Schedule, tags=["schedules"])
 async def create_schedule_endpoint(schedule: ScheduleCreate, db: AsyncIOMotorDatabase = Depends(get_database)):
-    new_schedule = await schedule_service.create_schedule(db=db, schedule=schedule)
-
-    ad = await ad_service.get_ad(db=db, ad_id=new_schedule.ad_id)
+    # Ad and account are read in one query, before anything is written.
+    ad = await ad_service.get_ad_expanded(db=db, ad_id=schedule.ad_id)
     if not ad:
         raise HTTPException(status_code=404, detail="Ad to schedule not found")
-
-    account = await account_service.get_account(db=db, account_id=ad.account_id)
+    account = ad.account
     if not account:
         raise HTTPException(status_code=404, detail="Account for ad not found")
 
-    if new_schedule.is_active:
-        sched_svc.schedule_ad_posting_job(
-            schedule_id=new_schedule.id,
-            interval_hours=new_schedule.republish_interval_hours,
-            account=account,
-            ad=ad
-        )
+    new_schedule = await schedule_service.create_schedule(db=db, schedule=schedule)
+    sched_svc.wake()
     return new_schedule
 
 @router.get("/schedules/", response_model=List[Schedule], tags=["schedules"])
-async def read_schedules_endpoint(skip: int = 0, limit: int = 100, db: AsyncIOMotorDatabase = Depends(get_database)):
-    return await schedule_service.get_schedules(db=db, skip=skip, limit=limit)
+async def read_schedules_endpoint(skip: int = 0, limit: int = 100, cursor: Optional[str] = None, view: projection.ListView = "full", fields: Optional[str] = None, expand: Optional[str] = None, db: AsyncIOMotorDatabase = Depends(get_database)):
+    try:
+        relations = expansion.parse_expand(expand, SCHEDULE_RELATIONS)
+        if relations and (fields or view != "full"):
+            raise HTTPException(status_code=400, detail="expand cannot be combined with fields or view")
+        selected_fields = projection.resolve_fields(Schedule, ScheduleSummary, view=view, fields=fields)
+        if relations:
+            schedules, next_cursor = await schedule_service.get_schedules_expanded_page(db=db, expand=relations, skip=skip, limit=limit, cursor=cursor)
+        elif selected_fields is None:
+            schedules, next_cursor = await schedule_service.get_schedules_page(db=db, skip=skip, limit=limit, cursor=cursor)
+        else:
+            schedules, next_cursor = await schedule_service.get_schedules_projected_page(db=db, fields=selected_fields, skip=skip, limit=limit, cursor=cursor)
+    except (pagination.InvalidCursorError, projection.InvalidFieldsError, expansion.InvalidExpandError) as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    headers = {"X-Next-Cursor": next_cursor} if next_cursor else None
+    # Projected and expanded pages do not match the full response model.
+    if selected_fields is not None and not fields:
+        schedules = [ScheduleSummary(**schedule) for schedule in schedules]
+    return responses.json_response(schedules, headers=headers)
+
+@router.get("/schedules/export", tags=["schedules"])
+async def export_schedules_endpoint(format: export_service.ExportFormat = "ndjson", gzip: bool = False, ad_id: Optional[str] = None, db: AsyncIOMotorDatabase = Depends(get_database)):
+    query = {"ad_id": ad_id} if ad_id else None
+    headers = {"Content-Disposition": f'attachment; filename="schedules.{format}"'}
+    if gzip:
+        headers["Content-Encoding"] = "gzip"
+    return StreamingResponse(
+        export_service.stream_export(db.schedules, fields=list(Schedule.model_fields), format=format, query=query, gzip=gzip),
+        media_type=export_service.MEDIA_TYPES[format],
+        headers=headers,
+    )
 
 @router.get("/schedules/{schedule_id}", response_model=Schedule, tags=["schedules"])
-async def read_schedule_endpoint(schedule_id: str, db: AsyncIOMotorDatabase = Depends(get_database)):
-    db_schedule = await schedule_service.get_schedule(db=db, schedule_id=schedule_id)
+async def read_schedule_endpoint(schedule_id: str, expand: Optional[str] = None, db: AsyncIOMotorDatabase = Depends(get_database)):
+    try:
+        relations = expansion.parse_expand(expand, SCHEDULE_RELATIONS)
+    except expansion.InvalidExpandError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if relations:
+        db_schedule = await schedule_service.get_schedule_expanded(db=db, schedule_id=schedule_id, expand=relations)
+    else:
+        db_schedule = await schedule_service.get_schedule(db=db, schedule_id=schedule_id)
     if db_schedule is None:
         raise HTTPException(status_code=404, detail="Schedule not found")
-    return db_schedule
+
+    return responses.json_response(db_schedule, headers={"ETag": concurrency.etag(db_schedule.version)})
 
 @router.patch("/schedules/{schedule_id}", response_model=Schedule, tags=["schedules"])
-async def update_schedule_endpoint(schedule_id: str, schedule: ScheduleUpdate, db: AsyncIOMotorDatabase = Depends(get_database)):
-    update_data = schedule.dict(exclude_unset=True)
+async def update_schedule_endpoint(schedule_id: str, schedule: ScheduleUpdate, response: Response, if_match: Optional[str] = Header(None), db: AsyncIOMotorDatabase = Depends(get_database)):
+    update_data = schedule.model_dump(exclude_unset=True)
     if not update_data:
         raise HTTPException(status_code=400, detail="No update data provided")
-
-    success = await schedule_service.update_schedule(db=db, schedule_id=schedule_id, schedule_data=update_data)
-    if not success:
-        raise HTTPException(status_code=404, detail="Schedule not found or no changes made")
-
-    updated_schedule = await schedule_service.get_schedule(db=db, schedule_id=schedule_id)
+    try:
+        expected_version = concurrency.parse_if_match(if_match)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    try:
+        updated_schedule = await schedule_service.update_schedule(db=db, schedule_id=schedule_id, schedule_data=update_data, expected_version=expected_version)
+    except concurrency.VersionConflictError as e:
+        raise HTTPException(status_code=409, detail=str(e))
     if updated_schedule is None:
-        raise HTTPException(status_code=404, detail="Schedule not found after update")
-
-    ad = await ad_service.get_ad(db=db, ad_id=updated_schedule.ad_id)
-    if not ad:
-        raise HTTPException(status_code=404, detail="Ad for schedule not found")
-    account = await account_service.get_account(db=db, account_id=ad.account_id)
-    if not account:
-        raise HTTPException(status_code=404, detail="Account for ad not found")
-
-    if updated_schedule.is_active:
-        sched_svc.schedule_ad_posting_job(
-            schedule_id=updated_schedule.id,
-            interval_hours=updated_schedule.republish_interval_hours,
-            account=account,
-            ad=ad
-        )
-    else:
-        sched_svc.remove_schedule(schedule_id=updated_schedule.id)
-
+        raise HTTPException(status_code=404, detail="Schedule not found")
+    response.headers["ETag"] = concurrency.etag(updated_schedule.version)
+    sched_svc.wake()
     return updated_schedule
 
 @router.delete("/schedules/{schedule_id}", status_code=204, tags=["schedules"])
 async def delete_schedule_endpoint(schedule_id: str, db: AsyncIOMotorDatabase = Depends(get_database)):
-    sched_svc.remove_schedule(schedule_id=schedule_id)
-
     success = await schedule_service.delete_schedule(db=db, schedule_id=schedule_id)
     if not success:
         raise HTTPException(status_code=404, detail="Schedule not found")
@@ -0,0 +1,15 @@
+from fastapi import APIRouter, Depends, Request
+from motor.motor_asyncio import AsyncIOMotorDatabase
+
+from app.backend.services import stats_service
+from app.backend.models.stats import Stats
+
+router = APIRouter()
+
+# Dependency to get the DB connection
+async def get_database(request: Request) -> AsyncIOMotorDatabase:
+    return request.app.mongodb
+
+@router.get("/stats", response_model=Stats, tags=["stats"])
+async def read_stats_endpoint(db: AsyncIOMotorDatabase = Depends(get_database)):
+    return await stats_service.get_stats(db=db)
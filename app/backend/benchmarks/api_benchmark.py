@@ -0,0 +1,274 @@
+"""
+Throughput and latency of the main API flows against a seeded database, compared
+with a stored baseline.
+
+    PYTHONPATH=. python -m app.backend.benchmarks.api_benchmark --ads 10000
+    PYTHONPATH=. python -m app.backend.benchmarks.api_benchmark --ads 100000 --mongo-url mongodb://localhost:27017
+    PYTHONPATH=. python -m app.backend.benchmarks.api_benchmark --ads 10000 --save-baseline
+
+Results are written as JSON to --output. Unless --no-compare is given they are
+compared with the baseline for the same backend and dataset size in
+benchmarks/baselines/ (or --baseline), and the command exits with status 1 when
+a scenario's p95 latency grew, or its throughput dropped, by more than
+--threshold. Baselines are only comparable on the machine that recorded them;
+their `meta` records the Python version, CPU architecture and core count, not
+the host. Scenarios missing from the baseline are reported and not compared.
+
+Without --mongo-url the benchmark runs against mongomock, which scans instead of
+using indexes and is far slower than mongod on large datasets.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import platform
+import random
+import sys
+import time
+import uuid
+from datetime import datetime
+from typing import Awaitable, Callable, Dict, List, Optional
+
+from app.backend.benchmarks import harness
+
+BASELINE_DIR = os.path.join(os.path.dirname(__file__), "baselines")
+
+SEED_ACCOUNTS = 100
+SEED_BATCH_SIZE = 10000
+BULK_SIZE = 100
+
+# Share of --requests each scenario performs; a bulk operation writes BULK_SIZE ads.
+SCENARIO_WEIGHTS = {"bulk": 0.1}
+
+# Seeded ads are spread over these provinces and over prices 0-999, so searches have facets to count.
+SEED_PROVINCES = ("Panamá", "Chiriquí", "Colón", "Coclé", "Veraguas")
+
+def _ad(account_id: str, index: int) -> dict:
+    return {
+        "title": f"Benchmark ad {index}",
+        "description": "Seeded by the API benchmark. " * 10,
+        "category": "Contactos",
+        "subcategory": "Relaciones Ocasionales",
+        "province": "Panamá",
+        "account_id": account_id,
+    }
+
+async def seed(db, ads: int) -> dict:
+    """Inserts accounts and `ads` ads directly, in batches. Returns the ids used by the scenarios."""
+    account_ids = [str(uuid.uuid4()) for _ in range(SEED_ACCOUNTS)]
+    await db.accounts.insert_many([
+        {"id": account_id, "email": f"benchmark-{index}@example.com", "wanuncios_password": "password", "is_active": True, "captcha_solving_method": "api", "version": 0}
+        for index, account_id in enumerate(account_ids)
+    ])
+    ad_ids = []
+    now = datetime.utcnow()
+    for start in range(0, ads, SEED_BATCH_SIZE):
+        batch = []
+        for index in range(start, min(start + SEED_BATCH_SIZE, ads)):
+            ad_id = str(uuid.uuid4())
+            ad_ids.append(ad_id)
+            batch.append({
+                **_ad(account_ids[index % SEED_ACCOUNTS], index),
+                "id": ad_id,
+                "province": SEED_PROVINCES[index % len(SEED_PROVINCES)],
+                "price": float(index % 1000),
+                "images": [],
+                "created_at": now,
+                "version": 0,
+            })
+        await db.ads.insert_many(batch)
+    return {"account_ids": account_ids, "ad_ids": ad_ids}
+
+SCENARIOS = ("list", "get", "create", "patch", "bulk", "schedule", "search")
+
+def _scenarios(client, seeded: dict, text_search: bool = False) -> Dict[str, Callable[[], Awaitable[int]]]:
+    """
+    Each scenario performs one operation and returns how many items it handled.
+    Searches only include a text query with `text_search`: mongomock has no `$text`.
+    """
+    account_ids, ad_ids = seeded["account_ids"], seeded["ad_ids"]
+    cursors: List[Optional[str]] = [None]
+
+    async def check(response, expected: int = 200):
+        if response.status_code != expected:
+            raise RuntimeError(f"{response.request.method} {response.request.url.path} returned {response.status_code}")
+        return response
+
+    async def list_ads():
+        # Walks the collection page by page, starting over at the end.
+        response = await check(await client.get("/api/ads/", params={"limit": 100, **({"cursor": cursors[0]} if cursors[0] else {})}))
+        cursors[0] = response.headers.get("X-Next-Cursor")
+        return len(response.json())
+
+    async def get_ad():
+        await check(await client.get(f"/api/ads/{random.choice(ad_ids)}"))
+        return 1
+
+    async def create_ad():
+        await check(await client.post("/api/ads/", json=_ad(random.choice(account_ids), -1)))
+        return 1
+
+    async def patch_ad():
+        await check(await client.patch(f"/api/ads/{random.choice(ad_ids)}", json={"price": random.randint(1, 1000)}))
+        return 1
+
+    async def bulk_create():
+        await check(await client.post("/api/ads/bulk", json=[_ad(random.choice(account_ids), -1) for _ in range(BULK_SIZE)]))
+        return BULK_SIZE
+
+    async def schedule_flow():
+        response = await check(await client.post("/api/schedules/", json={"ad_id": random.choice(ad_ids), "republish_interval_hours": 24}))
+        schedule_id = response.json()["id"]
+        await check(await client.get(f"/api/schedules/{schedule_id}", params={"expand": "ad,account"}))
+        await check(await client.patch(f"/api/schedules/{schedule_id}", json={"is_active": False}))
+        return 1
+
+    async def search_ads():
+        low = random.randint(0, 900)
+        params = {"category": "Contactos", "province": random.choice(SEED_PROVINCES), "price_min": low, "price_max": low + 100}
+        if text_search:
+            params["q"] = "benchmark ad"
+        response = await check(await client.get("/api/ads/search", params=params))
+        return len(response.json()["items"])
+
+    return {
+        "list": list_ads,
+        "get": get_ad,
+        "create": create_ad,
+        "patch": patch_ad,
+        "bulk": bulk_create,
+        "schedule": schedule_flow,
+        "search": search_ads,
+    }
+
+async def measure(operation: Callable[[], Awaitable[int]], requests: int, concurrency: int) -> dict:
+    latencies_ms: List[float] = []
+    errors: List[str] = []
+    items = 0
+    remaining = iter(range(requests))
+
+    async def worker():
+        nonlocal items
+        for _ in remaining:
+            started = time.perf_counter()
+            try:
+                items += await operation()
+            except Exception as e:
+                errors.append(str(e))
+                continue
+            latencies_ms.append((time.perf_counter() - started) * 1000)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    return {
+        "operations": requests,
+        "errors": len(errors),
+        "first_error": errors[0] if errors else None,
+        "throughput_ops": round(len(latencies_ms) / elapsed, 2),
+        "throughput_items": round(items / elapsed, 2),
+        **harness.summarize(latencies_ms),
+    }
+
+async def run(ads: int, requests: int, concurrency: int, scenarios: List[str], mongo_url: Optional[str]) -> dict:
+    db = harness.database(mongo_url, "classifieds_pro_benchmark")
+    await harness.reset_database(db)
+    started = time.perf_counter()
+    seeded = await seed(db, ads)
+    seed_seconds = time.perf_counter() - started
+
+    results = {}
+    async with harness.app_client(db) as client:
+        operations = _scenarios(client, seeded, text_search=bool(mongo_url))
+        for name in scenarios:
+            count = max(1, int(requests * SCENARIO_WEIGHTS.get(name, 1)))
+            await measure(operations[name], max(1, count // 10), concurrency) # Warm-up
+            results[name] = await measure(operations[name], count, concurrency)
+            print(f"{name:10} {results[name]['throughput_ops']:>10} ops/s  p50 {results[name]['p50_ms']} ms  p95 {results[name]['p95_ms']} ms", file=sys.stderr)
+
+    return {
+        "meta": {
+            "backend": "mongod" if mongo_url else "mongomock",
+            "ads": ads,
+            "requests": requests,
+            "concurrency": concurrency,
+            "seed_seconds": round(seed_seconds, 2),
+            "python": platform.python_version(),
+            "architecture": platform.machine(),
+            "cpus": os.cpu_count(),
+            "recorded_at": datetime.utcnow().isoformat(),
+        },
+        "scenarios": results,
+    }
+
+def compare(results: dict, baseline: dict, threshold: float) -> List[str]:
+    """Regressions of `results` against `baseline`, as readable lines."""
+    regressions = []
+    for name, current in results["scenarios"].items():
+        reference = baseline.get("scenarios", {}).get(name)
+        if not reference:
+            continue
+        if current["errors"]:
+            regressions.append(f"{name}: {current['errors']} errors ({current['first_error']})")
+        if reference.get("p95_ms") and current.get("p95_ms") and current["p95_ms"] > reference["p95_ms"] * (1 + threshold):
+            regressions.append(f"{name}: p95 {current['p95_ms']} ms vs {reference['p95_ms']} ms in the baseline")
+        if reference.get("throughput_ops") and current["throughput_ops"] < reference["throughput_ops"] * (1 - threshold):
+            regressions.append(f"{name}: {current['throughput_ops']} ops/s vs {reference['throughput_ops']} ops/s in the baseline")
+    return regressions
+
+def default_baseline_path(backend: str, ads: int) -> str:
+    return os.path.join(BASELINE_DIR, f"{backend}-{ads}.json")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--ads", type=int, default=10000, help="Number of ads to seed, e.g. 10000, 100000 or 1000000")
+    parser.add_argument("--requests", type=int, default=200, help="Operations per scenario")
+    parser.add_argument("--concurrency", type=int, default=10, help="Operations in flight at once")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS), help="Comma-separated scenarios to run")
+    parser.add_argument("--mongo-url", default=None, help="Run against a real mongod instead of mongomock")
+    parser.add_argument("--output", default="benchmark-results.json", help="Where to write the results")
+    parser.add_argument("--baseline", default=None, help="Baseline to compare with (default: baselines/<backend>-<ads>.json)")
+    parser.add_argument("--threshold", type=float, default=0.25, help="Relative regression that fails the run (default 0.25)")
+    parser.add_argument("--save-baseline", action="store_true", help="Store the results as the new baseline")
+    parser.add_argument("--no-compare", action="store_true", help="Do not compare with a baseline")
+    args = parser.parse_args()
+
+    scenarios = [name.strip() for name in args.scenarios.split(",") if name.strip()]
+    unknown = set(scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"Unknown scenarios: {', '.join(sorted(unknown))}")
+    logging.getLogger("httpx").setLevel(logging.WARNING) # One line per request otherwise
+    results = asyncio.run(run(args.ads, args.requests, args.concurrency, scenarios, args.mongo_url))
+    with open(args.output, "w") as output:
+        json.dump(results, output, indent=2)
+
+    baseline_path = args.baseline or default_baseline_path(results["meta"]["backend"], args.ads)
+    if args.save_baseline:
+        os.makedirs(os.path.dirname(baseline_path), exist_ok=True)
+        with open(baseline_path, "w") as output:
+            json.dump(results, output, indent=2)
+        print(f"Saved baseline {baseline_path}", file=sys.stderr)
+        return
+    if args.no_compare:
+        return
+    if not os.path.exists(baseline_path):
+        print(f"No baseline at {baseline_path}, nothing to compare with.", file=sys.stderr)
+        return
+
+    with open(baseline_path) as baseline_file:
+        baseline = json.load(baseline_file)
+    for setting in ("requests", "concurrency"):
+        if baseline["meta"].get(setting) != results["meta"][setting]:
+            print(f"Warning: the baseline was recorded with {setting}={baseline['meta'].get(setting)}.", file=sys.stderr)
+    missing = [name for name in results["scenarios"] if name not in baseline.get("scenarios", {})]
+    if missing:
+        print(f"Warning: the baseline has no {', '.join(missing)} results; re-record it with --save-baseline.", file=sys.stderr)
+    regressions = compare(results, baseline, args.threshold)
+    if regressions:
+        print("Regressions against " + baseline_path + ":\n  " + "\n  ".join(regressions), file=sys.stderr)
+        sys.exit(1)
+    print(f"No regression beyond {args.threshold:.0%} against {baseline_path}.", file=sys.stderr)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+"""
+Shared setup for the benchmarks: a database (mongomock or a real mongod) and an
+httpx client talking to the app in-process through ASGITransport, with the
+database dependencies overridden the same way tests/conftest.py does.
+"""
+import statistics
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, List, Optional
+
+import httpx
+
+from app.backend.api import accounts, ads, admin, jobs, metrics, schedules
+from app.backend.main import app
+from app.backend.services import cache, index_service
+
+# Every router dependency that provides the database.
+DATABASE_DEPENDENCIES = [module.get_database for module in (accounts, ads, schedules, admin, jobs, metrics)]
+
+def database(mongo_url: Optional[str], name: str):
+    if mongo_url:
+        from motor.motor_asyncio import AsyncIOMotorClient
+        return AsyncIOMotorClient(mongo_url)[name]
+    import mongomock_motor
+    return mongomock_motor.AsyncMongoMockClient()[name]
+
+async def reset_database(db):
+    """Empties the collections and the entity caches, then creates the declared indexes."""
+    for collection in await db.list_collection_names():
+        if not collection.startswith("system."):
+            await db[collection].delete_many({})
+    cache.clear_all()
+    await index_service.ensure_indexes(db)
+
+@asynccontextmanager
+async def app_client(db) -> AsyncIterator[httpx.AsyncClient]:
+    """
+    A client for the app bound to `db`. The lifespan is not run, so no scheduler
+    or job workers compete with the measured requests.
+    """
+    async def override_get_database():
+        return db
+
+    previous_overrides = dict(app.dependency_overrides)
+    previous_db = getattr(app, "mongodb", None)
+    app.dependency_overrides.update({dependency: override_get_database for dependency in DATABASE_DEPENDENCIES})
+    app.mongodb = db
+    try:
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://benchmark", timeout=None) as client:
+            yield client
+    finally:
+        app.dependency_overrides = previous_overrides
+        app.mongodb = previous_db
+
+def percentile(values: List[float], percent: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(percent / 100 * (len(ordered) - 1))))]
+
+def summarize(latencies_ms: List[float]) -> dict:
+    if not latencies_ms:
+        return {"p50_ms": None, "p95_ms": None, "p99_ms": None, "max_ms": None}
+    return {
+        "p50_ms": round(statistics.median(latencies_ms), 3),
+        "p95_ms": round(percentile(latencies_ms, 95), 3),
+        "p99_ms": round(percentile(latencies_ms, 99), 3),
+        "max_ms": round(max(latencies_ms), 3),
+    }
@@ -0,0 +1,80 @@
+"""
+Throughput of the image variant pipeline (services/image_processing.py) in
+images per second, per worker process and per core.
+
+    PYTHONPATH=. python -m app.backend.benchmarks.image_benchmark
+    PYTHONPATH=. python -m app.backend.benchmarks.image_benchmark --images 200 --size 3000x2000 --workers 1,2,4
+
+Each image is decoded, oriented, resized to every configured variant
+(IMAGE_VARIANTS) and re-encoded, as on upload. The images are generated
+gradients with noise, encoded as JPEG like photographs. Requires Pillow.
+"""
+import argparse
+import asyncio
+import io
+import json
+import os
+import sys
+import time
+from typing import List
+
+from app.backend.services import image_processing
+
+def images(count: int, width: int, height: int) -> List[bytes]:
+    from PIL import Image
+
+    generated = []
+    for index in range(count):
+        base = Image.linear_gradient("L").resize((width, height)).convert("RGB")
+        noise = Image.effect_noise((width, height), 40 + index % 20).convert("RGB")
+        image = Image.blend(base, noise, 0.3)
+        output = io.BytesIO()
+        image.save(output, format="JPEG", quality=90)
+        generated.append(output.getvalue())
+    return generated
+
+async def measure(sources: List[bytes], workers: int) -> dict:
+    os.environ["IMAGE_PROCESS_WORKERS"] = str(workers)
+    await image_processing.shutdown_pool()
+    specs = image_processing.variant_specs()
+    await asyncio.gather(*(image_processing.derive_variants(source, specs) for source in sources[:workers])) # Start the workers
+    started = time.perf_counter()
+    await asyncio.gather(*(image_processing.derive_variants(source, specs) for source in sources))
+    elapsed = time.perf_counter() - started
+    await image_processing.shutdown_pool()
+    per_second = len(sources) / elapsed
+    return {
+        "workers": workers,
+        "images_per_second": round(per_second, 2),
+        "images_per_second_per_worker": round(per_second / workers, 2),
+        "images_per_second_per_core": round(per_second / min(workers, os.cpu_count() or 1), 2),
+    }
+
+async def run(count: int, width: int, height: int, worker_counts: List[int]) -> dict:
+    sources = images(count, width, height)
+    return {
+        "images": count,
+        "size": f"{width}x{height}",
+        "cores": os.cpu_count(),
+        "variants": [spec.key for spec in image_processing.variant_specs()],
+        "runs": [await measure(sources, workers) for workers in worker_counts],
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--images", type=int, default=50, help="Images per run")
+    parser.add_argument("--size", default="2400x1600", help="Source image size, WIDTHxHEIGHT")
+    parser.add_argument("--workers", default=None, help="Comma-separated worker counts (default: 1 and one per core)")
+    args = parser.parse_args()
+
+    if not image_processing.is_available():
+        parser.error("Pillow is not installed")
+    width, height = (int(value) for value in args.size.lower().split("x"))
+    worker_counts = [int(value) for value in args.workers.split(",")] if args.workers else sorted({1, os.cpu_count() or 1})
+    results = asyncio.run(run(args.images, width, height, worker_counts))
+    for result in results["runs"]:
+        print(f"{result['workers']:>3} workers  {result['images_per_second']:>8} images/s  {result['images_per_second_per_core']:>8} images/s/core", file=sys.stderr)
+    print(json.dumps(results, indent=2))
+
+if __name__ == "__main__":
+    main()
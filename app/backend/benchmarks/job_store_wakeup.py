@@ -0,0 +1,92 @@
+"""
+Measures how late the scheduler runs timed jobs when the job store holds many
+other jobs that are not due yet.
+
+    PYTHONPATH=. python -m app.backend.benchmarks.job_store_wakeup --jobs 5000
+    PYTHONPATH=. python -m app.backend.benchmarks.job_store_wakeup --jobs 50000 --mongo-url mongodb://localhost:27017
+
+Without --mongo-url the benchmark runs against mongomock, which scans instead
+of using indexes, so absolute numbers are only meaningful against a real mongod.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import statistics
+import time
+from datetime import datetime, timedelta
+
+from app.backend.benchmarks import harness
+from app.backend.services import index_service, job_store, scheduler_service
+
+_finished = {}
+
+@job_store.handler("benchmark_probe")
+async def benchmark_probe(db, probe: int, due_at: float):
+    _finished[probe] = time.time() - due_at
+
+async def run(jobs: int, probes: int, mongo_url: str | None) -> dict:
+    db = harness.database(mongo_url, "classifieds_pro_benchmark")
+    await db.scheduled_jobs.delete_many({})
+    await db.schedules.delete_many({})
+    await index_service.ensure_indexes(db)
+
+    # Background load: jobs spread over the next day, none of them due during the run.
+    now = datetime.utcnow()
+    idle_jobs = [
+        {
+            "_id": f"idle-{index}",
+            "handler": "benchmark_probe",
+            "kwargs": {"probe": -1, "due_at": 0},
+            "next_run_at": now + timedelta(minutes=10, seconds=random.uniform(0, 86400)),
+            "interval_seconds": None,
+            "created_at": now,
+        }
+        for index in range(jobs)
+    ]
+    if idle_jobs:
+        await db.scheduled_jobs.insert_many(idle_jobs)
+
+    # Long polls, so that the measured latency comes from the sweeper waking up
+    # for the next due job, not from polling.
+    os.environ["SCHEDULER_POLL_SECONDS"] = "60"
+    scheduler_service.initialize_scheduler(db)
+    try:
+        for probe in range(probes):
+            delay = random.uniform(0.05, 0.5)
+            due_at = time.time() + delay
+            await scheduler_service.schedule_job(
+                db, "benchmark_probe", {"probe": probe, "due_at": due_at},
+                run_at=datetime.utcnow() + timedelta(seconds=delay),
+            )
+            await asyncio.sleep(random.uniform(0.0, 0.1))
+        deadline = time.time() + 30
+        while len(_finished) < probes and time.time() < deadline:
+            await asyncio.sleep(0.05)
+    finally:
+        await scheduler_service.shutdown_scheduler()
+
+    latencies_ms = [latency * 1000 for latency in _finished.values()]
+    return {
+        "backend": "mongod" if mongo_url else "mongomock",
+        "stored_jobs": jobs,
+        "probes": probes,
+        "completed": len(latencies_ms),
+        "wakeup_latency_ms": {
+            "p50": round(statistics.median(latencies_ms), 2),
+            "p95": round(harness.percentile(latencies_ms, 95), 2),
+            "max": round(max(latencies_ms), 2),
+        } if latencies_ms else None,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--jobs", type=int, default=5000, help="Number of idle jobs stored next to the probes")
+    parser.add_argument("--probes", type=int, default=50, help="Number of timed jobs whose lateness is measured")
+    parser.add_argument("--mongo-url", default=None, help="Run against a real mongod instead of mongomock")
+    args = parser.parse_args()
+    print(json.dumps(asyncio.run(run(args.jobs, args.probes, args.mongo_url)), indent=2))
+
+if __name__ == "__main__":
+    main()
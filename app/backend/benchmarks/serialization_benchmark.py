@@ -0,0 +1,97 @@
+"""
+Per-item cost of turning a page of stored ads into a JSON response body, with
+the validated path the read endpoints used before and the fast path they use now.
+
+    PYTHONPATH=. python -m app.backend.benchmarks.serialization_benchmark
+    PYTHONPATH=. python -m app.backend.benchmarks.serialization_benchmark --items 1000 --repeat 20
+
+validated: Ad(**document) per item, validation against the List[Ad] response
+           model, then the standard library encoder, as FastAPI does.
+fast:      Ad.model_construct(**document) per item, encoded by json_response()
+           (orjson when installed).
+
+No database is involved: the documents are built in memory.
+"""
+import argparse
+import json
+import statistics
+import sys
+import time
+from datetime import datetime
+from typing import Callable, List
+
+from bson import ObjectId
+from fastapi.encoders import jsonable_encoder
+from pydantic import TypeAdapter
+
+from app.backend.api import responses
+from app.backend.models.ad import Ad
+
+_response_model = TypeAdapter(List[Ad])
+
+def documents(items: int) -> List[dict]:
+    now = datetime.utcnow().replace(microsecond=123000) # Mongo keeps milliseconds
+    return [
+        {
+            "_id": ObjectId(),
+            "id": f"ad-{index}",
+            "title": f"Benchmark ad {index}",
+            "description": "Seeded by the serialization benchmark. " * 10,
+            "category": "Contactos",
+            "subcategory": "Relaciones Ocasionales",
+            "province": "Panamá",
+            "zone": None,
+            "price": float(index),
+            "images": [f"https://example.com/{index}.jpg"],
+            "account_id": "account",
+            "created_at": now,
+            "last_published_at": None,
+            "version": 0,
+        }
+        for index in range(items)
+    ]
+
+def validated(page: List[dict]) -> bytes:
+    ads = [Ad(**document) for document in page]
+    content = jsonable_encoder(_response_model.dump_python(_response_model.validate_python(ads), mode="json"))
+    return json.dumps(content, ensure_ascii=False, allow_nan=False, separators=(",", ":")).encode("utf-8")
+
+def fast(page: List[dict]) -> bytes:
+    return responses.json_response([Ad.model_construct(**document) for document in page]).body
+
+PATHS = {"validated": validated, "fast": fast}
+
+def measure(path: Callable[[List[dict]], bytes], page: List[dict], repeat: int) -> dict:
+    path(page) # Warm-up
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        path(page)
+        timings.append(time.perf_counter() - started)
+    median = statistics.median(timings)
+    return {"page_ms": round(median * 1000, 3), "per_item_us": round(median / len(page) * 1e6, 3)}
+
+def run(items: int, repeat: int) -> dict:
+    page = documents(items)
+    results = {name: measure(path, page, repeat) for name, path in PATHS.items()}
+    return {
+        "items": items,
+        "encoder": "orjson" if responses.orjson is not None else "json",
+        "paths": results,
+        "speedup": round(results["validated"]["per_item_us"] / results["fast"]["per_item_us"], 2),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--items", type=int, default=1000, help="Ads per page")
+    parser.add_argument("--repeat", type=int, default=20, help="Timed runs per path; the median is reported")
+    args = parser.parse_args()
+
+    results = run(args.items, args.repeat)
+    for name, result in results["paths"].items():
+        print(f"{name:10} {result['per_item_us']:>8} us/item  {result['page_ms']:>8} ms/page", file=sys.stderr)
+    print(f"fast path: {results['speedup']}x ({results['encoder']})", file=sys.stderr)
+    print(json.dumps(results, indent=2))
+
+if __name__ == "__main__":
+    main()
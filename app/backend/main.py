@@ -10,8 +10,8 @@ from dotenv import load_dotenv
 # Add the project root to the python path
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
 
-from app.backend.api import accounts, ads, schedules
-from app.backend.services import scheduler_service
+from app.backend.api import accounts, ads, schedules, admin, events, jobs, metrics, profiling, stats
+from app.backend.services import cache_invalidation, image_processing, index_service, job_queue, live_events, mongo_monitoring, scheduler_service, stats_service
 
 # Load environment variables
 load_dotenv(dotenv_path=os.path.join(os.path.dirname(__file__), '.env'))
@@ -33,7 +33,7 @@ async def lifespan(app: FastAPI):
         app.mongodb_client = None
         app.mongodb = None
     else:
-        app.mongodb_client = AsyncIOMotorClient(mongo_url)
+        app.mongodb_client = AsyncIOMotorClient(mongo_url, event_listeners=mongo_monitoring.event_listeners())
         app.mongodb = app.mongodb_client[db_name]
         try:
             await app.mongodb_client.admin.command('ping')
@@ -43,14 +43,37 @@ async def lifespan(app: FastAPI):
             app.mongodb_client = None
             app.mongodb = None
 
-    if app.mongodb_client:
-        scheduler_service.initialize_scheduler(app.mongodb_client)
+    if app.mongodb is not None:
+        try:
+            await index_service.ensure_indexes(app.mongodb)
+        except Exception as e:
+            logger.error(f"Index bootstrap failed: {e}")
+        try:
+            await cache_invalidation.start(app.mongodb)
+        except Exception as e:
+            logger.error(f"Cache invalidation channel failed to start: {e}")
+        try:
+            await live_events.start(app.mongodb)
+        except Exception as e:
+            logger.error(f"Live events failed to start: {e}")
+        try:
+            await stats_service.schedule_reconciliation(app.mongodb)
+        except Exception as e:
+            logger.error(f"Statistics reconciliation could not be scheduled: {e}")
+
+    if app.mongodb is not None:
+        scheduler_service.initialize_scheduler(app.mongodb)
+        job_queue.start_workers(app.mongodb)
 
     yield
 
     # Shutdown
     logger.info("Application shutdown...")
-    scheduler_service.shutdown_scheduler()
+    await scheduler_service.shutdown_scheduler()
+    await job_queue.stop_workers()
+    await cache_invalidation.stop()
+    await live_events.stop()
+    await image_processing.shutdown_pool()
     if app.mongodb_client:
         app.mongodb_client.close()
         logger.info("Disconnected from MongoDB.")
@@ -62,6 +85,11 @@ app = FastAPI(title="Classifieds Pro API", lifespan=lifespan)
 app.include_router(accounts.router, prefix="/api")
 app.include_router(ads.router, prefix="/api")
 app.include_router(schedules.router, prefix="/api")
+app.include_router(admin.router, prefix="/api")
+app.include_router(jobs.router, prefix="/api")
+app.include_router(stats.router, prefix="/api")
+app.include_router(events.router, prefix="/api")
+app.include_router(metrics.router)
 
 # Add middleware
 app.add_middleware(
@@ -70,7 +98,10 @@ app.add_middleware(
     allow_origins=["*"],
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "ETag"],
 )
+app.add_middleware(profiling.ProfilingMiddleware)
+app.add_middleware(metrics.MetricsMiddleware)
 
 # Basic root endpoint
 @app.get("/api")
@@ -13,6 +13,13 @@ class AccountCreate(AccountBase):
 
 class Account(AccountBase):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    version: int = 0 # Incremented on every update, used for optimistic concurrency
 
     class Config:
         from_attributes = True
+
+# Lightweight view of an account for list pages: no credentials.
+class AccountSummary(BaseModel):
+    id: str
+    email: str
+    is_active: bool = True
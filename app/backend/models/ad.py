@@ -1,8 +1,10 @@
 from pydantic import BaseModel, Field
-from typing import List, Optional
+from typing import Dict, List, Optional
 import uuid
 from datetime import datetime
 
+from app.backend.models.account import Account
+
 class AdBase(BaseModel):
     title: str
     description: str
@@ -16,6 +18,8 @@ class AdBase(BaseModel):
 class AdCreate(AdBase):
     account_id: str
 
+# `images` is not updatable: images are added and removed through the image
+# endpoints, which keep the stored files and the references in step.
 class AdUpdate(BaseModel):
     title: Optional[str] = None
     description: Optional[str] = None
@@ -24,13 +28,49 @@ class AdUpdate(BaseModel):
     province: Optional[str] = None
     zone: Optional[str] = None
     price: Optional[float] = None
-    images: Optional[List[str]] = None
+
+class AdBulkUpdate(AdUpdate):
+    id: str
+
+class AdBulkDelete(BaseModel):
+    ids: List[str]
 
 class Ad(AdBase):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
     account_id: str
     created_at: datetime = Field(default_factory=datetime.utcnow)
     last_published_at: Optional[datetime] = None
+    version: int = 0 # Incremented on every update, used for optimistic concurrency
 
     class Config:
         from_attributes = True
+
+# An ad with its account embedded, returned when `expand=account` is requested.
+class AdExpanded(Ad):
+    account: Optional[Account] = None
+
+# Lightweight view of an ad for list pages: no description or images.
+class AdSummary(BaseModel):
+    id: str
+    account_id: str
+    title: str
+    category: str
+    subcategory: str
+    province: str
+    zone: Optional[str] = None
+    price: Optional[float] = None
+    created_at: Optional[datetime] = None
+
+# Search results (see search_service.py). `score` is the text relevance, only set for text queries.
+class AdSearchHit(AdSummary):
+    score: Optional[float] = None
+
+class FacetCount(BaseModel):
+    value: Optional[str] = None
+    count: int
+
+class AdSearchResults(BaseModel):
+    items: List[AdSearchHit]
+    total: int
+    total_exact: bool # False when more ads match than SEARCH_FACET_LIMIT; the facets then cover the first ones
+    facets: Dict[str, List[FacetCount]]
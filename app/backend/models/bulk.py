@@ -0,0 +1,8 @@
+from pydantic import BaseModel
+from typing import Optional, Literal
+
+class BulkItemResult(BaseModel):
+    index: int # Position of the item in the request body
+    id: Optional[str] = None
+    status: Literal['created', 'updated', 'deleted', 'not_found', 'error']
+    detail: Optional[str] = None
@@ -0,0 +1,30 @@
+from pydantic import BaseModel
+from typing import List, Optional, Literal
+from datetime import datetime
+
+class AdTextBatchItem(BaseModel):
+    prompt: str
+    ad_id: Optional[str] = None # Ad whose description receives the text when `write_to_ads` is set
+
+class AdTextBatchRequest(BaseModel):
+    items: List[AdTextBatchItem]
+    write_to_ads: bool = False
+
+class AdTextBatchResult(BaseModel):
+    index: int # Position of the item in the request body
+    ad_id: Optional[str] = None
+    status: Literal['generated', 'failed', 'timeout']
+    generated_text: Optional[str] = None
+    detail: Optional[str] = None
+
+# A batch run by the job queue (see services/ai_batch_service.py).
+class AdTextBatch(BaseModel):
+    id: str
+    job_id: Optional[str] = None
+    status: Literal['queued', 'running', 'succeeded', 'failed']
+    total: int
+    write_to_ads: bool = False
+    results: List[AdTextBatchResult] = []
+    written_ad_ids: List[str] = []
+    created_at: datetime
+    finished_at: Optional[datetime] = None
@@ -0,0 +1,37 @@
+from pydantic import BaseModel
+from typing import List, Optional, Literal
+from datetime import datetime
+
+# A job of the background queue (see services/job_queue.py).
+class Job(BaseModel):
+    id: str
+    handler: str
+    kwargs: dict = {}
+    status: Literal['queued', 'running', 'succeeded', 'failed']
+    attempts: int = 0
+    error: Optional[str] = None
+    worker: Optional[str] = None
+    created_at: datetime
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+    lease_expires_at: Optional[datetime] = None
+
+    class Config:
+        from_attributes = True
+
+# Run statistics of one schedule or account over a time window (see services/job_runs.py).
+class JobRunStats(BaseModel):
+    id: str # Schedule or account id
+    runs: int
+    failures: int
+    failure_rate: float
+    p50_ms: float
+    p95_ms: float
+    p99_ms: float
+    last_run_at: datetime
+
+class JobRunStatsReport(BaseModel):
+    group_by: Literal['schedule', 'account']
+    since: datetime
+    until: datetime
+    groups: List[JobRunStats]
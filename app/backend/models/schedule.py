@@ -3,6 +3,9 @@ from typing import Optional
 import uuid
 from datetime import datetime
 
+from app.backend.models.account import Account
+from app.backend.models.ad import Ad
+
 class ScheduleBase(BaseModel):
     republish_interval_hours: int
     is_active: bool = True
@@ -18,6 +21,19 @@ class Schedule(ScheduleBase):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
     ad_id: str
     next_republish_at: datetime
+    version: int = 0 # Incremented on every update, used for optimistic concurrency
 
     class Config:
         from_attributes = True
+
+# A schedule with its ad and/or account embedded, returned when `expand=` is requested.
+class ScheduleExpanded(Schedule):
+    ad: Optional[Ad] = None
+    account: Optional[Account] = None
+
+# Lightweight view of a schedule for list pages.
+class ScheduleSummary(BaseModel):
+    id: str
+    ad_id: str
+    is_active: bool = True
+    next_republish_at: Optional[datetime] = None
@@ -0,0 +1,20 @@
+from pydantic import BaseModel
+from typing import Dict, Optional
+from datetime import datetime
+
+class ActiveStats(BaseModel):
+    total: int = 0
+    active: int = 0
+
+class AdStats(BaseModel):
+    total: int = 0
+    by_category: Dict[str, int] = {}
+    by_province: Dict[str, int] = {}
+    by_account: Dict[str, int] = {}
+
+# Dashboard statistics, read from the counters kept by stats_service.
+class Stats(BaseModel):
+    accounts: ActiveStats
+    ads: AdStats
+    schedules: ActiveStats
+    reconciled_at: Optional[datetime] = None # Last time the counters were checked against the collections
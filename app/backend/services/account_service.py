@@ -1,28 +1,71 @@
 from motor.motor_asyncio import AsyncIOMotorDatabase
-from typing import List
+from typing import List, Optional, Set, Tuple
 
 from app.backend.models.account import Account, AccountCreate
+from app.backend.services import cache, concurrency, live_events, pagination, projection, stats_service
+
+# Read before a delete or a bulk update, so the statistics and live events can follow the change.
+_TRACKED_FIELDS = {**stats_service.projection("accounts"), **live_events.projection("accounts")}
+
+async def _record_changes(db: AsyncIOMotorDatabase, changes: List[Tuple[Optional[dict], Optional[dict]]]):
+    """Counts and publishes (before, after) pairs of written documents."""
+    await stats_service.record_changes(db, "accounts", changes)
+    await live_events.publish_changes(db, "accounts", changes)
+
+async def _record_change(db: AsyncIOMotorDatabase, before: Optional[dict] = None, after: Optional[dict] = None):
+    await _record_changes(db, [(before, after)])
 
 async def get_account(db: AsyncIOMotorDatabase, account_id: str) -> Account | None:
-    account = await db.accounts.find_one({"id": account_id})
-    if account:
-        return Account(**account)
-    return None
+    async def load() -> Account | None:
+        account = await db.accounts.find_one({"id": account_id})
+        if account:
+            return Account.model_construct(**account)
+        return None
+    return await cache.get_or_load("accounts", account_id, load)
 
 async def get_accounts(db: AsyncIOMotorDatabase, skip: int = 0, limit: int = 100) -> List[Account]:
-    accounts_cursor = db.accounts.find().skip(skip).limit(limit)
-    accounts = await accounts_cursor.to_list(length=limit)
-    return [Account(**account) for account in accounts]
+    accounts, _ = await get_accounts_page(db=db, skip=skip, limit=limit)
+    return accounts
+
+async def get_accounts_page(db: AsyncIOMotorDatabase, limit: int = 100, skip: int = 0, cursor: Optional[str] = None) -> Tuple[List[Account], Optional[str]]:
+    accounts, next_cursor = await pagination.find_page(db.accounts, limit=limit, skip=skip, cursor=cursor)
+    return [Account.model_construct(**account) for account in accounts], next_cursor
+
+async def get_accounts_projected_page(db: AsyncIOMotorDatabase, fields: List[str], limit: int = 100, skip: int = 0, cursor: Optional[str] = None) -> Tuple[List[dict], Optional[str]]:
+    """Like get_accounts_page, but only loads the given fields and returns raw documents."""
+    accounts, next_cursor = await pagination.find_page(db.accounts, limit=limit, skip=skip, cursor=cursor, projection=projection.to_projection(fields))
+    for account in accounts:
+        account.pop("_id", None)
+    return accounts, next_cursor
+
+async def get_existing_account_ids(db: AsyncIOMotorDatabase, account_ids: List[str]) -> Set[str]:
+    """Returns which of the given ids belong to existing accounts, using a single `$in` query."""
+    return set(await db.accounts.distinct("id", {"id": {"$in": list(set(account_ids))}}))
 
 async def create_account(db: AsyncIOMotorDatabase, account: AccountCreate) -> Account:
-    new_account = Account(**account.dict())
-    await db.accounts.insert_one(new_account.dict())
+    new_account = Account(**account.model_dump())
+    document = new_account.model_dump()
+    await db.accounts.insert_one(document)
+    await _record_change(db, after=document)
     return new_account
 
-async def update_account(db: AsyncIOMotorDatabase, account_id: str, account_data: dict) -> bool:
-    result = await db.accounts.update_one({"id": account_id}, {"$set": account_data})
-    return result.modified_count > 0
+async def update_account(db: AsyncIOMotorDatabase, account_id: str, account_data: dict, expected_version: Optional[int] = None) -> Account | None:
+    """
+    Updates the account and returns it as stored after the update, or None if it does not exist.
+    Raises concurrency.VersionConflictError if `expected_version` is stale.
+    """
+    previous, account = await concurrency.update_document_with_previous(db.accounts, account_id, account_data, expected_version=expected_version)
+    await cache.invalidate("accounts", account_id)
+    if account is None:
+        return None
+    await _record_change(db, before=previous, after=account)
+    updated_account = Account(**account)
+    return updated_account
 
 async def delete_account(db: AsyncIOMotorDatabase, account_id: str) -> bool:
-    result = await db.accounts.delete_one({"id": account_id})
-    return result.deleted_count > 0
+    deleted = await db.accounts.find_one_and_delete({"id": account_id}, _TRACKED_FIELDS)
+    await cache.invalidate("accounts", account_id)
+    if deleted is None:
+        return False
+    await _record_change(db, before=deleted)
+    return True
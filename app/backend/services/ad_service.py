@@ -1,28 +1,213 @@
+from datetime import datetime
 from motor.motor_asyncio import AsyncIOMotorDatabase
-from typing import List
+from pymongo import ReturnDocument, UpdateOne
+from pymongo.errors import BulkWriteError
+from typing import Dict, List, Optional, Set, Tuple
 
-from app.backend.models.ad import Ad, AdCreate
+from app.backend.models.ad import Ad, AdCreate, AdBulkUpdate, AdExpanded
+from app.backend.models.bulk import BulkItemResult
+from app.backend.services import account_service, cache, concurrency, expansion, image_service, live_events, pagination, projection, stats_service
+
+# Read before a delete or a bulk update, so the statistics and live events can follow the change.
+_TRACKED_FIELDS = {**stats_service.projection("ads"), **live_events.projection("ads")}
+
+async def _record_changes(db: AsyncIOMotorDatabase, changes: List[Tuple[Optional[dict], Optional[dict]]]):
+    """Counts and publishes (before, after) pairs of written documents."""
+    await stats_service.record_changes(db, "ads", changes)
+    await live_events.publish_changes(db, "ads", changes)
+
+async def _record_change(db: AsyncIOMotorDatabase, before: Optional[dict] = None, after: Optional[dict] = None):
+    await _record_changes(db, [(before, after)])
 
 async def get_ad(db: AsyncIOMotorDatabase, ad_id: str) -> Ad | None:
-    ad = await db.ads.find_one({"id": ad_id})
-    if ad:
-        return Ad(**ad)
-    return None
+    async def load() -> Ad | None:
+        ad = await db.ads.find_one({"id": ad_id})
+        if ad:
+            return Ad.model_construct(**ad)
+        return None
+    return await cache.get_or_load("ads", ad_id, load)
 
 async def get_ads(db: AsyncIOMotorDatabase, skip: int = 0, limit: int = 100) -> List[Ad]:
-    ads_cursor = db.ads.find().skip(skip).limit(limit)
-    ads = await ads_cursor.to_list(length=limit)
-    return [Ad(**ad) for ad in ads]
+    ads, _ = await get_ads_page(db=db, skip=skip, limit=limit)
+    return ads
+
+async def get_ads_page(db: AsyncIOMotorDatabase, limit: int = 100, skip: int = 0, cursor: Optional[str] = None) -> Tuple[List[Ad], Optional[str]]:
+    ads, next_cursor = await pagination.find_page(db.ads, limit=limit, skip=skip, cursor=cursor)
+    # Documents we wrote ourselves: built without validating them again.
+    return [Ad.model_construct(**ad) for ad in ads], next_cursor
+
+async def get_ads_projected_page(db: AsyncIOMotorDatabase, fields: List[str], limit: int = 100, skip: int = 0, cursor: Optional[str] = None) -> Tuple[List[dict], Optional[str]]:
+    """Like get_ads_page, but only loads the given fields and returns raw documents."""
+    ads, next_cursor = await pagination.find_page(db.ads, limit=limit, skip=skip, cursor=cursor, projection=projection.to_projection(fields))
+    for ad in ads:
+        ad.pop("_id", None)
+    return ads, next_cursor
+
+async def get_ad_expanded(db: AsyncIOMotorDatabase, ad_id: str) -> AdExpanded | None:
+    """Returns the ad with its account embedded, read in a single aggregation."""
+    pipeline = [{"$match": {"id": ad_id}}, {"$limit": 1}] + expansion.lookup_one("accounts", "account_id", "account")
+    ads = await db.ads.aggregate(pipeline).to_list(length=1)
+    if ads:
+        return AdExpanded(**ads[0])
+    return None
+
+async def get_ads_expanded_page(db: AsyncIOMotorDatabase, limit: int = 100, skip: int = 0, cursor: Optional[str] = None) -> Tuple[List[AdExpanded], Optional[str]]:
+    """Like get_ads_page, with the accounts of the whole page loaded in one extra query."""
+    ads, next_cursor = await pagination.find_page(db.ads, limit=limit, skip=skip, cursor=cursor)
+    accounts = await expansion.load_by_ids(db.accounts, (ad.get("account_id") for ad in ads))
+    return [AdExpanded(**ad, account=accounts.get(ad.get("account_id"))) for ad in ads], next_cursor
 
 async def create_ad(db: AsyncIOMotorDatabase, ad: AdCreate) -> Ad:
-    new_ad = Ad(**ad.dict())
-    await db.ads.insert_one(new_ad.dict())
+    new_ad = Ad(**ad.model_dump())
+    document = new_ad.model_dump()
+    await db.ads.insert_one(document)
+    await _record_change(db, after=document)
     return new_ad
 
-async def update_ad(db: AsyncIOMotorDatabase, ad_id: str, ad_data: dict) -> bool:
-    result = await db.ads.update_one({"id": ad_id}, {"$set": ad_data})
-    return result.modified_count > 0
+async def update_ad(db: AsyncIOMotorDatabase, ad_id: str, ad_data: dict, expected_version: Optional[int] = None) -> Ad | None:
+    """
+    Updates the ad and returns it as stored after the update, or None if it does not exist.
+    Raises concurrency.VersionConflictError if `expected_version` is stale.
+    """
+    previous, ad = await concurrency.update_document_with_previous(db.ads, ad_id, ad_data, expected_version=expected_version)
+    await cache.invalidate("ads", ad_id)
+    if ad is None:
+        return None
+    await _record_change(db, before=previous, after=ad)
+    updated_ad = Ad(**ad)
+    return updated_ad
+
+async def mark_published(db: AsyncIOMotorDatabase, ad_id: str, published_at: datetime):
+    """Sets `last_published_at`. Not a user edit, so the version is left alone."""
+    ad = await db.ads.find_one_and_update(
+        {"id": ad_id}, {"$set": {"last_published_at": published_at}}, _TRACKED_FIELDS, return_document=ReturnDocument.AFTER,
+    )
+    await cache.invalidate("ads", ad_id)
+    if ad is not None:
+        await _record_change(db, before=ad, after=ad)
+
+async def attach_image(db: AsyncIOMotorDatabase, ad_id: str, sha256: str) -> bool:
+    """Adds the image to the ad's `images`. Returns False if the ad does not exist."""
+    ad = await db.ads.find_one_and_update(
+        {"id": ad_id}, {"$addToSet": {"images": sha256}, "$inc": {"version": 1}}, _TRACKED_FIELDS, return_document=ReturnDocument.AFTER,
+    )
+    await cache.invalidate("ads", ad_id)
+    if ad is None:
+        return False
+    await _record_change(db, before=ad, after=ad)
+    return True
+
+async def detach_image(db: AsyncIOMotorDatabase, ad_id: str, sha256: str) -> bool:
+    """Removes the image from the ad, and from GridFS once no ad uses it. Returns False if the ad did not have it."""
+    ad = await db.ads.find_one_and_update(
+        {"id": ad_id, "images": sha256}, {"$pull": {"images": sha256}, "$inc": {"version": 1}}, _TRACKED_FIELDS, return_document=ReturnDocument.AFTER,
+    )
+    if ad is None:
+        return False
+    await cache.invalidate("ads", ad_id)
+    await _record_change(db, before=ad, after=ad)
+    await image_service.delete_unreferenced(db, [sha256])
+    return True
 
 async def delete_ad(db: AsyncIOMotorDatabase, ad_id: str) -> bool:
-    result = await db.ads.delete_one({"id": ad_id})
-    return result.deleted_count > 0
+    deleted = await db.ads.find_one_and_delete({"id": ad_id}, {"images": 1, **_TRACKED_FIELDS})
+    await cache.invalidate("ads", ad_id)
+    if deleted is None:
+        return False
+    await _record_change(db, before=deleted)
+    await image_service.delete_unreferenced(db, deleted.get("images", []))
+    return True
+
+def _apply_write_errors(error: BulkWriteError, results: List[BulkItemResult], positions: List[int]):
+    # With ordered=False Mongo keeps going after a failed item and reports every
+    # failure by its index in the batch we sent, which we map back to the request.
+    for write_error in error.details.get("writeErrors", []):
+        index = positions[write_error["index"]]
+        results[index] = BulkItemResult(index=index, id=results[index].id, status="error", detail=write_error.get("errmsg"))
+
+async def create_ads(db: AsyncIOMotorDatabase, ads: List[AdCreate]) -> List[BulkItemResult]:
+    existing_accounts = await account_service.get_existing_account_ids(db=db, account_ids=[ad.account_id for ad in ads])
+
+    results = []
+    documents = []
+    positions = []
+    for index, ad in enumerate(ads):
+        if ad.account_id not in existing_accounts:
+            results.append(BulkItemResult(index=index, status="error", detail=f"Account with id {ad.account_id} not found"))
+            continue
+        new_ad = Ad(**ad.model_dump())
+        documents.append(new_ad.model_dump())
+        positions.append(index)
+        results.append(BulkItemResult(index=index, id=new_ad.id, status="created"))
+
+    if documents:
+        try:
+            await db.ads.insert_many(documents, ordered=False)
+        except BulkWriteError as e:
+            _apply_write_errors(e, results, positions)
+        await _record_changes(db, [
+            (None, document) for document, index in zip(documents, positions) if results[index].status == "created"
+        ])
+    return results
+
+async def update_ads(db: AsyncIOMotorDatabase, ads: List[AdBulkUpdate]) -> List[BulkItemResult]:
+    # The counted fields are read along with the ids, so the statistics can follow the changes.
+    previous = {
+        ad["id"]: ad
+        async for ad in db.ads.find({"id": {"$in": list({ad.id for ad in ads})}}, {"_id": 0, "id": 1, **_TRACKED_FIELDS})
+    }
+    existing_ads = set(previous)
+
+    results = []
+    operations = []
+    positions = []
+    changes = []
+    for index, ad in enumerate(ads):
+        update_data = ad.model_dump(exclude_unset=True)
+        update_data.pop("id", None)
+        if ad.id not in existing_ads:
+            results.append(BulkItemResult(index=index, id=ad.id, status="not_found"))
+            continue
+        if not update_data:
+            results.append(BulkItemResult(index=index, id=ad.id, status="error", detail="No update data provided"))
+            continue
+        operations.append(UpdateOne({"id": ad.id}, {"$set": update_data, "$inc": {"version": 1}}))
+        positions.append(index)
+        changes.append((previous[ad.id], {**previous[ad.id], **update_data}))
+        previous[ad.id] = changes[-1][1] # Later items of the same request update from here
+        results.append(BulkItemResult(index=index, id=ad.id, status="updated"))
+
+    if operations:
+        try:
+            await db.ads.bulk_write(operations, ordered=False)
+        except BulkWriteError as e:
+            _apply_write_errors(e, results, positions)
+        await cache.invalidate("ads", *{ads[index].id for index in positions})
+        await _record_changes(db, [change for change, index in zip(changes, positions) if results[index].status == "updated"])
+    return results
+
+async def set_descriptions(db: AsyncIOMotorDatabase, descriptions: Dict[str, str]) -> Set[str]:
+    """Writes the descriptions, keyed by ad id, in one bulk write. Returns the ids of the ads that exist."""
+    previous = await db.ads.find({"id": {"$in": list(descriptions)}}, {"_id": 0, "id": 1, **_TRACKED_FIELDS}).to_list(length=None)
+    existing_ads = {ad["id"] for ad in previous}
+    if existing_ads:
+        await db.ads.bulk_write(
+            [UpdateOne({"id": ad_id}, {"$set": {"description": descriptions[ad_id]}, "$inc": {"version": 1}}) for ad_id in existing_ads],
+            ordered=False,
+        )
+        await cache.invalidate("ads", *existing_ads)
+        await _record_changes(db, [(ad, ad) for ad in previous])
+    return existing_ads
+
+async def delete_ads(db: AsyncIOMotorDatabase, ad_ids: List[str]) -> List[BulkItemResult]:
+    deleted = await db.ads.find({"id": {"$in": list(set(ad_ids))}}, {"_id": 0, "id": 1, "images": 1, **_TRACKED_FIELDS}).to_list(length=None)
+    existing_ads = {ad["id"] for ad in deleted}
+    if existing_ads:
+        await db.ads.delete_many({"id": {"$in": list(existing_ads)}})
+        await cache.invalidate("ads", *existing_ads)
+        await _record_changes(db, [(ad, None) for ad in deleted])
+        await image_service.delete_unreferenced(db, list({image for ad in deleted for image in ad.get("images", [])}))
+    return [
+        BulkItemResult(index=index, id=ad_id, status="deleted" if ad_id in existing_ads else "not_found")
+        for index, ad_id in enumerate(ad_ids)
+    ]
@@ -0,0 +1,145 @@
+import asyncio
+import os
+import uuid
+import logging
+from datetime import datetime
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from typing import AsyncIterator, Collection, List, Optional, Set
+
+from app.backend.models.generation import AdTextBatch, AdTextBatchItem, AdTextBatchResult
+from app.backend.services import ad_service, ai_service, job_queue, job_store
+
+logger = logging.getLogger(__name__)
+
+# Ad text generation for many prompts at once. The prompts of a batch are fanned
+# out to ai_service, at most AI_BATCH_CONCURRENCY at a time, so they share its
+# caches and its per-process limit on LLM calls (AI_MAX_CONCURRENCY). A prompt
+# that takes longer than AI_BATCH_ITEM_TIMEOUT_SECONDS once started is reported
+# as timed out; its generation keeps running and is cached for the next request.
+#
+# Batches are either streamed back to the client or stored in the `ai_batches`
+# collection and run by the job queue:
+#
+#   {"_id": "...", "job_id": "...", "status": "queued" | "running" | "succeeded" | "failed",
+#    "items": [{"prompt": "...", "ad_id": "..."}], "write_to_ads": False, "total": 1,
+#    "results": [...], "written_ad_ids": [...], "created_at": datetime, "finished_at": None}
+#
+# With `write_to_ads`, the generated texts become the descriptions of the items'
+# ads, written in one bulk write once the whole batch is done.
+#
+# A long batch keeps its job claimed, the queue renews the lease while it runs.
+# A retried job keeps the texts already generated and only runs the other items
+# again; every item has at most one result.
+#
+# Configuration:
+#   AI_BATCH_CONCURRENCY            Prompts of one batch generated at once (default 8)
+#   AI_BATCH_ITEM_TIMEOUT_SECONDS   Time a prompt may take once started (default 60)
+#   AI_BATCH_MAX_ITEMS              Prompts accepted in one batch (default 500)
+
+COLLECTION_NAME = "ai_batches"
+RETENTION_SECONDS = 7 * 24 * 3600
+HANDLER_NAME = "generate_ad_texts"
+
+def _concurrency() -> int:
+    return int(os.getenv("AI_BATCH_CONCURRENCY", "8"))
+
+def _item_timeout() -> float:
+    return float(os.getenv("AI_BATCH_ITEM_TIMEOUT_SECONDS", "60"))
+
+def max_items() -> int:
+    return int(os.getenv("AI_BATCH_MAX_ITEMS", "500"))
+
+async def generate(
+    db: Optional[AsyncIOMotorDatabase],
+    items: List[AdTextBatchItem],
+    concurrency: Optional[int] = None,
+    timeout: Optional[float] = None,
+    skip: Collection[int] = (),
+) -> AsyncIterator[AdTextBatchResult]:
+    """Generates the text of every item but the indexes in `skip`, yielding the results in the order they complete."""
+    semaphore = asyncio.Semaphore(concurrency or _concurrency())
+    timeout = timeout or _item_timeout()
+
+    async def generate_one(index: int, item: AdTextBatchItem) -> AdTextBatchResult:
+        async with semaphore:
+            try:
+                text = await asyncio.wait_for(ai_service.generate_ad_text(item.prompt, db=db), timeout)
+            except asyncio.TimeoutError:
+                return AdTextBatchResult(index=index, ad_id=item.ad_id, status="timeout", detail=f"No text after {timeout:g} seconds")
+            except Exception as e:
+                logger.error(f"Generating the text of batch item {index} failed: {e}")
+                return AdTextBatchResult(index=index, ad_id=item.ad_id, status="failed", detail=str(e))
+        return AdTextBatchResult(index=index, ad_id=item.ad_id, status="generated", generated_text=text)
+
+    tasks = [asyncio.create_task(generate_one(index, item)) for index, item in enumerate(items) if index not in skip]
+    try:
+        for completed in asyncio.as_completed(tasks):
+            yield await completed
+    finally:
+        # The consumer went away (e.g. the client disconnected): drop the prompts not started yet.
+        for task in tasks:
+            task.cancel()
+
+async def write_descriptions(db: AsyncIOMotorDatabase, results: List[AdTextBatchResult]) -> Set[str]:
+    """Stores the generated texts as ad descriptions. Returns the ids of the ads written."""
+    descriptions = {result.ad_id: result.generated_text for result in results if result.status == "generated" and result.ad_id}
+    if not descriptions:
+        return set()
+    return await ad_service.set_descriptions(db=db, descriptions=descriptions)
+
+async def create_batch(db: AsyncIOMotorDatabase, items: List[AdTextBatchItem], write_to_ads: bool = False) -> AdTextBatch:
+    """Stores a batch and queues it. Raises job_queue.QueueFullError when the queue is full."""
+    document = {
+        "_id": str(uuid.uuid4()),
+        "job_id": None,
+        "status": "queued",
+        "items": [item.model_dump() for item in items],
+        "write_to_ads": write_to_ads,
+        "total": len(items),
+        "results": [],
+        "written_ad_ids": [],
+        "created_at": datetime.utcnow(),
+        "finished_at": None,
+    }
+    await db[COLLECTION_NAME].insert_one(document)
+    try:
+        job = await job_queue.enqueue(db, HANDLER_NAME, {"batch_id": document["_id"]})
+    except job_queue.QueueFullError:
+        await db[COLLECTION_NAME].delete_one({"_id": document["_id"]})
+        raise
+    document["job_id"] = job.id
+    await db[COLLECTION_NAME].update_one({"_id": document["_id"]}, {"$set": {"job_id": job.id}})
+    return AdTextBatch(id=document.pop("_id"), **document)
+
+async def get_batch(db: AsyncIOMotorDatabase, batch_id: str) -> Optional[AdTextBatch]:
+    document = await db[COLLECTION_NAME].find_one({"_id": batch_id}, {"items": 0})
+    return AdTextBatch(id=document.pop("_id"), **document) if document else None
+
+@job_store.handler(HANDLER_NAME)
+async def run_batch(db: AsyncIOMotorDatabase, batch_id: str):
+    collection = db[COLLECTION_NAME]
+    batch = await collection.find_one({"_id": batch_id})
+    if batch is None:
+        logger.warning(f"Batch {batch_id} no longer exists, nothing to generate.")
+        return
+    # A retried job keeps the texts generated before and runs the failed and missing items again.
+    results = [AdTextBatchResult(**result) for result in batch["results"] if result["status"] == "generated"]
+    await collection.update_one(
+        {"_id": batch_id},
+        {"$set": {"status": "running", "written_ad_ids": []}, "$pull": {"results": {"status": {"$ne": "generated"}}}},
+    )
+    try:
+        done = {result.index for result in results}
+        async for result in generate(db, [AdTextBatchItem(**item) for item in batch["items"]], skip=done):
+            results.append(result)
+            await collection.update_one(
+                {"_id": batch_id, "results.index": {"$ne": result.index}}, {"$push": {"results": result.model_dump()}},
+            )
+        written = await write_descriptions(db, results) if batch["write_to_ads"] else set()
+    except Exception:
+        await collection.update_one({"_id": batch_id}, {"$set": {"status": "failed", "finished_at": datetime.utcnow()}})
+        raise
+    await collection.update_one(
+        {"_id": batch_id},
+        {"$set": {"status": "succeeded", "written_ad_ids": sorted(written), "finished_at": datetime.utcnow()}},
+    )
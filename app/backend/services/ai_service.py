@@ -1,30 +1,322 @@
+import asyncio
+import hashlib
 import os
+import re
+import threading
+import unicodedata
+import logging
+from datetime import datetime
 from dotenv import load_dotenv
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from typing import AsyncIterator, Awaitable, Dict, Iterator, List, Optional, Set
+
+from app.backend.services import cache, metrics
 
 # It's good practice to load .env file at the start of the service
 # that needs it.
 load_dotenv(dotenv_path="app/backend/.env")
 
+logger = logging.getLogger(__name__)
+
 # This service will be responsible for interacting with the LLM
 # to generate ad text.
+#
+# The LLM client is synchronous, so generations run in worker threads and never
+# block the event loop. Results are cached by content: the key is a hash of the
+# model and the normalised prompt. The first tier is an in-process LRU cache
+# (the "ai_text" cache), the second the `ai_generations` collection, shared by
+# all processes. Identical prompts requested while a generation is running
+# wait for that generation instead of starting their own.
+#
+# stream_ad_text() yields the text while the LLM produces it. A streamed
+# generation is in flight like any other: identical prompts, streamed or not,
+# share it. The producing thread stops at the next chunk once every stream of it
+# has gone away, e.g. when the client of a streamed response disconnects;
+# requests still waiting for the whole text then generate it themselves.
+#
+# Configuration:
+#   UNIVERSAL_KEY              LLM API key
+#   AI_MODEL                   Model name, part of the cache key (default "default")
+#   AI_MAX_CONCURRENCY         Generations running at once per process (default 4)
+#   AI_CACHE_MAX_ENTRIES       Size of the in-process cache (default 1000)
+#   AI_CACHE_TTL_SECONDS       Lifetime of in-process entries (default 86400)
 
 # from emergentintegrations.llm.chat import LlmChat, UserMessage
 
-def generate_ad_text(prompt: str) -> str:
-    """
-    Generates ad text based on a prompt.
-    Checks for the UNIVERSAL_KEY in environment variables.
-    """
-    universal_key = os.getenv("UNIVERSAL_KEY")
+CACHE_NAME = "ai_text"
+COLLECTION_NAME = "ai_generations"
+RETENTION_SECONDS = 30 * 24 * 3600
 
+GENERATIONS = metrics.Counter(
+    "ai_generation_requests_total",
+    "Ad text generation requests by how they were served: memory, persistent, coalesced or generated.",
+    ("source",),
+)
+
+_in_flight: Dict[str, asyncio.Task] = {}
+_semaphore: Optional[asyncio.Semaphore] = None
+
+def _model() -> str:
+    return os.getenv("AI_MODEL", "default")
+
+def _universal_key() -> Optional[str]:
+    universal_key = os.getenv("UNIVERSAL_KEY")
     if not universal_key or universal_key == "dummy_key_replace_me":
-        return "Warning: UNIVERSAL_KEY is not configured. Please set it in the .env file. Using placeholder text."
+        return None
+    return universal_key
+
+def _get_semaphore() -> asyncio.Semaphore:
+    global _semaphore
+    if _semaphore is None:
+        _semaphore = asyncio.Semaphore(int(os.getenv("AI_MAX_CONCURRENCY", "4")))
+    return _semaphore
 
+def _get_memory_cache() -> cache.Cache:
+    cache.set_defaults(
+        CACHE_NAME,
+        max_entries=int(os.getenv("AI_CACHE_MAX_ENTRIES", "1000")),
+        ttl_seconds=float(os.getenv("AI_CACHE_TTL_SECONDS", "86400")),
+    )
+    return cache.get_cache(CACHE_NAME)
+
+def normalize_prompt(prompt: str) -> str:
+    """Prompts that only differ in Unicode form or whitespace share a cache entry."""
+    return " ".join(unicodedata.normalize("NFC", prompt).split())
+
+def cache_key(prompt: str, model: str) -> str:
+    return hashlib.sha256(f"{model}\0{normalize_prompt(prompt)}".encode()).hexdigest()
+
+def _generate_sync(prompt: str, model: str, universal_key: str) -> str:
     # In a real implementation, this would call the LLM.
     # For now, it returns a placeholder string that indicates a valid key is present.
 
-    # llm = LlmChat(api_key=universal_key)
+    # llm = LlmChat(api_key=universal_key, model=model)
     # response = llm.get_response([UserMessage(prompt)])
     # return response
 
     return f"This is a generated ad for the prompt: '{prompt}' (simulating a valid API key)"
+
+def _stream_sync(prompt: str, model: str, universal_key: str) -> Iterator[str]:
+    # llm = LlmChat(api_key=universal_key, model=model)
+    # for chunk in llm.stream([UserMessage(prompt)]):
+    #     yield chunk
+
+    yield from re.findall(r"\S+\s*", _generate_sync(prompt, model, universal_key))
+
+async def _load_persistent(db: Optional[AsyncIOMotorDatabase], key: str) -> Optional[str]:
+    if db is None:
+        return None
+    stored = await db[COLLECTION_NAME].find_one({"_id": key}, {"text": 1})
+    if not stored:
+        return None
+    GENERATIONS.inc("persistent")
+    _get_memory_cache().set(key, stored["text"])
+    return stored["text"]
+
+async def _store(db: Optional[AsyncIOMotorDatabase], key: str, prompt: str, model: str, text: str):
+    GENERATIONS.inc("generated")
+    _get_memory_cache().set(key, text)
+    if db is None:
+        return
+    try:
+        await db[COLLECTION_NAME].replace_one(
+            {"_id": key},
+            {"model": model, "prompt": normalize_prompt(prompt), "text": text, "created_at": datetime.utcnow()},
+            upsert=True,
+        )
+    except Exception as e:
+        logger.error(f"Could not persist the generation for {key}: {e}")
+
+async def _generate_and_store(db: Optional[AsyncIOMotorDatabase], key: str, prompt: str, model: str, universal_key: str) -> str:
+    text = await _load_persistent(db, key)
+    if text is not None:
+        return text
+    async with _get_semaphore():
+        text = await asyncio.to_thread(_generate_sync, prompt, model, universal_key)
+    await _store(db, key, prompt, model, text)
+    return text
+
+async def generate_ad_text(prompt: str, db: Optional[AsyncIOMotorDatabase] = None) -> str:
+    """
+    Generates ad text based on a prompt.
+    Checks for the UNIVERSAL_KEY in environment variables.
+    """
+    universal_key = _universal_key()
+    if universal_key is None:
+        return "Warning: UNIVERSAL_KEY is not configured. Please set it in the .env file. Using placeholder text."
+
+    model = _model()
+    key = cache_key(prompt, model)
+    text = _get_memory_cache().get(key)
+    if text is not None:
+        GENERATIONS.inc("memory")
+        return text
+
+    while True:
+        task = _in_flight.get(key)
+        if task is not None:
+            GENERATIONS.inc("coalesced")
+        else:
+            task = _start(key, _generate_and_store(db, key, prompt, model, universal_key))
+        # Shielded, so that a caller going away does not cancel the generation others wait for.
+        text = await asyncio.shield(task)
+        if text is not None:
+            return text
+        # A streamed generation whose clients all went away: generate it ourselves.
+
+def _start(key: str, generation: Awaitable[Optional[str]], broadcast: Optional["_Broadcast"] = None) -> asyncio.Task:
+    """Runs a generation as the one in flight for `key`."""
+    task = asyncio.create_task(generation)
+    _in_flight[key] = task
+    if broadcast is not None:
+        _broadcasts[key] = broadcast
+
+    def done(_):
+        _in_flight.pop(key, None)
+        _broadcasts.pop(key, None)
+    task.add_done_callback(done)
+    return task
+
+class _Broadcast:
+    """The chunks of a streamed generation, sent to every stream of the same text."""
+
+    def __init__(self):
+        self.chunks: List[str] = []
+        self.finished = False
+        self.stop = threading.Event()
+        self._listeners: Set[asyncio.Queue] = set()
+
+    def listen(self) -> asyncio.Queue:
+        """A queue of the chunks so far and the chunks to come, ending with _FINISHED."""
+        queue: asyncio.Queue = asyncio.Queue()
+        for chunk in self.chunks:
+            queue.put_nowait(chunk)
+        if self.finished:
+            queue.put_nowait(_FINISHED)
+        self._listeners.add(queue)
+        return queue
+
+    def leave(self, queue: asyncio.Queue):
+        """Stops the generation once its last stream has gone away."""
+        self._listeners.discard(queue)
+        if not self._listeners and not self.finished:
+            self.stop.set()
+
+    def send(self, chunk: str):
+        self.chunks.append(chunk)
+        for queue in self._listeners:
+            queue.put_nowait(chunk)
+
+    def finish(self):
+        self.finished = True
+        for queue in self._listeners:
+            queue.put_nowait(_FINISHED)
+
+_FINISHED = object()
+_broadcasts: Dict[str, _Broadcast] = {}
+
+async def _stream_and_store(db: Optional[AsyncIOMotorDatabase], key: str, prompt: str, model: str, universal_key: str, broadcast: _Broadcast) -> Optional[str]:
+    """Streams a generation to `broadcast`. Returns the text, or None when it was stopped."""
+    try:
+        text = await _load_persistent(db, key)
+        if text is not None:
+            broadcast.send(text)
+            return text
+
+        loop = asyncio.get_running_loop()
+        chunks: asyncio.Queue = asyncio.Queue()
+        stopped = object()
+
+        def put(item):
+            try:
+                loop.call_soon_threadsafe(chunks.put_nowait, item)
+            except RuntimeError:
+                pass # The loop is closed
+
+        def produce():
+            try:
+                for chunk in _stream_sync(prompt, model, universal_key):
+                    if broadcast.stop.is_set():
+                        put(stopped)
+                        return
+                    put(chunk)
+            except Exception as e:
+                put(e)
+            finally:
+                put(_FINISHED)
+
+        async with _get_semaphore():
+            thread = asyncio.create_task(asyncio.to_thread(produce))
+            try:
+                while (chunk := await chunks.get()) is not _FINISHED:
+                    if chunk is stopped:
+                        return None
+                    if isinstance(chunk, Exception):
+                        raise chunk
+                    broadcast.send(chunk)
+            except BaseException:
+                broadcast.stop.set()
+                raise
+            finally:
+                # The slot is only given back once the thread has returned.
+                await asyncio.wait({thread})
+        text = "".join(broadcast.chunks)
+        await _store(db, key, prompt, model, text)
+        return text
+    finally:
+        broadcast.finish()
+
+async def stream_ad_text(prompt: str, db: Optional[AsyncIOMotorDatabase] = None) -> AsyncIterator[str]:
+    """
+    Yields the ad text chunk by chunk as the LLM produces it. Streams of a text
+    already being streamed receive the same chunks; cached text and text a
+    non-streamed request is generating are yielded in one chunk.
+    """
+    universal_key = _universal_key()
+    if universal_key is None:
+        yield "Warning: UNIVERSAL_KEY is not configured. Please set it in the .env file. Using placeholder text."
+        return
+
+    model = _model()
+    key = cache_key(prompt, model)
+    text = _get_memory_cache().get(key)
+    if text is not None:
+        GENERATIONS.inc("memory")
+        yield text
+        return
+
+    while True:
+        task = _in_flight.get(key)
+        broadcast = _broadcasts.get(key)
+        if task is None:
+            broadcast = _Broadcast()
+            task = _start(key, _stream_and_store(db, key, prompt, model, universal_key, broadcast), broadcast)
+            break
+        if broadcast is not None and broadcast.stop.is_set():
+            # Its streams went away and it is stopping: wait for it to end and start again.
+            await asyncio.wait({task})
+            continue
+        GENERATIONS.inc("coalesced")
+        if broadcast is None:
+            yield await asyncio.shield(task)
+            return
+        break
+
+    chunks = broadcast.listen()
+    try:
+        while (chunk := await chunks.get()) is not _FINISHED:
+            yield chunk
+    finally:
+        broadcast.leave(chunks)
+    await task # Raises the error of a failed generation
+
+def stats() -> dict:
+    """How generation requests were served, and the share answered without calling the LLM."""
+    counts = {source: int(GENERATIONS.get(source)) for source in ("memory", "persistent", "coalesced", "generated")}
+    requests = sum(counts.values())
+    return {
+        "requests": requests,
+        **counts,
+        "hit_rate": (requests - counts["generated"]) / requests if requests else None,
+        "in_flight": len(_in_flight),
+    }
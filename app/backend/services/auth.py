@@ -0,0 +1,17 @@
+import hmac
+import os
+from typing import Optional
+
+# Operator access. Requests prove they come from an operator by sending the
+# ADMIN_TOKEN in an X-Admin-Token header; it guards the /admin endpoints, request
+# profiling and downloads of original images.
+#
+# Configuration:
+#   ADMIN_TOKEN   Token clients must send in X-Admin-Token (unset: operator access is disabled)
+
+def admin_token() -> Optional[str]:
+    return os.getenv("ADMIN_TOKEN") or None
+
+def is_admin(token: Optional[str]) -> bool:
+    expected = admin_token()
+    return bool(expected and token) and hmac.compare_digest(token.encode(), expected.encode())
@@ -0,0 +1,218 @@
+import os
+import time
+import logging
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Hashable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Read-through entity cache used by the service layer. Caches are created lazily
+# by name (e.g. "accounts") so that they pick up the configuration from the
+# environment once the .env file has been loaded.
+#
+# Configuration:
+#   CACHE_BACKEND      "memory" (default) or "none" to disable caching
+#   CACHE_MAX_ENTRIES  Maximum number of entries per cache (default 10000)
+#   CACHE_TTL_SECONDS  Time-to-live of an entry (default 30)
+#
+# A load that an invalidation of its key overtook (the write lands while the
+# loader awaits the database) is returned but not cached, so it cannot outlive
+# the invalidation until its TTL.
+#
+# A cache whose entries never go stale (e.g. results keyed by their content)
+# can be given its own size and TTL with set_defaults() before its first use.
+
+class Cache(ABC):
+    """Interface every cache backend implements."""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.hits = 0
+        self.misses = 0
+
+    @abstractmethod
+    def get(self, key: Hashable) -> Optional[Any]:
+        """The cached value, or None on a miss; counts the hit or miss."""
+
+    @abstractmethod
+    def set(self, key: Hashable, value: Any):
+        ...
+
+    @abstractmethod
+    def delete(self, key: Hashable):
+        ...
+
+    @abstractmethod
+    def clear(self):
+        ...
+
+    @abstractmethod
+    def __len__(self) -> int:
+        ...
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "name": self.name,
+            "backend": type(self).__name__,
+            "size": len(self),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else None,
+        }
+
+class MemoryCache(Cache):
+    """Size-bounded LRU cache whose entries expire after a fixed TTL."""
+
+    def __init__(self, name: str, max_entries: int = 10000, ttl_seconds: float = 30.0):
+        super().__init__(name)
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.evictions = 0
+        self._entries: "OrderedDict[Hashable, tuple]" = OrderedDict()
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        value, expires_at = entry
+        if expires_at <= time.monotonic():
+            del self._entries[key]
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key: Hashable, value: Any):
+        self._entries[key] = (value, time.monotonic() + self.ttl_seconds)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def delete(self, key: Hashable):
+        self._entries.pop(key, None)
+
+    def clear(self):
+        self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def stats(self) -> dict:
+        stats = super().stats()
+        stats.update(max_entries=self.max_entries, ttl_seconds=self.ttl_seconds, evictions=self.evictions)
+        return stats
+
+class NullCache(Cache):
+    """Backend that never stores anything, used when caching is disabled."""
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        self.misses += 1
+        return None
+
+    def set(self, key: Hashable, value: Any):
+        pass
+
+    def delete(self, key: Hashable):
+        pass
+
+    def clear(self):
+        pass
+
+    def __len__(self) -> int:
+        return 0
+
+def _memory_backend(name: str) -> Cache:
+    defaults = _defaults.get(name, {})
+    return MemoryCache(
+        name,
+        max_entries=defaults.get("max_entries") or int(os.getenv("CACHE_MAX_ENTRIES", "10000")),
+        ttl_seconds=defaults.get("ttl_seconds") or float(os.getenv("CACHE_TTL_SECONDS", "30")),
+    )
+
+BACKENDS: Dict[str, Callable[[str], Cache]] = {
+    "memory": _memory_backend,
+    "none": NullCache,
+}
+
+_caches: Dict[str, Cache] = {}
+_defaults: Dict[str, dict] = {}
+_subscribers: List[Callable[[str, List[Hashable]], Awaitable[None]]] = []
+# Per (cache, key) being loaded: [loads in progress, invalidation generation].
+_loading: Dict[tuple, List[int]] = {}
+
+def register_backend(name: str, factory: Callable[[str], Cache]):
+    """Makes a custom backend selectable through CACHE_BACKEND."""
+    BACKENDS[name] = factory
+
+def set_defaults(name: str, max_entries: Optional[int] = None, ttl_seconds: Optional[float] = None):
+    """Size and TTL of the cache `name`, instead of CACHE_MAX_ENTRIES and CACHE_TTL_SECONDS. Only applies before it is created."""
+    _defaults[name] = {"max_entries": max_entries, "ttl_seconds": ttl_seconds}
+
+def get_cache(name: str) -> Cache:
+    cache = _caches.get(name)
+    if cache is None:
+        backend = os.getenv("CACHE_BACKEND", "memory")
+        if backend not in BACKENDS:
+            logger.warning(f"Unknown CACHE_BACKEND '{backend}', caching is disabled.")
+        cache = _caches[name] = BACKENDS.get(backend, NullCache)(name)
+    return cache
+
+async def get_or_load(name: str, key: Hashable, loader: Callable[[], Awaitable[Optional[Any]]]) -> Optional[Any]:
+    """Returns the cached value, or loads and caches it. Missing entities (None) are not cached."""
+    cache = get_cache(name)
+    value = cache.get(key)
+    if value is not None:
+        return value
+    loading = _loading.setdefault((name, key), [0, 0])
+    loading[0] += 1
+    generation = loading[1]
+    try:
+        value = await loader()
+    finally:
+        loading[0] -= 1
+        if not loading[0]:
+            del _loading[(name, key)]
+    # Not cached when the key was invalidated meanwhile: the value may predate the write.
+    if value is not None and loading[1] == generation:
+        cache.set(key, value)
+    return value
+
+def subscribe(callback: Callable[[str, List[Hashable]], Awaitable[None]]):
+    """Registers a callback that is told about every invalidation made by this process."""
+    _subscribers.append(callback)
+
+def unsubscribe(callback: Callable[[str, List[Hashable]], Awaitable[None]]):
+    if callback in _subscribers:
+        _subscribers.remove(callback)
+
+def invalidate_local(name: str, key: Hashable):
+    """Drops an entry without notifying subscribers, e.g. for invalidations received from other nodes."""
+    loading = _loading.get((name, key))
+    if loading is not None:
+        loading[1] += 1
+    if name in _caches:
+        _caches[name].delete(key)
+
+async def invalidate(name: str, *keys: Hashable):
+    """Drops entries from this process' cache and forwards the invalidation to subscribers."""
+    if not keys:
+        return
+    for key in keys:
+        invalidate_local(name, key)
+    for callback in list(_subscribers):
+        try:
+            await callback(name, list(keys))
+        except Exception as e:
+            logger.error(f"Cache invalidation subscriber failed for '{name}': {e}")
+
+def clear_all():
+    for cache in _caches.values():
+        cache.clear()
+
+def stats() -> List[dict]:
+    return [cache.stats() for cache in _caches.values()]
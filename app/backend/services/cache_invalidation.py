@@ -0,0 +1,83 @@
+import asyncio
+import logging
+from datetime import datetime
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo import CursorType
+from pymongo.errors import CollectionInvalid
+from typing import Hashable, List, Optional
+
+from app.backend.services import cache, node
+
+logger = logging.getLogger(__name__)
+
+# Broadcasts cache invalidations between API processes through a capped
+# collection. Every process appends the keys it invalidates and tails the
+# collection for keys invalidated by the others. Capped collections support
+# tailable cursors on a standalone mongod, so no replica set is required.
+
+COLLECTION_NAME = "cache_invalidations"
+COLLECTION_SIZE_BYTES = 1024 * 1024
+RETRY_DELAY_SECONDS = 1.0
+
+_db: Optional[AsyncIOMotorDatabase] = None
+_listener: Optional[asyncio.Task] = None
+
+async def _ensure_collection(db: AsyncIOMotorDatabase):
+    try:
+        await db.create_collection(COLLECTION_NAME, capped=True, size=COLLECTION_SIZE_BYTES)
+    except CollectionInvalid:
+        pass # Already exists
+
+async def publish(name: str, keys: List[Hashable]):
+    if _db is None:
+        return
+    await _db[COLLECTION_NAME].insert_one({"node": node.NODE_ID, "cache": name, "keys": keys, "at": datetime.utcnow()})
+
+async def _listen(db: AsyncIOMotorDatabase):
+    collection = db[COLLECTION_NAME]
+    # Start after the newest entry: older invalidations are irrelevant to a
+    # process whose cache is still empty.
+    latest = await collection.find_one({}, sort=[("$natural", -1)])
+    last_id = latest["_id"] if latest else None
+
+    while True:
+        try:
+            query = {"_id": {"$gt": last_id}} if last_id else {}
+            tail = collection.find(query, cursor_type=CursorType.TAILABLE_AWAIT)
+            while tail.alive:
+                async for message in tail:
+                    last_id = message["_id"]
+                    if message.get("node") == node.NODE_ID: # Published by this process
+                        continue
+                    for key in message.get("keys", []):
+                        cache.invalidate_local(message["cache"], key)
+                # A tailable cursor on an empty collection returns right away.
+                await asyncio.sleep(RETRY_DELAY_SECONDS)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Cache invalidation listener failed, retrying: {e}")
+            await asyncio.sleep(RETRY_DELAY_SECONDS)
+
+async def start(db: AsyncIOMotorDatabase):
+    """Starts broadcasting this process' invalidations and applying the ones from other processes."""
+    global _db, _listener
+    if _listener is not None:
+        return
+    await _ensure_collection(db)
+    _db = db
+    cache.subscribe(publish)
+    _listener = asyncio.create_task(_listen(db))
+    logger.info("Cache invalidation channel started.")
+
+async def stop():
+    global _db, _listener
+    cache.unsubscribe(publish)
+    if _listener is not None:
+        _listener.cancel()
+        try:
+            await _listener
+        except asyncio.CancelledError:
+            pass
+    _db = None
+    _listener = None
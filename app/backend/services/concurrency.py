@@ -0,0 +1,64 @@
+from motor.motor_asyncio import AsyncIOMotorCollection
+from pymongo import ReturnDocument
+from typing import Optional, Tuple
+
+# Every document carries a `version` counter that is incremented on each update.
+# Clients send the version they last read in an `If-Match` header, and the
+# update only applies if nobody changed the document in the meantime.
+# Documents written before versioning existed have no `version`, which counts as 0.
+
+class VersionConflictError(Exception):
+    """Raised when a conditional update finds a different version than expected."""
+
+    def __init__(self, document_id: str, expected_version: int, current_version: int):
+        self.document_id = document_id
+        self.expected_version = expected_version
+        self.current_version = current_version
+        super().__init__(f"Version conflict on {document_id}: expected version {expected_version}, current version is {current_version}")
+
+def parse_if_match(value: Optional[str]) -> Optional[int]:
+    """Reads the expected version from an `If-Match` header such as `"3"` or `W/"3"`."""
+    if value is None or value.strip() == "*":
+        return None
+    value = value.strip()
+    if value.startswith("W/"):
+        value = value[2:]
+    try:
+        return int(value.strip('"'))
+    except ValueError:
+        raise ValueError(f"Invalid If-Match header: {value!r}")
+
+def etag(version: int) -> str:
+    return f'"{version}"'
+
+async def update_document_with_previous(
+    collection: AsyncIOMotorCollection,
+    document_id: str,
+    update_data: dict,
+    expected_version: Optional[int] = None,
+) -> Tuple[Optional[dict], Optional[dict]]:
+    """
+    Applies `update_data` and returns the document both before and after the
+    update in a single round trip: the update only sets fields and bumps the
+    version, so the result is derived from the previous document. Returns
+    (None, None) if there is no document with this id. Raises
+    VersionConflictError if `expected_version` is given and does not match the
+    stored version.
+    """
+    query = {"id": document_id}
+    if expected_version is not None:
+        query["version"] = expected_version if expected_version else {"$in": [0, None]}
+
+    previous = await collection.find_one_and_update(
+        query,
+        {"$set": update_data, "$inc": {"version": 1}},
+        return_document=ReturnDocument.BEFORE,
+    )
+    if previous is None:
+        if expected_version is not None:
+            # Only on the failure path: tell a missing document from a stale version.
+            current = await collection.find_one({"id": document_id}, {"version": 1})
+            if current is not None:
+                raise VersionConflictError(document_id, expected_version, current.get("version") or 0)
+        return None, None
+    return previous, {**previous, **update_data, "version": (previous.get("version") or 0) + 1}
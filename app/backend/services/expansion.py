@@ -0,0 +1,34 @@
+from motor.motor_asyncio import AsyncIOMotorCollection
+from typing import Dict, Iterable, List, Optional, Set
+
+# Helpers for the `expand=` query parameter, which embeds related documents
+# (e.g. a schedule's ad and account) in the response. Single reads join with a
+# `$lookup` pipeline; list pages batch-load the related documents with one
+# `$in` query per relation instead of one query per item.
+
+class InvalidExpandError(ValueError):
+    """Raised when a client asks to expand a relation the resource does not have."""
+
+def parse_expand(expand: Optional[str], allowed: Iterable[str]) -> Set[str]:
+    if not expand:
+        return set()
+    requested = {relation.strip() for relation in expand.split(",") if relation.strip()}
+    unknown = requested - set(allowed)
+    if unknown:
+        raise InvalidExpandError(f"Cannot expand: {', '.join(sorted(unknown))}")
+    return requested
+
+def lookup_one(from_collection: str, local_field: str, as_field: str) -> List[dict]:
+    """Pipeline stages embedding the single document of `from_collection` whose `id` equals `local_field`."""
+    return [
+        {"$lookup": {"from": from_collection, "localField": local_field, "foreignField": "id", "as": as_field}},
+        {"$unwind": {"path": f"${as_field}", "preserveNullAndEmptyArrays": True}},
+    ]
+
+async def load_by_ids(collection: AsyncIOMotorCollection, ids: Iterable[str]) -> Dict[str, dict]:
+    """Loads the documents with the given ids in one query, keyed by id."""
+    unique_ids = list({document_id for document_id in ids if document_id})
+    if not unique_ids:
+        return {}
+    documents = await collection.find({"id": {"$in": unique_ids}}).to_list(length=len(unique_ids))
+    return {document["id"]: document for document in documents}
@@ -0,0 +1,99 @@
+import csv
+import io
+import json
+import zlib
+from datetime import datetime
+from motor.motor_asyncio import AsyncIOMotorCollection
+from typing import AsyncIterator, List, Literal, Optional
+
+ExportFormat = Literal["ndjson", "csv"]
+
+MEDIA_TYPES = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv",
+}
+
+# Rows are grouped into chunks of roughly this size before being sent, so a
+# large export does not turn into one ASGI message per document. The first
+# chunk is always sent on its own so the client gets its first byte right away.
+CHUNK_SIZE = 64 * 1024
+BATCH_SIZE = 1000
+
+def _json_default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return str(value)
+
+async def iter_documents(collection: AsyncIOMotorCollection, query: Optional[dict] = None) -> AsyncIterator[dict]:
+    """Yields documents straight from the Motor cursor, one batch in memory at a time."""
+    async for document in collection.find(query or {}, {"_id": 0}).batch_size(BATCH_SIZE):
+        yield document
+
+async def ndjson_rows(documents: AsyncIterator[dict]) -> AsyncIterator[str]:
+    async for document in documents:
+        yield json.dumps(document, default=_json_default) + "\n"
+
+async def csv_rows(documents: AsyncIterator[dict], fields: List[str]) -> AsyncIterator[str]:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+
+    def render(row: list) -> str:
+        buffer.seek(0)
+        buffer.truncate()
+        writer.writerow(row)
+        return buffer.getvalue()
+
+    yield render(fields)
+    async for document in documents:
+        row = []
+        for field in fields:
+            value = document.get(field)
+            if isinstance(value, (list, dict)):
+                value = json.dumps(value, default=_json_default)
+            elif isinstance(value, datetime):
+                value = value.isoformat()
+            row.append("" if value is None else value)
+        yield render(row)
+
+async def chunked(rows: AsyncIterator[str]) -> AsyncIterator[bytes]:
+    pending = []
+    pending_size = 0
+    first = True
+    async for row in rows:
+        data = row.encode("utf-8")
+        pending.append(data)
+        pending_size += len(data)
+        if first or pending_size >= CHUNK_SIZE:
+            yield b"".join(pending)
+            pending = []
+            pending_size = 0
+            first = False
+    if pending:
+        yield b"".join(pending)
+
+async def gzipped(chunks: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+    compressor = zlib.compressobj(wbits=zlib.MAX_WBITS | 16)
+    async for chunk in chunks:
+        # A sync flush per chunk keeps the stream decodable as it arrives
+        # instead of holding everything back until the compressor fills up.
+        data = compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)
+        if data:
+            yield data
+    yield compressor.flush()
+
+def stream_export(
+    collection: AsyncIOMotorCollection,
+    fields: List[str],
+    format: ExportFormat = "ndjson",
+    query: Optional[dict] = None,
+    gzip: bool = False,
+) -> AsyncIterator[bytes]:
+    """
+    Builds the byte stream for exporting a collection as NDJSON or CSV.
+    Memory use is bounded by the cursor batch and one output chunk, whatever
+    the size of the collection.
+    """
+    documents = iter_documents(collection, query)
+    rows = csv_rows(documents, fields) if format == "csv" else ndjson_rows(documents)
+    chunks = chunked(rows)
+    return gzipped(chunks) if gzip else chunks
@@ -0,0 +1,144 @@
+import asyncio
+import io
+import multiprocessing
+import os
+import warnings
+import logging
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Dict, List, NamedTuple, Optional
+
+try:
+    from PIL import Image, ImageOps
+except ImportError: # Optional: without Pillow images are only served as uploaded
+    Image = None
+
+logger = logging.getLogger(__name__)
+
+# Derives resized, recompressed variants of uploaded images (e.g. a display size
+# and a dashboard thumbnail). Decoding and encoding are CPU-bound, so they run
+# in a pool of worker processes and never hold the event loop or the GIL of
+# the API process. The pool is started on first use and stopped with the app.
+#
+# Variants are re-encoded from the decoded pixels, which drops EXIF, GPS and
+# other metadata; the EXIF orientation is applied first so nothing ends up
+# rotated. Images are only ever scaled down.
+#
+# Configuration:
+#   IMAGE_VARIANTS            name:max_edge pairs; the first is served by default
+#                             (default "display:1600,medium:800,thumb:200")
+#   IMAGE_OUTPUT_FORMAT       Pillow format of the variants (default JPEG)
+#   IMAGE_QUALITY             Encoder quality (default 82)
+#   IMAGE_MAX_PIXELS          Larger images are refused as decompression bombs (default 50000000)
+#   IMAGE_PROCESS_WORKERS     Worker processes (default: one per CPU)
+
+FORMAT_CONTENT_TYPES = {"JPEG": "image/jpeg", "PNG": "image/png", "WEBP": "image/webp"}
+
+class VariantSpec(NamedTuple):
+    name: str
+    max_edge: int
+    format: str
+    quality: int
+
+    @property
+    def key(self) -> str:
+        """Identifies the output, so variants are derived again when the settings change."""
+        return f"{self.name}-{self.max_edge}-{self.format.lower()}-q{self.quality}"
+
+    @property
+    def content_type(self) -> str:
+        return FORMAT_CONTENT_TYPES.get(self.format, "application/octet-stream")
+
+class ImageDecodeError(ValueError):
+    """Raised when an image cannot be decoded, or is too large to decode safely."""
+
+class Variant(NamedTuple):
+    data: bytes
+    width: int
+    height: int
+
+_executor: Optional[ProcessPoolExecutor] = None
+
+def is_available() -> bool:
+    return Image is not None
+
+def variant_specs() -> List[VariantSpec]:
+    output_format = os.getenv("IMAGE_OUTPUT_FORMAT", "JPEG").upper()
+    quality = int(os.getenv("IMAGE_QUALITY", "82"))
+    specs = []
+    for entry in os.getenv("IMAGE_VARIANTS", "display:1600,medium:800,thumb:200").split(","):
+        name, _, size = entry.strip().partition(":")
+        if name and size:
+            specs.append(VariantSpec(name, int(size), output_format, quality))
+    return specs
+
+def _max_pixels() -> int:
+    return int(os.getenv("IMAGE_MAX_PIXELS", "50000000"))
+
+def _worker_count() -> int:
+    return int(os.getenv("IMAGE_PROCESS_WORKERS", "0")) or os.cpu_count() or 1
+
+def derive(data: bytes, specs: List[VariantSpec], max_pixels: int) -> Dict[str, Variant]:
+    """Decodes `data` and encodes every variant. Runs in a worker process."""
+    Image.MAX_IMAGE_PIXELS = max_pixels
+    try:
+        with warnings.catch_warnings():
+            warnings.simplefilter("error", Image.DecompressionBombWarning)
+            with Image.open(io.BytesIO(data)) as source:
+                image = ImageOps.exif_transpose(source)
+                image.load()
+    except (OSError, ValueError, Image.DecompressionBombError, Image.DecompressionBombWarning) as e:
+        raise ImageDecodeError(f"Cannot decode the image: {e}")
+
+    variants = {}
+    for spec in specs:
+        resized = image.copy()
+        resized.thumbnail((spec.max_edge, spec.max_edge), Image.Resampling.LANCZOS)
+        if spec.format == "JPEG" and resized.mode != "RGB":
+            if resized.mode in ("RGBA", "LA", "P"):
+                resized = resized.convert("RGBA")
+                background = Image.new("RGB", resized.size, (255, 255, 255))
+                background.paste(resized, mask=resized.getchannel("A"))
+                resized = background
+            else:
+                resized = resized.convert("RGB")
+        output = io.BytesIO()
+        # No exif/icc arguments: the encoded file carries no metadata.
+        resized.save(output, format=spec.format, quality=spec.quality, optimize=True)
+        variants[spec.name] = Variant(output.getvalue(), resized.width, resized.height)
+    return variants
+
+def _get_executor() -> ProcessPoolExecutor:
+    global _executor
+    if _executor is None:
+        # Spawned rather than forked: the API process runs Motor's threads.
+        workers = _worker_count()
+        _executor = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+        logger.info(f"Started {workers} image processing workers.")
+    return _executor
+
+async def derive_variants(data: bytes, specs: Optional[List[VariantSpec]] = None) -> Dict[str, Variant]:
+    """Derives the variants in the process pool. Raises ImageDecodeError for undecodable images."""
+    if not is_available():
+        raise RuntimeError("Pillow is not installed")
+    loop = asyncio.get_running_loop()
+    executor = _get_executor()
+    try:
+        return await loop.run_in_executor(executor, derive, data, specs or variant_specs(), _max_pixels())
+    except BrokenProcessPool:
+        # A worker died (e.g. killed for its memory); the next call starts a new pool.
+        _discard_executor(executor)
+        raise
+
+def _discard_executor(executor: ProcessPoolExecutor):
+    global _executor
+    if _executor is executor:
+        _executor = None
+    executor.shutdown(wait=False, cancel_futures=True)
+
+async def shutdown_pool():
+    """Stops the worker processes, waiting for them in a thread so the event loop keeps running."""
+    global _executor
+    executor, _executor = _executor, None
+    if executor is not None:
+        await asyncio.to_thread(executor.shutdown, wait=True, cancel_futures=True)
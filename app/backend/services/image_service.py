@@ -0,0 +1,300 @@
+import hashlib
+import os
+import re
+import logging
+from bson import ObjectId
+from gridfs.errors import FileExists
+from motor.motor_asyncio import AsyncIOMotorDatabase, AsyncIOMotorGridFSBucket
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, NamedTuple, Optional, Tuple
+
+from app.backend.services import image_processing
+
+logger = logging.getLogger(__name__)
+
+# Ad images, stored in the `images` GridFS bucket and addressed by the SHA-256
+# of their content. Ads only keep the hashes in `images`, so ad documents, list
+# pages and cache entries stay small, and an image shared by several ads is
+# stored once. Uploads are written to GridFS chunk by chunk while hashing; if
+# the content is already stored the new copy is dropped. The hash is only added
+# to the ad once the image is stored, and a duplicate is only dropped once that
+# reference exists, so a concurrent deletion of the unreferenced copy cannot
+# leave the ad without its image. Downloads are read back chunk by chunk, so no
+# image is ever held in memory as a whole.
+#
+#   images.files: {"_id": ObjectId, "length": 1234, "chunkSize": 261120, "uploadDate": datetime,
+#                  "filename": "...", "metadata": {"sha256": "...", "content_type": "image/jpeg"}}
+#
+# Resized variants without metadata (see image_processing.py) are derived on
+# upload, or on first download after the variant settings changed, and stored
+# in the `image_variants` bucket under "<sha256>:<variant key>", so each one is
+# computed once per content and settings. Images Pillow cannot decode are
+# flagged and only served as uploaded.
+#
+#   image_variants.files: {"_id": "<sha256>:display-1600-jpeg-q82", "length": 1234, ...,
+#                          "metadata": {"source": "<sha256>", "variant": "display",
+#                                       "content_type": "image/jpeg", "width": 1600, "height": 1200}}
+#
+# An image and its variants are deleted once no ad references it any more.
+#
+# Configuration:
+#   IMAGE_MAX_BYTES   Largest accepted upload (default 10485760)
+
+BUCKET_NAME = "images"
+FILES_COLLECTION = f"{BUCKET_NAME}.files"
+CHUNKS_COLLECTION = f"{BUCKET_NAME}.chunks"
+VARIANTS_BUCKET_NAME = "image_variants"
+VARIANTS_FILES_COLLECTION = f"{VARIANTS_BUCKET_NAME}.files"
+ORIGINAL = "original"
+DOWNLOAD_CHUNK_BYTES = 256 * 1024
+
+_SHA256 = re.compile(r"^[0-9a-f]{64}$")
+
+class ImageTooLargeError(ValueError):
+    """Raised when an upload exceeds IMAGE_MAX_BYTES."""
+
+class EmptyImageError(ValueError):
+    """Raised when an upload has no content."""
+
+class InvalidRangeError(ValueError):
+    """Raised when a Range header cannot be satisfied for the image."""
+
+class UnknownVariantError(ValueError):
+    """Raised when a variant is requested that is not configured."""
+
+class OriginalNotAllowedError(PermissionError):
+    """Raised when the original of an image, with its metadata, is requested without admin rights."""
+
+class Download(NamedTuple):
+    """A stored file to send: an original or one of its variants."""
+    bucket_name: str
+    file_id: Any
+    content_type: str
+    length: int
+    etag: str
+
+def max_bytes() -> int:
+    return int(os.getenv("IMAGE_MAX_BYTES", str(10 * 1024 * 1024)))
+
+def is_image_hash(value: str) -> bool:
+    return bool(_SHA256.match(value))
+
+def _bucket(db: AsyncIOMotorDatabase, name: str = BUCKET_NAME) -> AsyncIOMotorGridFSBucket:
+    return AsyncIOMotorGridFSBucket(db, bucket_name=name)
+
+def _describe(document: dict) -> dict:
+    return {"sha256": document["metadata"]["sha256"], "content_type": document["metadata"]["content_type"], "length": document["length"], "uploaded_at": document["uploadDate"]}
+
+async def store_image(
+    db: AsyncIOMotorDatabase,
+    chunks: AsyncIterator[bytes],
+    content_type: str,
+    filename: str = "",
+    reference: Optional[Callable[[str], Awaitable[bool]]] = None,
+) -> Optional[Tuple[dict, bool]]:
+    """
+    Streams `chunks` into GridFS. Returns the stored image and whether it is new,
+    i.e. False when the same content was already stored.
+
+    `reference` is called with the hash to add it to an ad once the image is
+    stored, or found already stored, so an ad never points to an upload that
+    failed. A duplicate upload is only dropped after the reference is added,
+    and is stored after all if the copy it matched was deleted as unreferenced
+    in between. When `reference` returns False nothing new is kept and None is
+    returned.
+
+    Raises ImageTooLargeError beyond IMAGE_MAX_BYTES and EmptyImageError without
+    content; nothing is kept then.
+    """
+    limit = max_bytes()
+    file_id = ObjectId()
+    upload = _bucket(db).open_upload_stream_with_id(file_id, filename or str(file_id))
+    digest = hashlib.sha256()
+    length = 0
+    try:
+        async for chunk in chunks:
+            length += len(chunk)
+            if length > limit:
+                raise ImageTooLargeError(f"Images are limited to {limit} bytes")
+            digest.update(chunk)
+            await upload.write(chunk)
+        if not length:
+            raise EmptyImageError("The upload is empty")
+    except BaseException:
+        await upload.abort()
+        raise
+
+    sha256 = digest.hexdigest()
+    referenced = False
+    existing = await db[FILES_COLLECTION].find_one({"metadata.sha256": sha256})
+    if existing:
+        if reference is not None:
+            if not await reference(sha256):
+                await upload.abort()
+                return None
+            referenced = True
+            # Our copy is only dropped if the stored one was not deleted as unreferenced meanwhile.
+            existing = await db[FILES_COLLECTION].find_one({"metadata.sha256": sha256})
+        if existing:
+            await upload.abort()
+            return _describe(existing), False
+
+    await upload.set("metadata", {"sha256": sha256, "content_type": content_type})
+    try:
+        await upload.close()
+    except Exception:
+        # Most likely the same content uploaded concurrently won the unique index.
+        await db[CHUNKS_COLLECTION].delete_many({"files_id": file_id})
+        existing = await db[FILES_COLLECTION].find_one({"metadata.sha256": sha256})
+        if existing is None:
+            raise
+        if reference is not None and not referenced and not await reference(sha256):
+            return None
+        return _describe(existing), False
+    if reference is not None and not referenced and not await reference(sha256):
+        await _bucket(db).delete(file_id)
+        return None
+    return _describe(await db[FILES_COLLECTION].find_one({"_id": file_id})), True
+
+async def get_images(db: AsyncIOMotorDatabase, hashes: List[str]) -> List[dict]:
+    """The stored images among `hashes`, in the same order."""
+    documents = await db[FILES_COLLECTION].find({"metadata.sha256": {"$in": hashes}}).to_list(length=len(hashes))
+    by_hash = {document["metadata"]["sha256"]: _describe(document) for document in documents}
+    return [by_hash[sha256] for sha256 in hashes if sha256 in by_hash]
+
+def parse_range(header: Optional[str], length: int) -> Optional[Tuple[int, int]]:
+    """
+    The inclusive byte range requested by a `Range` header, or None for the whole
+    image. Only single ranges are honoured; anything else is served in full.
+    """
+    if not header or not header.startswith("bytes=") or "," in header:
+        return None
+    start, _, end = header[len("bytes="):].strip().partition("-")
+    try:
+        if start:
+            first, last = int(start), int(end) if end else length - 1
+        elif end:
+            first, last = max(length - int(end), 0), length - 1 # Suffix range: the last N bytes
+        else:
+            return None
+    except ValueError:
+        return None
+    if first >= length or first > last:
+        raise InvalidRangeError(f"Range not satisfiable: {header}")
+    return first, min(last, length - 1)
+
+def _variant_id(sha256: str, spec: image_processing.VariantSpec) -> str:
+    return f"{sha256}:{spec.key}"
+
+def _describe_variant(document: dict) -> dict:
+    metadata = document["metadata"]
+    return {"variant": metadata["variant"], "content_type": metadata["content_type"], "length": document["length"], "width": metadata["width"], "height": metadata["height"]}
+
+async def get_variants(db: AsyncIOMotorDatabase, hashes: List[str]) -> Dict[str, Dict[str, dict]]:
+    """The stored variants of each image for the current settings, keyed by hash and variant name."""
+    ids = [_variant_id(sha256, spec) for sha256 in hashes for spec in image_processing.variant_specs()]
+    variants: Dict[str, Dict[str, dict]] = {}
+    async for document in db[VARIANTS_FILES_COLLECTION].find({"_id": {"$in": ids}}):
+        variants.setdefault(document["metadata"]["source"], {})[document["metadata"]["variant"]] = _describe_variant(document)
+    return variants
+
+async def ensure_variants(db: AsyncIOMotorDatabase, sha256: str) -> Dict[str, dict]:
+    """
+    The variants of the image for the current settings, derived in the process
+    pool and stored first if missing. Empty if the image cannot be decoded or
+    Pillow is not installed; missing the ones that failed to be derived.
+    """
+    if not image_processing.is_available():
+        return {}
+    variants = (await get_variants(db, [sha256])).get(sha256, {})
+    missing = [spec for spec in image_processing.variant_specs() if spec.name not in variants]
+    if not missing:
+        return variants
+    original = await db[FILES_COLLECTION].find_one({"metadata.sha256": sha256})
+    if original is None or original["metadata"].get("undecodable"):
+        return variants
+
+    data = await (await _bucket(db).open_download_stream(original["_id"])).read()
+    try:
+        derived = await image_processing.derive_variants(data, missing)
+    except image_processing.ImageDecodeError as e:
+        logger.warning(f"Image {sha256} is served without variants: {e}")
+        await db[FILES_COLLECTION].update_one({"_id": original["_id"]}, {"$set": {"metadata.undecodable": True}})
+        return variants
+    except Exception as e:
+        # E.g. a worker process died: the variants are derived again on the next download.
+        logger.error(f"Deriving the variants of image {sha256} failed: {e}")
+        return variants
+
+    bucket = _bucket(db, VARIANTS_BUCKET_NAME)
+    for spec in missing:
+        variant = derived[spec.name]
+        file_id = _variant_id(sha256, spec)
+        try:
+            await bucket.upload_from_stream_with_id(file_id, file_id, variant.data, metadata={
+                "source": sha256, "variant": spec.name, "content_type": spec.content_type, "width": variant.width, "height": variant.height,
+            })
+        except FileExists:
+            pass # Derived concurrently by another request
+    return (await get_variants(db, [sha256])).get(sha256, {})
+
+async def get_download(db: AsyncIOMotorDatabase, sha256: str, variant: Optional[str] = None, include_original: bool = False) -> Optional[Download]:
+    """
+    The file to send for `variant` of the image: a configured variant name,
+    "original", or None for the first configured variant.
+
+    Originals keep their metadata (EXIF, GPS), so they are only sent with
+    `include_original`. Otherwise the default falls back to the original only
+    when the image cannot have variants: Pillow is not installed, no variants
+    are configured, or Pillow cannot decode it.
+    Raises UnknownVariantError for other names and OriginalNotAllowedError for
+    "original" without `include_original`.
+    """
+    specs = {spec.name: spec for spec in image_processing.variant_specs()}
+    if variant not in (None, ORIGINAL) and variant not in specs:
+        raise UnknownVariantError(f"Unknown image variant: {variant}")
+    if variant == ORIGINAL and not include_original:
+        raise OriginalNotAllowedError("The original of an image is only sent to admins")
+    if variant != ORIGINAL and specs:
+        name = variant or next(iter(specs))
+        variants = await ensure_variants(db, sha256)
+        if name in variants:
+            file_id = _variant_id(sha256, specs[name])
+            return Download(VARIANTS_BUCKET_NAME, file_id, variants[name]["content_type"], variants[name]["length"], f'"{file_id}"')
+        if variant is not None:
+            return None
+    original = await db[FILES_COLLECTION].find_one({"metadata.sha256": sha256}, {"_id": 1, "length": 1, "metadata": 1})
+    if original is None:
+        return None
+    if not include_original and specs and image_processing.is_available() and not original["metadata"].get("undecodable"):
+        return None # Its variants could not be derived this time
+    return Download(BUCKET_NAME, original["_id"], original["metadata"]["content_type"], original["length"], f'"{sha256}"')
+
+async def stream_download(db: AsyncIOMotorDatabase, download: Download, start: int = 0, end: Optional[int] = None) -> AsyncIterator[bytes]:
+    """Yields the bytes from `start` to `end` (inclusive) of the file, chunk by chunk."""
+    stream = await _bucket(db, download.bucket_name).open_download_stream(download.file_id)
+    remaining = (download.length - 1 if end is None else end) - start + 1
+    if start:
+        stream.seek(start)
+    while remaining > 0:
+        data = await stream.read(min(DOWNLOAD_CHUNK_BYTES, remaining))
+        if not data:
+            break
+        remaining -= len(data)
+        yield data
+
+async def delete_unreferenced(db: AsyncIOMotorDatabase, hashes: List[str]):
+    """Deletes the images among `hashes` that no ad references any more."""
+    hashes = [value for value in set(hashes) if is_image_hash(value)]
+    if not hashes:
+        return
+    referenced = set(await db.ads.distinct("images", {"images": {"$in": hashes}}))
+    unreferenced = [value for value in hashes if value not in referenced]
+    bucket, variants_bucket = _bucket(db), _bucket(db, VARIANTS_BUCKET_NAME)
+    async for document in db[FILES_COLLECTION].find({"metadata.sha256": {"$in": unreferenced}}, {"_id": 1, "metadata.sha256": 1}):
+        # Checked again right before deleting, to narrow the window for an upload referencing it meanwhile.
+        if await db.ads.find_one({"images": document["metadata"]["sha256"]}, {"_id": 1}):
+            unreferenced.remove(document["metadata"]["sha256"])
+            continue
+        await bucket.delete(document["_id"])
+    async for document in db[VARIANTS_FILES_COLLECTION].find({"metadata.source": {"$in": unreferenced}}, {"_id": 1}):
+        await variants_bucket.delete(document["_id"])
@@ -0,0 +1,196 @@
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo import ASCENDING, DESCENDING, TEXT, IndexModel
+from pymongo.errors import OperationFailure
+from typing import Dict, List
+import logging
+
+from app.backend.services import ai_batch_service, ai_service, image_service, job_runs, profiling
+
+logger = logging.getLogger(__name__)
+
+# Every index the application relies on, per collection. ensure_indexes() creates
+# what is missing from this declaration, so new indexes only need to be added
+# here; changed definitions are rebuilt through POST /admin/indexes/sync.
+INDEXES: Dict[str, List[IndexModel]] = {
+    "accounts": [
+        IndexModel([("id", ASCENDING)], name="id_unique", unique=True),
+    ],
+    "ads": [
+        IndexModel([("id", ASCENDING)], name="id_unique", unique=True),
+        # Also serves the search filtered by account, newest first.
+        IndexModel([("account_id", ASCENDING), ("_id", DESCENDING)], name="account_id"),
+        # Finds whether any ad still references an image before it is deleted.
+        IndexModel([("images", ASCENDING)], name="images"),
+        # Search (see search_service.py): relevance over title and description,
+        # equality filters followed by the price range, and equality filters
+        # followed by `_id` for filter-only searches sorted newest first.
+        IndexModel([("title", TEXT), ("description", TEXT)], name="search_text", weights={"title": 3, "description": 1}, default_language="spanish"),
+        IndexModel([("category", ASCENDING), ("subcategory", ASCENDING), ("price", ASCENDING)], name="category_price"),
+        IndexModel([("province", ASCENDING), ("zone", ASCENDING), ("price", ASCENDING)], name="province_price"),
+        IndexModel([("category", ASCENDING), ("subcategory", ASCENDING), ("_id", DESCENDING)], name="category_newest"),
+        IndexModel([("province", ASCENDING), ("zone", ASCENDING), ("_id", DESCENDING)], name="province_newest"),
+    ],
+    "schedules": [
+        IndexModel([("id", ASCENDING)], name="id_unique", unique=True),
+        IndexModel([("ad_id", ASCENDING)], name="ad_id"),
+        IndexModel([("next_republish_at", ASCENDING)], name="next_republish_at"),
+        # Serves the scheduler's due-schedule query: is_active = true AND next_republish_at <= now.
+        IndexModel([("is_active", ASCENDING), ("next_republish_at", ASCENDING)], name="due_schedules"),
+    ],
+    "scheduled_jobs": [
+        IndexModel([("next_run_at", ASCENDING)], name="next_run_at"),
+    ],
+    "jobs": [
+        # Serves the queue's pending count and the workers' oldest-first claim.
+        IndexModel([("status", ASCENDING), ("created_at", ASCENDING)], name="pending"),
+        # Finished jobs are kept a week for status lookups; queued and running jobs have no finished_at.
+        IndexModel([("finished_at", ASCENDING)], name="finished_at_ttl", expireAfterSeconds=7 * 24 * 3600),
+    ],
+    "job_runs": [
+        IndexModel([("started_at", ASCENDING)], name="started_at_ttl", expireAfterSeconds=job_runs.RETENTION_SECONDS),
+        IndexModel([("schedule_id", ASCENDING), ("started_at", ASCENDING)], name="schedule_runs"),
+        IndexModel([("account_id", ASCENDING), ("started_at", ASCENDING)], name="account_runs"),
+    ],
+    "ai_generations": [
+        IndexModel([("created_at", ASCENDING)], name="created_at_ttl", expireAfterSeconds=ai_service.RETENTION_SECONDS),
+    ],
+    "ai_batches": [
+        IndexModel([("created_at", ASCENDING)], name="created_at_ttl", expireAfterSeconds=ai_batch_service.RETENTION_SECONDS),
+    ],
+    image_service.FILES_COLLECTION: [
+        IndexModel([("metadata.sha256", ASCENDING)], name="sha256_unique", unique=True),
+    ],
+    image_service.VARIANTS_FILES_COLLECTION: [
+        IndexModel([("metadata.source", ASCENDING)], name="source"),
+    ],
+    "profiles": [
+        IndexModel([("created_at", ASCENDING)], name="created_at_ttl", expireAfterSeconds=profiling.RETENTION_SECONDS),
+    ],
+}
+
+# Index options that change the behaviour of an index. If any of them differ
+# from the declaration the index has to be rebuilt.
+_COMPARED_OPTIONS = ("unique", "sparse", "expireAfterSeconds", "partialFilterExpression")
+
+def _index_key(index: dict) -> list:
+    return [tuple(item) for item in (index["key"].items() if hasattr(index["key"], "items") else index["key"])]
+
+# The server reports a text index under the keys `_fts` and `_ftsx` and lists
+# its fields in `weights`, while the declaration lists them in the key.
+_TEXT_INDEX_KEYS = ("_fts", "_ftsx")
+
+def _plain_key(index: dict) -> list:
+    return [(field, kind) for field, kind in _index_key(index) if kind != "text" and field not in _TEXT_INDEX_KEYS]
+
+def _text_weights(index: dict) -> Dict[str, int]:
+    fields = {field: 1 for field, kind in _index_key(index) if kind == "text" and field not in _TEXT_INDEX_KEYS}
+    return {**fields, **index.get("weights", {})}
+
+def _matches(declared: dict, existing: dict) -> bool:
+    if _plain_key(declared) != _plain_key(existing) or set(_text_weights(declared)) != set(_text_weights(existing)):
+        return False
+    # Weights and language are compared when the server reports them (mongomock does not).
+    if "weights" in existing and _text_weights(declared) != _text_weights(existing):
+        return False
+    if "default_language" in existing and declared.get("default_language", "english") != existing["default_language"]:
+        return False
+    return all(declared.get(option) == existing.get(option) for option in _COMPARED_OPTIONS)
+
+# IndexNotFound, IndexOptionsConflict and IndexKeySpecsConflict: another process
+# dropped or created the same index first.
+_RACE_CODES = {27, 85, 86}
+
+async def _create(collection, index: IndexModel) -> bool:
+    """Creates an index. Returns False when another process created it differently first."""
+    try:
+        await collection.create_indexes([index])
+    except OperationFailure as e:
+        if e.code not in _RACE_CODES:
+            raise
+        return False
+    return True
+
+async def ensure_indexes(db: AsyncIOMotorDatabase, rebuild: bool = False) -> Dict[str, Dict[str, List[str]]]:
+    """
+    Creates the declared indexes that are missing. Indexes whose definition
+    changed are reported as `mismatched`, and only dropped and rebuilt with
+    `rebuild=True` (POST /admin/indexes/sync): every worker runs this at startup,
+    and concurrent rebuilds would leave queries without the index meanwhile.
+    Indexes that already match are left alone and indexes that are not declared
+    here are never dropped.
+    """
+    report = {}
+    for collection_name, indexes in INDEXES.items():
+        collection = db[collection_name]
+        existing = await collection.index_information()
+        result = {"created": [], "rebuilt": [], "mismatched": [], "unchanged": []}
+
+        for index in indexes:
+            declared = index.document
+            name = declared["name"]
+            if name in existing:
+                if _matches(declared, existing[name]):
+                    result["unchanged"].append(name)
+                    continue
+                if not rebuild:
+                    logger.warning(f"Index {collection_name}.{name} does not match its declaration; rebuild it with POST /admin/indexes/sync.")
+                    result["mismatched"].append(name)
+                    continue
+                logger.warning(f"Index {collection_name}.{name} does not match its declaration, rebuilding it.")
+                try:
+                    await collection.drop_index(name)
+                except OperationFailure as e:
+                    if e.code not in _RACE_CODES:
+                        raise
+                result["rebuilt" if await _create(collection, index) else "mismatched"].append(name)
+            else:
+                result["created" if await _create(collection, index) else "mismatched"].append(name)
+
+        if result["created"] or result["rebuilt"]:
+            logger.info(f"Indexes on {collection_name}: created {result['created']}, rebuilt {result['rebuilt']}.")
+        report[collection_name] = result
+    return report
+
+async def get_index_report(db: AsyncIOMotorDatabase) -> dict:
+    """
+    Lists the indexes of every collection with their usage counters, the declared
+    indexes that are missing, and the collections that only have the `_id` index.
+    Usage counters come from `$indexStats` and are None when the server does not
+    support it.
+    """
+    collections = []
+    unindexed = []
+    for collection_name in sorted(await db.list_collection_names()):
+        if collection_name.startswith("system."):
+            continue
+        collection = db[collection_name]
+        existing = await collection.index_information()
+
+        usage = None
+        try:
+            stats = await collection.aggregate([{"$indexStats": {}}]).to_list(length=None)
+            usage = {stat["name"]: stat.get("accesses", {}) for stat in stats}
+        except (OperationFailure, NotImplementedError):
+            pass
+
+        indexes = []
+        for name, info in existing.items():
+            accesses = usage.get(name) if usage is not None else None
+            indexes.append({
+                "name": name,
+                "key": [list(item) for item in _index_key(info)],
+                "unique": info.get("unique", False),
+                "ops": accesses.get("ops") if accesses else None,
+                "since": accesses.get("since") if accesses else None,
+            })
+
+        declared = [index.document["name"] for index in INDEXES.get(collection_name, [])]
+        if list(existing) == ["_id_"]:
+            unindexed.append(collection_name)
+        collections.append({
+            "name": collection_name,
+            "indexes": indexes,
+            "missing_declared": [name for name in declared if name not in existing],
+        })
+
+    return {"collections": collections, "collections_without_indexes": unindexed}
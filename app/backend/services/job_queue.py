@@ -0,0 +1,204 @@
+import asyncio
+import os
+import uuid
+import logging
+from datetime import datetime, timedelta
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo import ASCENDING, ReturnDocument
+from typing import List, Optional
+
+from app.backend.models.job import Job
+from app.backend.services import job_store, node
+
+logger = logging.getLogger(__name__)
+
+# Persistent queue for work that should run now but outside the request, e.g.
+# publishing an ad. Jobs are stored in the `jobs` collection and run by a fixed
+# pool of worker tasks in every API process, using the handlers registered with
+# job_store.handler(). Enqueueing is one count and one insert, so requests stay
+# fast however much work is queued, and is refused once too much is pending.
+#
+#   {"_id": "...", "handler": "publish_ad", "kwargs": {"ad_id": "..."},
+#    "status": "queued" | "running" | "succeeded" | "failed", "attempts": 0,
+#    "error": None, "worker": None, "created_at": datetime, "started_at": None,
+#    "finished_at": None, "lease_expires_at": None}
+#
+# A worker claims a job by moving it from queued to running, with a lease of
+# JOB_TIMEOUT_SECONDS that it renews every third of that time while the handler
+# runs, so a long job is never taken from a live worker. Every claim increments
+# `attempts`, which identifies the claim: renewals and the final status only
+# apply while the job is still running under the same attempt. A worker that
+# finds its claim gone (its lease expired while it could not renew it, and the
+# job was claimed again or failed) cancels its handler.
+#
+# A running job whose lease has expired was abandoned by a worker that died and
+# is queued again, up to JOB_MAX_ATTEMPTS attempts in total.
+#
+# Configuration:
+#   JOB_WORKERS               Worker tasks per process (default 4)
+#   JOB_QUEUE_MAX_PENDING     Queued and running jobs above which enqueueing is refused (default 100)
+#   JOB_TIMEOUT_SECONDS       Time without a lease renewal after which a job counts as abandoned (default 600)
+#   JOB_MAX_ATTEMPTS          Attempts before an abandoned job is marked failed (default 3)
+#   JOB_QUEUE_POLL_SECONDS    Longest time an idle worker waits before looking again (default 5)
+
+COLLECTION_NAME = "jobs"
+
+_workers: List[asyncio.Task] = []
+_wakeup = asyncio.Event()
+
+class QueueFullError(ValueError):
+    """Raised when a job is enqueued while the queue already holds the maximum number of pending jobs."""
+
+def _worker_count() -> int:
+    return int(os.getenv("JOB_WORKERS", "4"))
+
+def _max_pending() -> int:
+    return int(os.getenv("JOB_QUEUE_MAX_PENDING", "100"))
+
+def _timeout_seconds() -> float:
+    return float(os.getenv("JOB_TIMEOUT_SECONDS", "600"))
+
+def _max_attempts() -> int:
+    return int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+
+def _poll_seconds() -> float:
+    return float(os.getenv("JOB_QUEUE_POLL_SECONDS", "5"))
+
+def _to_job(document: dict) -> Job:
+    return Job(id=document.pop("_id"), **document)
+
+async def enqueue(db: AsyncIOMotorDatabase, handler: str, kwargs: dict) -> Job:
+    """Stores a job for the worker pool. Raises QueueFullError when too many jobs are pending."""
+    if job_store.get_handler(handler) is None:
+        raise ValueError(f"Unknown job handler: {handler}")
+    pending = await db[COLLECTION_NAME].count_documents({"status": {"$in": ["queued", "running"]}})
+    if pending >= _max_pending():
+        raise QueueFullError(f"The job queue is full ({pending} jobs pending), try again later")
+
+    document = {
+        "_id": str(uuid.uuid4()),
+        "handler": handler,
+        "kwargs": kwargs,
+        "status": "queued",
+        "attempts": 0,
+        "error": None,
+        "worker": None,
+        "created_at": datetime.utcnow(),
+        "started_at": None,
+        "finished_at": None,
+        "lease_expires_at": None,
+    }
+    await db[COLLECTION_NAME].insert_one(document)
+    _wakeup.set()
+    return _to_job(document)
+
+async def get_job(db: AsyncIOMotorDatabase, job_id: str) -> Optional[Job]:
+    document = await db[COLLECTION_NAME].find_one({"_id": job_id})
+    return _to_job(document) if document else None
+
+async def _fail_exhausted(db: AsyncIOMotorDatabase, now: datetime):
+    await db[COLLECTION_NAME].update_many(
+        {"status": "running", "lease_expires_at": {"$lte": now}, "attempts": {"$gte": _max_attempts()}},
+        {"$set": {"status": "failed", "error": "Abandoned by its worker too many times", "finished_at": now}},
+    )
+
+async def claim_next(db: AsyncIOMotorDatabase, worker: str) -> Optional[dict]:
+    """Atomically takes the oldest queued (or abandoned) job for `worker`."""
+    now = datetime.utcnow()
+    await _fail_exhausted(db, now)
+    return await db[COLLECTION_NAME].find_one_and_update(
+        {"$or": [
+            {"status": "queued"},
+            {"status": "running", "lease_expires_at": {"$lte": now}, "attempts": {"$lt": _max_attempts()}},
+        ]},
+        {
+            "$set": {"status": "running", "worker": worker, "started_at": now, "lease_expires_at": now + timedelta(seconds=_timeout_seconds())},
+            "$inc": {"attempts": 1},
+        },
+        sort=[("created_at", ASCENDING)],
+        return_document=ReturnDocument.AFTER,
+    )
+
+def _claim_of(job: dict) -> dict:
+    """Matches the job only while it is still running under the claim `job` was read with."""
+    return {"_id": job["_id"], "status": "running", "attempts": job["attempts"]}
+
+async def renew_lease(db: AsyncIOMotorDatabase, job: dict) -> bool:
+    """Extends the lease of a claimed job. Returns False when the claim has been lost."""
+    result = await db[COLLECTION_NAME].update_one(
+        _claim_of(job), {"$set": {"lease_expires_at": datetime.utcnow() + timedelta(seconds=_timeout_seconds())}},
+    )
+    return result.matched_count > 0
+
+async def _keep_lease(db: AsyncIOMotorDatabase, job: dict, run: asyncio.Task, lost: asyncio.Event):
+    while True:
+        await asyncio.sleep(_timeout_seconds() / 3)
+        try:
+            held = await renew_lease(db, job)
+        except Exception as e:
+            # The lease still runs for two more renewals; only a lost claim stops the handler.
+            logger.warning(f"Could not renew the lease of job {job['_id']}: {e}")
+            continue
+        if not held:
+            logger.error(f"Job {job['_id']} ({job['handler']}) lost its lease, cancelling it.")
+            lost.set()
+            run.cancel()
+            return
+
+async def run_next(db: AsyncIOMotorDatabase, worker: str = node.NODE_ID) -> Optional[str]:
+    """Claims and runs one job. Returns its id, or None when nothing was queued."""
+    job = await claim_next(db, worker)
+    if job is None:
+        return None
+
+    status, error = "succeeded", None
+    lost = asyncio.Event()
+    run = asyncio.create_task(job_store.run_job(db, job, kind="queue"))
+    heartbeat = asyncio.create_task(_keep_lease(db, job, run, lost))
+    try:
+        await run
+    except asyncio.CancelledError:
+        if not lost.is_set():
+            # Shutting down: leave the job running so it is picked up again once its lease expires.
+            raise
+        # Another worker owns the job now and records its outcome.
+        return job["_id"]
+    except Exception as e:
+        logger.error(f"Job {job['_id']} ({job['handler']}) failed: {e}")
+        status, error = "failed", f"{type(e).__name__}: {e}"
+    finally:
+        heartbeat.cancel()
+        await asyncio.gather(heartbeat, return_exceptions=True)
+    await db[COLLECTION_NAME].update_one(
+        _claim_of(job),
+        {"$set": {"status": status, "error": error, "finished_at": datetime.utcnow(), "lease_expires_at": None}},
+    )
+    return job["_id"]
+
+async def _work_forever(db: AsyncIOMotorDatabase):
+    while True:
+        _wakeup.clear()
+        try:
+            if await run_next(db) is not None:
+                continue
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Job worker failed: {e}")
+        try:
+            await asyncio.wait_for(_wakeup.wait(), timeout=_poll_seconds())
+        except asyncio.TimeoutError:
+            pass
+
+def start_workers(db: AsyncIOMotorDatabase):
+    """Starts the worker pool of this process."""
+    if not _workers:
+        _workers.extend(asyncio.create_task(_work_forever(db)) for _ in range(_worker_count()))
+        logger.info(f"Started {len(_workers)} job workers.")
+
+async def stop_workers():
+    """Stops the worker pool. Jobs cut short are run again once their lease expires."""
+    for worker in _workers:
+        worker.cancel()
+    await asyncio.gather(*_workers, return_exceptions=True)
+    _workers.clear()
@@ -0,0 +1,100 @@
+import asyncio
+import contextvars
+import time
+import logging
+from contextlib import asynccontextmanager
+from datetime import datetime
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from typing import AsyncIterator, List, Literal, Optional
+
+from app.backend.services import live_events
+
+logger = logging.getLogger(__name__)
+
+# Execution history of schedule runs and jobs, one document per run, written
+# when the run ends:
+#
+#   {"kind": "schedule" | "queue" | "timed", "handler": "publish_ad",
+#    "schedule_id": ..., "job_id": ..., "ad_id": ..., "account_id": ...,
+#    "started_at": datetime, "finished_at": datetime, "duration_ms": 1234.5,
+#    "outcome": "succeeded" | "failed", "error_class": None, "error": None}
+#
+# Rows are dropped by a TTL index on `started_at` after RETENTION_SECONDS.
+
+COLLECTION_NAME = "job_runs"
+RETENTION_SECONDS = 30 * 24 * 3600
+
+RunGroup = Literal["schedule", "account"]
+
+_GROUP_FIELDS = {"schedule": "schedule_id", "account": "account_id"}
+
+_current_run: contextvars.ContextVar[Optional[dict]] = contextvars.ContextVar("current_run", default=None)
+
+def label(**labels):
+    """Adds labels (e.g. `account_id`) to the run being recorded, if any."""
+    run = _current_run.get()
+    if run is not None:
+        run.update({key: value for key, value in labels.items() if value is not None})
+
+@asynccontextmanager
+async def record(db: AsyncIOMotorDatabase, kind: str, handler: str, **labels) -> AsyncIterator[dict]:
+    """
+    Records the run of the enclosed block. Exceptions are recorded as a failed
+    run and re-raised; a cancelled run (e.g. at shutdown) did not end and is not
+    recorded.
+    """
+    run = {"kind": kind, "handler": handler, **{key: value for key, value in labels.items() if value is not None}}
+    token = _current_run.set(run)
+    started_at, started = datetime.utcnow(), time.perf_counter()
+    run.update({"outcome": "succeeded", "error_class": None, "error": None})
+    cancelled = False
+    try:
+        yield run
+    except asyncio.CancelledError:
+        cancelled = True
+        raise
+    except BaseException as e:
+        run.update({"outcome": "failed", "error_class": type(e).__name__, "error": str(e)[:500]})
+        raise
+    finally:
+        _current_run.reset(token)
+        if not cancelled:
+            run.update({"started_at": started_at, "finished_at": datetime.utcnow(), "duration_ms": (time.perf_counter() - started) * 1000})
+            try:
+                await db[COLLECTION_NAME].insert_one(run)
+            except Exception as e:
+                logger.error(f"Could not record the run of {handler}: {e}")
+            else:
+                await live_events.publish_change(db, COLLECTION_NAME, after=run)
+
+def _percentile(percent: int) -> dict:
+    # Nearest-rank percentile over the durations pushed in ascending order.
+    return {"$arrayElemAt": ["$durations", {"$subtract": [{"$ceil": {"$multiply": [percent / 100, "$runs"]}}, 1]}]}
+
+async def get_run_stats(db: AsyncIOMotorDatabase, group_by: RunGroup, since: datetime, until: datetime) -> List[dict]:
+    """Duration percentiles and failure rate of the runs started in [since, until), per schedule or account."""
+    field = _GROUP_FIELDS[group_by]
+    pipeline = [
+        {"$match": {"started_at": {"$gte": since, "$lt": until}, field: {"$ne": None}}},
+        {"$sort": {"duration_ms": 1}},
+        {"$group": {
+            "_id": f"${field}",
+            "durations": {"$push": "$duration_ms"},
+            "runs": {"$sum": 1},
+            "failures": {"$sum": {"$cond": [{"$eq": ["$outcome", "failed"]}, 1, 0]}},
+            "last_run_at": {"$max": "$started_at"},
+        }},
+        {"$project": {
+            "_id": 0,
+            "id": "$_id",
+            "runs": 1,
+            "failures": 1,
+            "failure_rate": {"$divide": ["$failures", "$runs"]},
+            "p50_ms": _percentile(50),
+            "p95_ms": _percentile(95),
+            "p99_ms": _percentile(99),
+            "last_run_at": 1,
+        }},
+        {"$sort": {"id": 1}},
+    ]
+    return await db[COLLECTION_NAME].aggregate(pipeline).to_list(length=None)
@@ -0,0 +1,170 @@
+import os
+import uuid
+import logging
+from datetime import datetime, timedelta
+from motor.motor_asyncio import AsyncIOMotorCollection, AsyncIOMotorDatabase
+from pymongo import ASCENDING
+from typing import Awaitable, Callable, Dict, List, Optional
+
+from app.backend.services import job_runs, leases
+
+logger = logging.getLogger(__name__)
+
+# Async job store for timed jobs (one-off or repeating), read and written with
+# Motor so it never blocks the event loop. A job is a small document naming a
+# registered handler and its keyword arguments, which should only hold ids:
+#
+#   {"_id": "...", "handler": "publish_ad", "kwargs": {"ad_id": "..."},
+#    "next_run_at": datetime, "interval_seconds": None, "created_at": datetime}
+#
+# Due jobs are found through the `next_run_at` index and claimed with a
+# compare-and-set, so concurrent schedulers never run the same occurrence twice.
+# A claimed one-off job stays in the store until its run has ended: the claim
+# moves its `next_run_at` JOB_STORE_CLAIM_SECONDS ahead, so a job whose process
+# died mid-run becomes due again and is claimed anew.
+#
+# Configuration:
+#   JOB_STORE_CLAIM_SECONDS   Time after which a claimed one-off job that did not finish is run again (default 600)
+
+COLLECTION_NAME = "scheduled_jobs"
+
+JobHandler = Callable[..., Awaitable[None]]
+
+_handlers: Dict[str, JobHandler] = {}
+
+def handler(name: str) -> Callable[[JobHandler], JobHandler]:
+    """Registers a coroutine function as a job handler. It is called as `handler(db, **kwargs)`."""
+    def register(function: JobHandler) -> JobHandler:
+        _handlers[name] = function
+        return function
+    return register
+
+def get_handler(name: str) -> Optional[JobHandler]:
+    return _handlers.get(name)
+
+def _claim_seconds() -> float:
+    return float(os.getenv("JOB_STORE_CLAIM_SECONDS", "600"))
+
+class AsyncMongoJobStore:
+    def __init__(self, collection: AsyncIOMotorCollection):
+        self.collection = collection
+
+    @classmethod
+    def for_database(cls, db: AsyncIOMotorDatabase) -> "AsyncMongoJobStore":
+        return cls(db[COLLECTION_NAME])
+
+    async def add_job(
+        self,
+        handler: str,
+        kwargs: dict,
+        run_at: datetime,
+        interval_seconds: Optional[int] = None,
+        job_id: Optional[str] = None,
+        replace_existing: bool = True,
+    ) -> str:
+        """
+        Adds a job, replacing any existing job with the same id. Returns the job id.
+        With `replace_existing=False` an existing job keeps its next run and claim,
+        and only takes the handler, arguments and interval.
+        """
+        if handler not in _handlers:
+            raise ValueError(f"Unknown job handler: {handler}")
+        job_id = job_id or str(uuid.uuid4())
+        if not replace_existing:
+            await self.collection.update_one(
+                {"_id": job_id},
+                {
+                    "$set": {"handler": handler, "kwargs": kwargs, "interval_seconds": interval_seconds},
+                    "$setOnInsert": {"next_run_at": run_at, "created_at": datetime.utcnow()},
+                },
+                upsert=True,
+            )
+            return job_id
+        await self.collection.replace_one(
+            {"_id": job_id},
+            {
+                "handler": handler,
+                "kwargs": kwargs,
+                "next_run_at": run_at,
+                "interval_seconds": interval_seconds,
+                "created_at": datetime.utcnow(),
+            },
+            upsert=True,
+        )
+        return job_id
+
+    async def get_job(self, job_id: str) -> Optional[dict]:
+        return await self.collection.find_one({"_id": job_id})
+
+    async def remove_job(self, job_id: str) -> bool:
+        result = await self.collection.delete_one({"_id": job_id})
+        return result.deleted_count > 0
+
+    async def get_next_run_time(self) -> Optional[datetime]:
+        job = await self.collection.find_one({}, {"next_run_at": 1}, sort=[("next_run_at", ASCENDING)])
+        return job["next_run_at"] if job else None
+
+    async def claim_due_jobs(self, now: datetime, limit: int, fence: Optional[int] = None) -> List[dict]:
+        """
+        Claims up to `limit` jobs due at `now`. Repeating jobs are moved to their next
+        occurrence, one-off jobs to the end of their claim, until finish_job() removes
+        them; both only succeed if `next_run_at` still holds the value that was read,
+        which is what makes the claim exclusive. With a `fence` token, jobs already
+        claimed under a newer token are skipped.
+        """
+        if limit <= 0:
+            return []
+        candidates = await self.collection.find(
+            {"next_run_at": {"$lte": now}}
+        ).sort("next_run_at", ASCENDING).limit(limit).to_list(length=limit)
+
+        claimed = []
+        for job in candidates:
+            condition = leases.fenced({"_id": job["_id"], "next_run_at": job["next_run_at"]}, fence)
+            if job.get("interval_seconds"):
+                interval = timedelta(seconds=job["interval_seconds"])
+                next_run = job["next_run_at"] + interval
+                if next_run <= now:
+                    next_run = now + interval
+            else:
+                next_run = now + timedelta(seconds=_claim_seconds())
+                # Mongo keeps milliseconds; finish_job() matches the stored value exactly.
+                next_run = next_run.replace(microsecond=next_run.microsecond // 1000 * 1000)
+            update = {"next_run_at": next_run}
+            if fence is not None:
+                update["fence"] = fence
+            result = await self.collection.update_one(condition, {"$set": update})
+            if result.modified_count > 0:
+                if not job.get("interval_seconds"):
+                    job["claimed_until"] = next_run
+                claimed.append(job)
+        return claimed
+
+    async def finish_job(self, job: dict) -> bool:
+        """Removes a claimed one-off job once it has run, unless it was claimed or replaced since."""
+        if "claimed_until" not in job:
+            return False
+        result = await self.collection.delete_one({"_id": job["_id"], "next_run_at": job["claimed_until"]})
+        return result.deleted_count > 0
+
+async def run_job(db: AsyncIOMotorDatabase, job: dict, kind: str = "timed"):
+    """
+    Runs a job with its handler and records the run in the execution history.
+    A one-off job is removed once its run has ended, failed or not; a cancelled
+    run leaves it to be claimed again.
+    """
+    store = AsyncMongoJobStore.for_database(db)
+    job_handler = get_handler(job["handler"])
+    if job_handler is None:
+        logger.error(f"Dropping job {job['_id']}: no handler named '{job['handler']}'.")
+        if kind == "timed":
+            # Repeating jobs too: they would be claimed again at every interval.
+            await store.remove_job(job["_id"])
+        return
+    try:
+        async with job_runs.record(db, kind, job["handler"], job_id=job["_id"]):
+            await job_handler(db, **job.get("kwargs", {}))
+    except Exception:
+        await store.finish_job(job)
+        raise
+    await store.finish_job(job)
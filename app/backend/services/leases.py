@@ -0,0 +1,77 @@
+import logging
+from datetime import datetime, timedelta
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+# Named leases stored in Mongo, used to elect a single process for work that
+# must not run in every worker (e.g. the scheduler's sweeper). A lease is held
+# until `expires_at`; its holder renews it periodically (heartbeat) and any
+# other process can take it over once it has expired.
+#
+#   {"_id": "scheduler", "owner": "<node id>", "token": 7, "expires_at": datetime}
+#
+# `token` is a fencing token: it grows by one every time the lease changes
+# hands and never goes back, so writes tagged with it can be made to fail once
+# a newer holder exists. Expired leases are not deleted, since that would reset
+# the token.
+
+COLLECTION_NAME = "leases"
+
+async def acquire(db: AsyncIOMotorDatabase, name: str, owner: str, ttl_seconds: float) -> Optional[int]:
+    """
+    Takes the lease if it is free, expired or already ours, and returns its fencing
+    token. Returns None while another owner holds it.
+    """
+    now = datetime.utcnow()
+    expires_at = now + timedelta(seconds=ttl_seconds)
+    current = await db[COLLECTION_NAME].find_one_and_update(
+        {"_id": name, "owner": owner, "expires_at": {"$gt": now}},
+        {"$set": {"expires_at": expires_at}},
+        return_document=ReturnDocument.AFTER,
+    )
+    if current:
+        return current["token"]
+    try:
+        # Matches a missing or expired lease only; a lease held by someone else
+        # makes the upsert collide with the existing _id.
+        current = await db[COLLECTION_NAME].find_one_and_update(
+            {"_id": name, "expires_at": {"$lte": now}},
+            {"$set": {"owner": owner, "expires_at": expires_at, "acquired_at": now}, "$inc": {"token": 1}},
+            upsert=True,
+            return_document=ReturnDocument.AFTER,
+        )
+    except DuplicateKeyError:
+        return None
+    logger.info(f"Acquired lease '{name}' with token {current['token']}.")
+    return current["token"]
+
+async def renew(db: AsyncIOMotorDatabase, name: str, owner: str, token: int, ttl_seconds: float) -> bool:
+    """Extends a lease we hold. False means it expired and was taken over, so the holder must stop."""
+    now = datetime.utcnow()
+    result = await db[COLLECTION_NAME].update_one(
+        {"_id": name, "owner": owner, "token": token, "expires_at": {"$gt": now}},
+        {"$set": {"expires_at": now + timedelta(seconds=ttl_seconds)}},
+    )
+    return result.matched_count > 0
+
+async def release(db: AsyncIOMotorDatabase, name: str, owner: str, token: int) -> bool:
+    """Expires a lease we hold right away, so the next process can take it without waiting for the TTL."""
+    result = await db[COLLECTION_NAME].update_one(
+        {"_id": name, "owner": owner, "token": token},
+        {"$set": {"expires_at": datetime.utcnow()}},
+    )
+    return result.matched_count > 0
+
+def fenced(query: dict, token: Optional[int]) -> dict:
+    """
+    Adds a fencing condition to a write filter: the document must not have been
+    written by a newer lease holder. Writes made with the filter should `$set`
+    `fence` to the same token. Without a token the filter is left unchanged.
+    """
+    if token is None:
+        return query
+    return {**query, "$or": [{"fence": {"$exists": False}}, {"fence": {"$lte": token}}]}
@@ -0,0 +1,295 @@
+import asyncio
+import logging
+import os
+from collections import OrderedDict
+from datetime import datetime
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo.errors import OperationFailure
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from app.backend.models.account import AccountSummary
+from app.backend.models.ad import AdSummary
+from app.backend.models.schedule import ScheduleSummary
+
+logger = logging.getLogger(__name__)
+
+# Create, update and delete events of accounts, ads, schedules and job runs,
+# pushed to the clients of `GET /api/events` so the dashboard does not have to
+# poll the list endpoints:
+#
+#   {"collection": "ads", "operation": "insert" | "update" | "delete", "id": "...",
+#    "account_id": "...", "document": {...summary fields...} | None, "at": datetime}
+#
+# On a replica set the events come from a Mongo change stream on the database,
+# so every write is seen, whichever process or tool made it. Otherwise (a
+# standalone mongod, or mongomock) the services publish their own writes on an
+# in-process bus, and a client only sees the writes of the process it is
+# connected to. Events carry the summary fields of the documents only; account
+# credentials are never sent.
+#
+# Every subscriber has its own queue, which never blocks the publishers. A
+# subscriber that falls behind has its pending events coalesced: a newer event
+# for the same document replaces the pending one. If it still has more than
+# EVENTS_MAX_PENDING documents pending it is disconnected, and should reload
+# its lists before subscribing again.
+#
+# Change streams only carry the `_id` of deleted documents. Where the server
+# supports pre-images (MongoDB 6.0+) they are enabled on the watched
+# collections, and delete events carry the document's `id` and account; on older
+# servers their `id` is None.
+#
+# Configuration:
+#   EVENTS_SOURCE            "auto" (default): change streams when available; "local": the in-process bus
+#   EVENTS_MAX_PENDING       Documents with pending events before a subscriber is disconnected (default 1000)
+#   EVENTS_HEARTBEAT_SECONDS Time between keep-alive comments on idle streams (default 15)
+
+COLLECTIONS = ("accounts", "ads", "schedules", "job_runs")
+
+SUMMARY_FIELDS: Dict[str, Tuple[str, ...]] = {
+    "accounts": tuple(AccountSummary.model_fields),
+    "ads": tuple(AdSummary.model_fields),
+    "schedules": tuple(ScheduleSummary.model_fields),
+    "job_runs": ("kind", "handler", "outcome", "schedule_id", "job_id", "ad_id", "account_id", "started_at", "finished_at", "duration_ms", "error_class"),
+}
+
+RETRY_DELAY_SECONDS = 1.0
+
+# Server errors after which the stream cannot be resumed from its token:
+# InvalidResumeToken, ChangeStreamFatalError and ChangeStreamHistoryLost.
+_UNRESUMABLE_CODES = {260, 280, 286}
+
+_OPERATIONS = {"insert": "insert", "update": "update", "replace": "update", "delete": "delete"}
+
+_subscriptions: Set["Subscription"] = set()
+_watcher: Optional[asyncio.Task] = None
+_source = "local"
+
+def _max_pending() -> int:
+    return int(os.getenv("EVENTS_MAX_PENDING", "1000"))
+
+def heartbeat_seconds() -> float:
+    return float(os.getenv("EVENTS_HEARTBEAT_SECONDS", "15"))
+
+def source() -> str:
+    """Where the events come from: "change_stream" or "local"."""
+    return _source
+
+def projection(collection: str) -> dict:
+    """The fields to read from a document before a write, to publish it afterwards."""
+    return {field: 1 for field in SUMMARY_FIELDS[collection]}
+
+class Subscription:
+    def __init__(self, collections: Optional[Iterable[str]] = None, account_id: Optional[str] = None, max_pending: Optional[int] = None):
+        self.collections = set(collections or COLLECTIONS)
+        self.account_id = account_id
+        self.max_pending = max_pending or _max_pending()
+        self.coalesced = 0
+        self.overflowed = False
+        self._pending: "OrderedDict[tuple, dict]" = OrderedDict()
+        self._ready = asyncio.Event()
+
+    def matches(self, event: dict) -> bool:
+        if event["collection"] not in self.collections:
+            return False
+        return self.account_id is None or event.get("account_id") == self.account_id
+
+    def offer(self, event: dict):
+        """Queues an event without blocking; coalesces or disconnects when the subscriber is behind."""
+        key = (event["collection"], event["id"] if event["id"] is not None else id(event))
+        previous = self._pending.get(key)
+        if previous is not None:
+            # An insert the client has not seen yet stays an insert, with the newer document.
+            if previous["operation"] == "insert" and event["operation"] == "update":
+                event = {**event, "operation": "insert"}
+            self._pending[key] = event
+            self.coalesced += 1
+        elif len(self._pending) >= self.max_pending:
+            self.overflowed = True
+            unsubscribe(self)
+        else:
+            self._pending[key] = event
+        self._ready.set()
+
+    async def next(self, timeout: Optional[float] = None) -> Optional[dict]:
+        """
+        The next event, or None when there was none within `timeout`.
+        Raises OverflowError once the subscriber has been disconnected.
+        """
+        while not self._pending:
+            if self.overflowed:
+                raise OverflowError(f"More than {self.max_pending} events pending")
+            self._ready.clear()
+            try:
+                await asyncio.wait_for(self._ready.wait(), timeout)
+            except asyncio.TimeoutError:
+                return None
+        _, event = self._pending.popitem(last=False)
+        return event
+
+def subscribe(collections: Optional[Iterable[str]] = None, account_id: Optional[str] = None, max_pending: Optional[int] = None) -> Subscription:
+    subscription = Subscription(collections=collections, account_id=account_id, max_pending=max_pending)
+    _subscriptions.add(subscription)
+    return subscription
+
+def unsubscribe(subscription: Subscription):
+    _subscriptions.discard(subscription)
+
+def subscriber_count() -> int:
+    return len(_subscriptions)
+
+async def _account_of(db: Optional[AsyncIOMotorDatabase], collection: str, document: dict) -> Optional[str]:
+    if collection == "accounts":
+        return document.get("id")
+    if collection == "schedules":
+        # Schedules reach their account through their ad; only looked up when a subscriber filters by account.
+        if db is None or document.get("ad_id") is None or not any(subscription.account_id for subscription in _subscriptions):
+            return None
+        ad = await db.ads.find_one({"id": document["ad_id"]}, {"account_id": 1})
+        return ad.get("account_id") if ad else None
+    return document.get("account_id")
+
+async def _build(db: Optional[AsyncIOMotorDatabase], collection: str, operation: str, document: Optional[dict], summary: Optional[dict]) -> dict:
+    if collection == "job_runs":
+        document_id = str(document["_id"]) if document and "_id" in document else None
+    else:
+        document_id = document.get("id") if document else None
+    return {
+        "collection": collection,
+        "operation": operation,
+        "id": document_id,
+        "account_id": await _account_of(db, collection, document) if document else None,
+        "document": {field: summary.get(field) for field in SUMMARY_FIELDS[collection]} if summary else None,
+        "at": datetime.utcnow(),
+    }
+
+def _dispatch(event: dict):
+    for subscription in list(_subscriptions):
+        if subscription.matches(event):
+            subscription.offer(event)
+
+async def publish_changes(db: Optional[AsyncIOMotorDatabase], collection: str, changes: Iterable[Tuple[Optional[dict], Optional[dict]]]):
+    """
+    Publishes (before, after) pairs of written documents on the in-process bus;
+    None before a create and after a delete. Nothing to do while the change
+    stream delivers the events, or when nobody is listening.
+    """
+    if _source != "local" or not _subscriptions:
+        return
+    try:
+        for before, after in changes:
+            if after is None:
+                event = await _build(db, collection, "delete", before, None)
+            else:
+                event = await _build(db, collection, "insert" if before is None else "update", after, after)
+            _dispatch(event)
+    except Exception as e:
+        logger.warning(f"Could not publish the changes of {collection}: {e}")
+
+async def publish_change(db: Optional[AsyncIOMotorDatabase], collection: str, before: Optional[dict] = None, after: Optional[dict] = None):
+    await publish_changes(db, collection, [(before, after)])
+
+async def from_change(db: Optional[AsyncIOMotorDatabase], change: dict) -> Optional[dict]:
+    """Turns a change stream document into an event, or None for changes we do not publish."""
+    collection = change.get("ns", {}).get("coll")
+    operation = _OPERATIONS.get(change.get("operationType"))
+    if collection not in COLLECTIONS or operation is None:
+        return None
+    if operation == "delete":
+        # Without a pre-image only the `_id` is known.
+        document = change.get("fullDocumentBeforeChange") or dict(change.get("documentKey", {}))
+        return await _build(db, collection, operation, document, None)
+    document = change.get("fullDocument")
+    if document is None:
+        return None # Deleted before the update could be looked up; its delete event follows
+    return await _build(db, collection, operation, document, document)
+
+# Job runs are only ever inserted; their TTL deletions are not news.
+_PIPELINE: List[dict] = [{"$match": {"$or": [
+    {"ns.coll": {"$in": ["accounts", "ads", "schedules"]}, "operationType": {"$in": list(_OPERATIONS)}},
+    {"ns.coll": "job_runs", "operationType": "insert"},
+]}}]
+
+async def _enable_pre_images(db: AsyncIOMotorDatabase):
+    for collection in ("accounts", "ads", "schedules"):
+        try:
+            await db.command("collMod", collection, changeStreamPreAndPostImages={"enabled": True})
+        except Exception as e:
+            logger.info(f"No change stream pre-images on {collection}, its delete events only carry the _id: {e}")
+
+async def _try_open(db: AsyncIOMotorDatabase, resume_after: Optional[dict], **options):
+    stream = db.watch(_PIPELINE, full_document="updateLookup", resume_after=resume_after, **options)
+    try:
+        # The server only refuses the stream (e.g. without a replica set) once it is read.
+        return stream, await stream.try_next()
+    except Exception:
+        await stream.close()
+        raise
+
+async def _open_stream(db: AsyncIOMotorDatabase, resume_after: Optional[dict] = None):
+    """Opens the change stream. Returns it with its first change, if any."""
+    try:
+        return await _try_open(db, resume_after, full_document_before_change="whenAvailable")
+    except OperationFailure:
+        # Servers before 6.0 do not know pre-images.
+        return await _try_open(db, resume_after)
+
+async def _handle(db: AsyncIOMotorDatabase, change: dict) -> dict:
+    event = await from_change(db, change)
+    if event is not None:
+        _dispatch(event)
+    return change["_id"] # The resume token
+
+async def _watch(db: AsyncIOMotorDatabase, stream, first_change: Optional[dict]):
+    resume_token = None
+    while True:
+        try:
+            if stream is None:
+                stream, first_change = await _open_stream(db, resume_after=resume_token)
+            if first_change is not None:
+                resume_token = await _handle(db, first_change)
+                first_change = None
+            async for change in stream:
+                resume_token = await _handle(db, change)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            if resume_token is not None and isinstance(e, OperationFailure) and e.code in _UNRESUMABLE_CODES:
+                # E.g. the resume point has left the oplog: the changes in between are lost, continue from now on.
+                logger.error(f"Change stream cannot be resumed, continuing from now: {e}")
+                resume_token = None
+            else:
+                logger.error(f"Change stream failed, resuming: {e}")
+            await asyncio.sleep(RETRY_DELAY_SECONDS)
+        finally:
+            if stream is not None:
+                await stream.close()
+                stream = None
+
+async def start(db: AsyncIOMotorDatabase):
+    """Feeds the subscribers from a change stream when the deployment supports one, else from the in-process bus."""
+    global _watcher, _source
+    if _watcher is not None:
+        return
+    if os.getenv("EVENTS_SOURCE", "auto") == "local":
+        logger.info("Live events are published on the in-process bus.")
+        return
+    try:
+        stream, first_change = await _open_stream(db)
+    except Exception as e:
+        logger.info(f"Change streams are not available ({e}), live events are published on the in-process bus.")
+        return
+    await _enable_pre_images(db)
+    _source = "change_stream"
+    _watcher = asyncio.create_task(_watch(db, stream, first_change))
+    logger.info("Live events are read from a change stream.")
+
+async def stop():
+    global _watcher, _source
+    if _watcher is not None:
+        _watcher.cancel()
+        try:
+            await _watcher
+        except asyncio.CancelledError:
+            pass
+    _watcher = None
+    _source = "local"
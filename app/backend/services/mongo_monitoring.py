@@ -0,0 +1,100 @@
+import threading
+from pymongo import monitoring
+
+from app.backend.services import metrics
+
+# pymongo event listeners feeding the Mongo series of /metrics. They are passed
+# to AsyncIOMotorClient(event_listeners=...) in main.py and run on Motor's
+# worker threads, so they only record into thread-safe metrics.
+
+MONGO_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+COMMAND_DURATION = metrics.Histogram(
+    "mongodb_command_duration_seconds", "Duration of MongoDB commands.",
+    ("collection", "command"), buckets=MONGO_BUCKETS,
+)
+COMMAND_FAILURES = metrics.Counter(
+    "mongodb_command_failures_total", "MongoDB commands that returned an error.",
+    ("collection", "command"),
+)
+POOL_CONNECTIONS = metrics.Gauge(
+    "mongodb_pool_connections", "Connections of the MongoDB pool per server, open or checked out by an operation.",
+    ("address", "state"),
+)
+POOL_EVENTS = metrics.Counter(
+    "mongodb_pool_events_total", "Connection pool events: cleared pools and failed checkouts.",
+    ("address", "event"),
+)
+
+# Commands whose first value is not a collection name.
+_NO_COLLECTION = {"hello", "ismaster", "isMaster", "ping", "buildInfo", "endSessions", "abortTransaction", "commitTransaction", "listCollections", "listDatabases"}
+
+def _address(event) -> str:
+    host, port = event.address
+    return f"{host}:{port}"
+
+class CommandMetricsListener(monitoring.CommandListener):
+    def __init__(self):
+        # Started events carry the command document, finished events only its
+        # request id, so the collection is remembered in between.
+        self._collections = {}
+        self._lock = threading.Lock()
+
+    def started(self, event):
+        collection = ""
+        if event.command_name not in _NO_COLLECTION:
+            value = event.command.get(event.command_name)
+            if isinstance(value, str):
+                collection = value
+        with self._lock:
+            self._collections[(event.connection_id, event.request_id)] = collection
+
+    def _finish(self, event) -> str:
+        with self._lock:
+            collection = self._collections.pop((event.connection_id, event.request_id), "")
+        COMMAND_DURATION.observe(collection, event.command_name, value=event.duration_micros / 1_000_000)
+        return collection
+
+    def succeeded(self, event):
+        self._finish(event)
+
+    def failed(self, event):
+        COMMAND_FAILURES.inc(self._finish(event), event.command_name)
+
+class PoolMetricsListener(monitoring.ConnectionPoolListener):
+    def pool_created(self, event):
+        POOL_CONNECTIONS.set(_address(event), "open", value=0)
+        POOL_CONNECTIONS.set(_address(event), "checked_out", value=0)
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        POOL_EVENTS.inc(_address(event), "cleared")
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_created(self, event):
+        POOL_CONNECTIONS.inc(_address(event), "open")
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        POOL_CONNECTIONS.dec(_address(event), "open")
+
+    def connection_check_out_started(self, event):
+        pass
+
+    def connection_check_out_failed(self, event):
+        POOL_EVENTS.inc(_address(event), "checkout_failed")
+
+    def connection_checked_out(self, event):
+        POOL_CONNECTIONS.inc(_address(event), "checked_out")
+
+    def connection_checked_in(self, event):
+        POOL_CONNECTIONS.dec(_address(event), "checked_out")
+
+def event_listeners() -> list:
+    return [CommandMetricsListener(), PoolMetricsListener()]
@@ -0,0 +1,6 @@
+import uuid
+
+# Identifies this process among the API processes sharing the database: the
+# owner of the leases it holds, the worker name on the jobs it claims, and the
+# sender of the cache invalidations it broadcasts.
+NODE_ID = str(uuid.uuid4())
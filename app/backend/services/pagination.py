@@ -0,0 +1,55 @@
+import base64
+import binascii
+from bson import ObjectId
+from bson.errors import InvalidId
+from motor.motor_asyncio import AsyncIOMotorCollection
+from typing import List, Optional, Tuple
+
+# Keyset pagination over the `_id` index. ObjectIds are unique and increase with
+# insertion time, so `_id > last_seen` gives a stable order that Mongo can seek
+# into directly instead of walking every skipped document.
+
+class InvalidCursorError(ValueError):
+    """Raised when a client sends a cursor we did not issue."""
+
+def encode_cursor(object_id: ObjectId) -> str:
+    return base64.urlsafe_b64encode(object_id.binary).decode("ascii").rstrip("=")
+
+def decode_cursor(cursor: str) -> ObjectId:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        return ObjectId(base64.urlsafe_b64decode(padded.encode("ascii")))
+    except (binascii.Error, InvalidId, TypeError, ValueError, UnicodeEncodeError):
+        raise InvalidCursorError(f"Invalid cursor: {cursor!r}")
+
+async def find_page(
+    collection: AsyncIOMotorCollection,
+    query: Optional[dict] = None,
+    limit: int = 100,
+    skip: int = 0,
+    cursor: Optional[str] = None,
+    projection: Optional[dict] = None,
+) -> Tuple[List[dict], Optional[str]]:
+    """
+    Returns one page of raw documents plus the cursor for the next page.
+
+    When `cursor` is given the page starts right after it and `skip` is ignored;
+    otherwise the legacy offset mode is used. The next cursor is only returned
+    when the page is full, i.e. when there may be more documents to read.
+    `_id` is always included, even with a projection, since the cursor is
+    built from it.
+    """
+    query = dict(query or {})
+    if cursor:
+        query["_id"] = {"$gt": decode_cursor(cursor)}
+        skip = 0
+
+    documents_cursor = collection.find(query, projection).sort("_id", 1)
+    if skip:
+        documents_cursor = documents_cursor.skip(skip)
+    documents = await documents_cursor.limit(limit).to_list(length=limit)
+
+    next_cursor = None
+    if limit and len(documents) == limit:
+        next_cursor = encode_cursor(documents[-1]["_id"])
+    return documents, next_cursor
@@ -0,0 +1,107 @@
+import asyncio
+import os
+import sys
+import threading
+import logging
+from collections import Counter
+from datetime import datetime
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo import DESCENDING
+from typing import List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Sampling profiler for single requests. While a profiled request runs, a
+# background thread periodically captures the event loop thread's stack and
+# counts it if the request's task is the one running; otherwise the sample is
+# counted as "(waiting)", i.e. the request was awaiting I/O or the loop was busy
+# with other requests. Stacks are returned in the collapsed format
+# ("frame;frame;frame count" per line) that flame graph tools read.
+#
+# Profiles are saved in the `profiles` collection, so they can be downloaded
+# from any worker, and expire after a day. Only operators (see auth.py) can
+# profile a request.
+#
+# Configuration:
+#   PROFILE_SAMPLE_RATE   Fraction of all requests profiled and saved automatically (default 0)
+#   PROFILE_INTERVAL_MS   Time between two stack samples (default 5; the sampler thread needs the
+#                         GIL, so busy requests are sampled at most every sys.getswitchinterval())
+
+COLLECTION_NAME = "profiles"
+RETENTION_SECONDS = 24 * 3600
+
+WAITING = "(waiting)"
+
+def sample_rate() -> float:
+    return float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+
+def _interval_seconds() -> float:
+    return float(os.getenv("PROFILE_INTERVAL_MS", "5")) / 1000
+
+def _describe(code) -> str:
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+class SamplingProfiler:
+    """Samples the stacks of `task` from a background thread until stopped."""
+
+    def __init__(self, task: asyncio.Task, root_code=None, interval: Optional[float] = None):
+        self.task = task
+        self.loop = task.get_loop()
+        self.root_code = root_code
+        self.interval = interval or _interval_seconds()
+        self.thread_id = threading.get_ident()
+        self.stacks: Counter = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="request-profiler", daemon=True)
+
+    def _stack(self, frame) -> str:
+        codes = []
+        while frame is not None:
+            codes.append(frame.f_code)
+            if frame.f_code is self.root_code:
+                break
+            frame = frame.f_back
+        return ";".join(_describe(code) for code in reversed(codes))
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            if asyncio.current_task(self.loop) is self.task:
+                self.stacks[self._stack(frame)] += 1
+            else:
+                self.stacks[WAITING] += 1
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self) -> Counter:
+        self._stop.set()
+        self._thread.join()
+        return self.stacks
+
+def collapse(stacks: Counter) -> str:
+    return "".join(f"{stack} {count}\n" for stack, count in stacks.most_common())
+
+async def save_profile(db: AsyncIOMotorDatabase, profile_id: str, method: str, path: str, status: int, duration_ms: float, stacks: Counter, sampled: bool):
+    await db[COLLECTION_NAME].insert_one({
+        "_id": profile_id,
+        "method": method,
+        "path": path,
+        "status": status,
+        "duration_ms": duration_ms,
+        "samples": sum(stacks.values()),
+        "sampled": sampled, # Profiled by PROFILE_SAMPLE_RATE rather than on request
+        "collapsed": collapse(stacks),
+        "created_at": datetime.utcnow(),
+    })
+
+async def list_profiles(db: AsyncIOMotorDatabase, limit: int = 50) -> List[dict]:
+    profiles = await db[COLLECTION_NAME].find({}, {"collapsed": 0}).sort("created_at", DESCENDING).limit(limit).to_list(length=limit)
+    for profile in profiles:
+        profile["id"] = profile.pop("_id")
+    return profiles
+
+async def get_profile(db: AsyncIOMotorDatabase, profile_id: str) -> Optional[dict]:
+    return await db[COLLECTION_NAME].find_one({"_id": profile_id})
@@ -0,0 +1,28 @@
+from pydantic import BaseModel
+from typing import List, Literal, Optional, Type
+
+ListView = Literal["full", "summary"]
+
+class InvalidFieldsError(ValueError):
+    """Raised when a client asks for fields the model does not have."""
+
+def resolve_fields(model: Type[BaseModel], summary_model: Type[BaseModel], view: ListView = "full", fields: Optional[str] = None) -> Optional[List[str]]:
+    """
+    Turns the `view` and `fields` query parameters of a list endpoint into the
+    list of fields to project, or None when the full documents are wanted.
+    `fields` takes precedence over `view`, and `id` is always included.
+    """
+    if fields:
+        requested = [field.strip() for field in fields.split(",") if field.strip()]
+        unknown = [field for field in requested if field not in model.model_fields]
+        if unknown:
+            raise InvalidFieldsError(f"Unknown fields: {', '.join(unknown)}")
+        return list(dict.fromkeys(["id"] + requested))
+    if view == "summary":
+        return list(summary_model.model_fields)
+    return None
+
+def to_projection(fields: Optional[List[str]]) -> Optional[dict]:
+    if fields is None:
+        return None
+    return {field: 1 for field in fields}
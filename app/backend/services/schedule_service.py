@@ -1,32 +1,106 @@
+from datetime import datetime, timedelta
 from motor.motor_asyncio import AsyncIOMotorDatabase
-from typing import List
+from typing import List, Optional, Set, Tuple
 
-from app.backend.models.schedule import Schedule, ScheduleCreate
+from app.backend.models.schedule import Schedule, ScheduleCreate, ScheduleExpanded
+from app.backend.services import cache, concurrency, expansion, live_events, pagination, projection, stats_service
+
+# Read before a delete or a bulk update, so the statistics and live events can follow the change.
+_TRACKED_FIELDS = {**stats_service.projection("schedules"), **live_events.projection("schedules")}
+
+async def _record_changes(db: AsyncIOMotorDatabase, changes: List[Tuple[Optional[dict], Optional[dict]]]):
+    """Counts and publishes (before, after) pairs of written documents."""
+    await stats_service.record_changes(db, "schedules", changes)
+    await live_events.publish_changes(db, "schedules", changes)
+
+async def _record_change(db: AsyncIOMotorDatabase, before: Optional[dict] = None, after: Optional[dict] = None):
+    await _record_changes(db, [(before, after)])
 
 async def get_schedule(db: AsyncIOMotorDatabase, schedule_id: str) -> Schedule | None:
-    schedule = await db.schedules.find_one({"id": schedule_id})
-    if schedule:
-        return Schedule(**schedule)
-    return None
+    async def load() -> Schedule | None:
+        schedule = await db.schedules.find_one({"id": schedule_id})
+        if schedule:
+            return Schedule.model_construct(**schedule)
+        return None
+    return await cache.get_or_load("schedules", schedule_id, load)
 
 async def get_schedules(db: AsyncIOMotorDatabase, skip: int = 0, limit: int = 100) -> List[Schedule]:
-    schedules_cursor = db.schedules.find().skip(skip).limit(limit)
-    schedules = await schedules_cursor.to_list(length=limit)
-    return [Schedule(**schedule) for schedule in schedules]
+    schedules, _ = await get_schedules_page(db=db, skip=skip, limit=limit)
+    return schedules
+
+async def get_schedules_page(db: AsyncIOMotorDatabase, limit: int = 100, skip: int = 0, cursor: Optional[str] = None) -> Tuple[List[Schedule], Optional[str]]:
+    schedules, next_cursor = await pagination.find_page(db.schedules, limit=limit, skip=skip, cursor=cursor)
+    return [Schedule.model_construct(**schedule) for schedule in schedules], next_cursor
+
+async def get_schedules_projected_page(db: AsyncIOMotorDatabase, fields: List[str], limit: int = 100, skip: int = 0, cursor: Optional[str] = None) -> Tuple[List[dict], Optional[str]]:
+    """Like get_schedules_page, but only loads the given fields and returns raw documents."""
+    schedules, next_cursor = await pagination.find_page(db.schedules, limit=limit, skip=skip, cursor=cursor, projection=projection.to_projection(fields))
+    for schedule in schedules:
+        schedule.pop("_id", None)
+    return schedules, next_cursor
+
+async def get_schedule_expanded(db: AsyncIOMotorDatabase, schedule_id: str, expand: Set[str]) -> ScheduleExpanded | None:
+    """Returns the schedule with its ad and/or account embedded, read in a single aggregation."""
+    pipeline = [{"$match": {"id": schedule_id}}, {"$limit": 1}]
+    # The account is reached through the ad, so the ad is joined either way.
+    pipeline += expansion.lookup_one("ads", "ad_id", "ad")
+    if "account" in expand:
+        pipeline += expansion.lookup_one("accounts", "ad.account_id", "account")
+    if "ad" not in expand:
+        pipeline.append({"$project": {"ad": 0}})
+    schedules = await db.schedules.aggregate(pipeline).to_list(length=1)
+    if schedules:
+        return ScheduleExpanded(**schedules[0])
+    return None
+
+async def get_schedules_expanded_page(db: AsyncIOMotorDatabase, expand: Set[str], limit: int = 100, skip: int = 0, cursor: Optional[str] = None) -> Tuple[List[ScheduleExpanded], Optional[str]]:
+    """Like get_schedules_page, with the related documents of the whole page batch-loaded with `$in` queries."""
+    schedules, next_cursor = await pagination.find_page(db.schedules, limit=limit, skip=skip, cursor=cursor)
+    ads = await expansion.load_by_ids(db.ads, (schedule.get("ad_id") for schedule in schedules))
+    accounts = {}
+    if "account" in expand:
+        accounts = await expansion.load_by_ids(db.accounts, (ad.get("account_id") for ad in ads.values()))
+
+    expanded = []
+    for schedule in schedules:
+        ad = ads.get(schedule.get("ad_id"))
+        related = {}
+        if "ad" in expand:
+            related["ad"] = ad
+        if "account" in expand and ad:
+            related["account"] = accounts.get(ad.get("account_id"))
+        expanded.append(ScheduleExpanded(**schedule, **related))
+    return expanded, next_cursor
 
 async def create_schedule(db: AsyncIOMotorDatabase, schedule: ScheduleCreate) -> Schedule:
-    # In a real app, next_republish_at would be calculated based on the interval
-    from datetime import datetime, timedelta
-    new_schedule_data = schedule.dict()
+    new_schedule_data = schedule.model_dump()
     new_schedule_data["next_republish_at"] = datetime.utcnow() + timedelta(hours=schedule.republish_interval_hours)
     new_schedule = Schedule(**new_schedule_data)
-    await db.schedules.insert_one(new_schedule.dict())
+    document = new_schedule.model_dump()
+    await db.schedules.insert_one(document)
+    await _record_change(db, after=document)
     return new_schedule
 
-async def update_schedule(db: AsyncIOMotorDatabase, schedule_id: str, schedule_data: dict) -> bool:
-    result = await db.schedules.update_one({"id": schedule_id}, {"$set": schedule_data})
-    return result.modified_count > 0
+async def update_schedule(db: AsyncIOMotorDatabase, schedule_id: str, schedule_data: dict, expected_version: Optional[int] = None) -> Schedule | None:
+    """
+    Updates the schedule and returns it as stored after the update, or None if it does not exist.
+    Raises concurrency.VersionConflictError if `expected_version` is stale.
+    Changing the interval restarts the countdown to the next run from now.
+    """
+    if "republish_interval_hours" in schedule_data and "next_republish_at" not in schedule_data:
+        schedule_data = {**schedule_data, "next_republish_at": datetime.utcnow() + timedelta(hours=schedule_data["republish_interval_hours"])}
+    previous, schedule = await concurrency.update_document_with_previous(db.schedules, schedule_id, schedule_data, expected_version=expected_version)
+    await cache.invalidate("schedules", schedule_id)
+    if schedule is None:
+        return None
+    await _record_change(db, before=previous, after=schedule)
+    updated_schedule = Schedule(**schedule)
+    return updated_schedule
 
 async def delete_schedule(db: AsyncIOMotorDatabase, schedule_id: str) -> bool:
-    result = await db.schedules.delete_one({"id": schedule_id})
-    return result.deleted_count > 0
+    deleted = await db.schedules.find_one_and_delete({"id": schedule_id}, _TRACKED_FIELDS)
+    await cache.invalidate("schedules", schedule_id)
+    if deleted is None:
+        return False
+    await _record_change(db, before=deleted)
+    return True
@@ -1,52 +1,242 @@
-from apscheduler.schedulers.asyncio import AsyncIOScheduler
-from apscheduler.jobstores.mongodb import MongoDBJobStore
+import asyncio
 import os
 import logging
+from datetime import datetime, timedelta
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from typing import List, Optional, Set
 
-from app.backend.services import automation_service
-from app.backend.models.account import Account
-from app.backend.models.ad import Ad
+from app.backend.services import ad_service, automation_service, cache, job_runs, job_store, leases, node
 
 logger = logging.getLogger(__name__)
 
-# The scheduler instance will be managed by the FastAPI app lifecycle.
-scheduler = AsyncIOScheduler()
-
-def initialize_scheduler(client):
-    """Initializes and starts the scheduler."""
-    if not scheduler.running:
-        jobstore = MongoDBJobStore(client=client, database=os.getenv("DB_NAME"))
-        scheduler.add_jobstore(jobstore)
-        scheduler.start()
-        logger.info("Scheduler started and connected to MongoDB job store.")
-
-def shutdown_scheduler():
-    """Shuts down the scheduler."""
-    if scheduler.running:
-        scheduler.shutdown()
-        logger.info("Scheduler shut down.")
-
-def schedule_ad_posting_job(schedule_id: str, interval_hours: int, account: Account, ad: Ad):
-    """Adds or updates a job in the scheduler."""
-    job_id = f"post_ad_{schedule_id}"
-
-    logger.info(f"Scheduling job {job_id} to run every {interval_hours} hours.")
-
-    scheduler.add_job(
-        automation_service.post_ad_to_wanuncios,
-        'interval',
-        hours=interval_hours,
-        args=[account, ad],
-        id=job_id,
-        replace_existing=True,
-        misfire_grace_time=3600 # An hour grace time if the scheduler is down
+# The `schedules` collection is the source of truth for republishing. Instead of
+# keeping one scheduler job per schedule in memory, a single sweeper task
+# repeatedly claims the schedules whose `next_republish_at` has passed, using
+# the (is_active, next_republish_at) index, and advances `next_republish_at`
+# with a compare-and-set. Only one sweeper can win a given run, so several
+# processes can sweep the same collection without posting an ad twice.
+#
+# The same sweeper also runs the timed jobs of the async job store
+# (see job_store.py), e.g. an ad publication requested for a later time.
+#
+# Every worker process starts a sweeper, but only the one holding the
+# "scheduler" lease (see leases.py) sweeps; the others retry the lease at every
+# heartbeat, so they take over within one lease period when the leader dies and
+# right away when it shuts down cleanly. Claims are written with the lease's
+# fencing token, so a leader that stalled past its lease cannot claim anything
+# the new leader has already claimed.
+#
+# Configuration:
+#   SCHEDULER_POLL_SECONDS     Longest time between two sweeps (default 30)
+#   SCHEDULER_BATCH_SIZE       Maximum schedules or jobs claimed per query (default 100)
+#   SCHEDULER_MAX_CONCURRENCY  Maximum schedule runs and jobs running at once (default 5)
+#   SCHEDULER_LEASE_SECONDS    Lifetime of the leader lease, renewed every third of it (default 15)
+
+LEASE_NAME = "scheduler"
+
+_sweeper: Optional[asyncio.Task] = None
+_wakeup = asyncio.Event()
+_running: Set[asyncio.Task] = set()
+_db: Optional[AsyncIOMotorDatabase] = None
+_lease_token: Optional[int] = None
+
+class PublishError(Exception):
+    """Raised when an ad could not be posted, so that the run is recorded as failed."""
+
+def _poll_seconds() -> float:
+    return float(os.getenv("SCHEDULER_POLL_SECONDS", "30"))
+
+def _batch_size() -> int:
+    return int(os.getenv("SCHEDULER_BATCH_SIZE", "100"))
+
+def _max_concurrency() -> int:
+    return int(os.getenv("SCHEDULER_MAX_CONCURRENCY", "5"))
+
+def _lease_seconds() -> float:
+    return float(os.getenv("SCHEDULER_LEASE_SECONDS", "15"))
+
+def _heartbeat_seconds() -> float:
+    return _lease_seconds() / 3
+
+def next_run_after(previous_run: datetime, interval_hours: int, now: datetime) -> datetime:
+    """The next occurrence after `now`. Runs missed while the service was down are skipped, not replayed."""
+    next_run = previous_run + timedelta(hours=interval_hours)
+    if next_run <= now:
+        next_run = now + timedelta(hours=interval_hours)
+    return next_run
+
+async def claim_due_schedules(db: AsyncIOMotorDatabase, now: datetime, limit: int, fence: Optional[int] = None) -> List[dict]:
+    """
+    Claims up to `limit` due schedules by advancing their `next_republish_at`.
+    The update only matches if `next_republish_at` is still the value we read,
+    so a schedule claimed by another sweeper in the meantime is skipped. With a
+    `fence` token, schedules claimed under a newer token are skipped as well.
+    """
+    if limit <= 0:
+        return []
+    candidates = await db.schedules.find(
+        {"is_active": True, "next_republish_at": {"$lte": now}},
+        {"id": 1, "ad_id": 1, "republish_interval_hours": 1, "next_republish_at": 1},
+    ).sort("next_republish_at", 1).limit(limit).to_list(length=limit)
+
+    claimed = []
+    for schedule in candidates:
+        next_run = next_run_after(schedule["next_republish_at"], schedule["republish_interval_hours"], now)
+        update = {"next_republish_at": next_run}
+        if fence is not None:
+            update["fence"] = fence
+        result = await db.schedules.update_one(
+            leases.fenced({"id": schedule["id"], "next_republish_at": schedule["next_republish_at"]}, fence),
+            {"$set": update},
+        )
+        if result.modified_count:
+            schedule["next_republish_at"] = next_run
+            claimed.append(schedule)
+    if claimed:
+        await cache.invalidate("schedules", *[schedule["id"] for schedule in claimed])
+    return claimed
+
+async def seconds_until_next_due(db: AsyncIOMotorDatabase, now: datetime) -> float:
+    """How long the sweeper can sleep, capped at the poll interval."""
+    upcoming = await db.schedules.find_one(
+        {"is_active": True},
+        {"next_republish_at": 1},
+        sort=[("next_republish_at", 1)],
     )
+    next_runs = [upcoming["next_republish_at"]] if upcoming else []
+    next_job_run = await job_store.AsyncMongoJobStore.for_database(db).get_next_run_time()
+    if next_job_run:
+        next_runs.append(next_job_run)
+    if not next_runs:
+        return _poll_seconds()
+    delay = (min(next_runs) - now).total_seconds()
+    return min(max(delay, 0.0), _poll_seconds())
+
+@job_store.handler("publish_ad")
+async def publish_ad(db: AsyncIOMotorDatabase, ad_id: str):
+    """Posts an ad with its account, both loaded by id when the job runs, and records when it was published."""
+    job_runs.label(ad_id=ad_id)
+    ad = await ad_service.get_ad_expanded(db=db, ad_id=ad_id)
+    if ad is None or ad.account is None:
+        raise PublishError(f"Ad {ad_id} or its account no longer exists")
+    job_runs.label(account_id=ad.account_id)
+    if not await automation_service.post_ad_to_wanuncios(ad.account, ad):
+        raise PublishError(f"Posting ad {ad_id} to wanuncios.com failed")
+    await ad_service.mark_published(db=db, ad_id=ad_id, published_at=datetime.utcnow())
+
+async def run_schedule(db: AsyncIOMotorDatabase, schedule: dict):
+    """Posts the ad of a claimed schedule."""
+    logger.info(f"Running schedule {schedule['id']} for ad {schedule['ad_id']}.")
+    async with job_runs.record(db, "schedule", "publish_ad", schedule_id=schedule["id"]):
+        await publish_ad(db, ad_id=schedule["ad_id"])
+
+async def schedule_job(db: AsyncIOMotorDatabase, handler: str, kwargs: dict, run_at: datetime, interval_seconds: Optional[int] = None, job_id: Optional[str] = None) -> str:
+    """Stores a timed job and makes the sweeper account for it. Returns the job id."""
+    job_id = await job_store.AsyncMongoJobStore.for_database(db).add_job(handler, kwargs, run_at, interval_seconds=interval_seconds, job_id=job_id)
+    wake()
+    return job_id
+
+def _spawn(name: str, coroutine_function, *args):
+    async def run():
+        try:
+            await coroutine_function(*args)
+        except Exception as e:
+            logger.error(f"{name} failed: {e}")
+        finally:
+            _running.discard(asyncio.current_task())
+            wake() # A slot is free again
+
+    _running.add(asyncio.create_task(run()))
+
+async def sweep(db: AsyncIOMotorDatabase, fence: Optional[int] = None) -> int:
+    """Claims and starts as many due schedules and jobs as there are free slots. Returns how many were started."""
+    store = job_store.AsyncMongoJobStore.for_database(db)
+    started = 0
+    for claim, run, describe in (
+        (claim_due_schedules, run_schedule, lambda schedule: f"Schedule {schedule['id']}"),
+        (lambda db, now, limit, fence: store.claim_due_jobs(now, limit, fence), job_store.run_job, lambda job: f"Job {job['_id']}"),
+    ):
+        while True:
+            limit = min(_batch_size(), _max_concurrency() - len(_running))
+            if limit <= 0:
+                return started
+            claimed = await claim(db, datetime.utcnow(), limit, fence)
+            for item in claimed:
+                _spawn(describe(item), run, db, item)
+            started += len(claimed)
+            if len(claimed) < limit:
+                break
+    return started
+
+async def _hold_lease(db: AsyncIOMotorDatabase) -> Optional[int]:
+    """Renews the leader lease, or tries to take it. Returns the fencing token while we lead."""
+    global _lease_token
+    if _lease_token is not None:
+        if await leases.renew(db, LEASE_NAME, node.NODE_ID, _lease_token, _lease_seconds()):
+            return _lease_token
+        logger.warning("Lost the scheduler lease, no longer sweeping.")
+    _lease_token = await leases.acquire(db, LEASE_NAME, node.NODE_ID, _lease_seconds())
+    if _lease_token is not None:
+        logger.info(f"Leading the scheduler with fencing token {_lease_token}.")
+    return _lease_token
+
+async def _sweep_forever(db: AsyncIOMotorDatabase):
+    while True:
+        _wakeup.clear()
+        try:
+            token = await _hold_lease(db)
+            if token is None:
+                delay = _heartbeat_seconds()
+            else:
+                await sweep(db, fence=token)
+                delay = await seconds_until_next_due(db, datetime.utcnow())
+                if len(_running) >= _max_concurrency():
+                    delay = _poll_seconds() # Woken up as soon as a run finishes
+                # Also bounds how late the leader notices schedules and jobs
+                # created through other workers.
+                delay = min(delay, _heartbeat_seconds())
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Schedule sweep failed: {e}")
+            delay = min(_poll_seconds(), _heartbeat_seconds())
+        try:
+            await asyncio.wait_for(_wakeup.wait(), timeout=delay)
+        except asyncio.TimeoutError:
+            pass
+
+def initialize_scheduler(db: AsyncIOMotorDatabase):
+    """Starts the due-schedule sweeper, which sweeps whenever this process holds the scheduler lease."""
+    global _sweeper, _db
+    if _sweeper is None:
+        _db = db
+        _sweeper = asyncio.create_task(_sweep_forever(db))
+        logger.info("Schedule sweeper started.")
+
+async def shutdown_scheduler():
+    """Stops the sweeper and any postings still running, and hands the lease over."""
+    global _sweeper, _lease_token
+    if _sweeper is not None:
+        tasks = [_sweeper, *_running]
+        _sweeper = None
+        for task in tasks:
+            task.cancel()
+        # The lease is only handed over once nothing of ours writes any more.
+        await asyncio.gather(*tasks, return_exceptions=True)
+        if _lease_token is not None:
+            try:
+                await leases.release(_db, LEASE_NAME, node.NODE_ID, _lease_token)
+            except Exception as e:
+                logger.error(f"Could not release the scheduler lease: {e}")
+            _lease_token = None
+        logger.info("Schedule sweeper shut down.")
+
+def running_count() -> int:
+    return len(_running)
+
+def is_leader() -> bool:
+    return _lease_token is not None
 
-def remove_schedule(schedule_id: str):
-    """Removes a job from the scheduler."""
-    job_id = f"post_ad_{schedule_id}"
-    if scheduler.get_job(job_id):
-        scheduler.remove_job(job_id)
-        logger.info(f"Removed job {job_id} from schedule.")
-    else:
-        logger.warning(f"Attempted to remove non-existent job: {job_id}")
+def wake():
+    """Makes the sweeper look for due schedules and jobs now instead of at its next poll."""
+    _wakeup.set()
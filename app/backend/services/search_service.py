@@ -0,0 +1,112 @@
+import asyncio
+import os
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from typing import Dict, List, Literal, Optional
+
+from app.backend.models.ad import AdSearchHit, AdSearchResults, AdSummary, FacetCount
+
+# Ad search: full-text relevance over title and description plus equality
+# filters and a price range, with facet counts of the matching ads.
+#
+# Text queries use the `search_text` index (see index_service.py), which weighs
+# the title three times the description and stems Spanish words. Filter-only
+# searches sorted newest first (by `_id`, like the ad list) are served by the
+# `_id`-suffixed filter indexes, the price sorts and ranges by the
+# `price`-suffixed ones.
+#
+# The page of hits and the facets are two aggregations run concurrently. The
+# facets only look at the first SEARCH_FACET_LIMIT matching ads, which keeps a
+# broad query (e.g. one province) from counting a million documents per
+# request; `total_exact` tells whether `total` and the facets are complete.
+#
+# Configuration:
+#   SEARCH_FACET_LIMIT    Matching ads counted for the facets and total (default 1000)
+#   SEARCH_FACET_VALUES   Values returned per facet, most frequent first (default 20)
+
+SearchSort = Literal["relevance", "newest", "price_asc", "price_desc"]
+
+FILTER_FIELDS = ("category", "subcategory", "province", "zone", "account_id")
+FACET_FIELDS = ("category", "subcategory", "province", "zone")
+
+_SORTS = {
+    "relevance": {"score": {"$meta": "textScore"}, "_id": -1},
+    "newest": {"_id": -1},
+    "price_asc": {"price": 1, "_id": -1},
+    "price_desc": {"price": -1, "_id": -1},
+}
+
+class InvalidSearchError(ValueError):
+    """Raised for searches that cannot be run, e.g. an empty price range."""
+
+def _facet_limit() -> int:
+    return int(os.getenv("SEARCH_FACET_LIMIT", "1000"))
+
+def _facet_values() -> int:
+    return int(os.getenv("SEARCH_FACET_VALUES", "20"))
+
+def build_match(q: Optional[str] = None, filters: Optional[Dict[str, str]] = None, price_min: Optional[float] = None, price_max: Optional[float] = None) -> dict:
+    if price_min is not None and price_max is not None and price_min > price_max:
+        raise InvalidSearchError("price_min cannot be greater than price_max")
+    match = {field: value for field, value in (filters or {}).items() if value is not None}
+    unknown = set(match) - set(FILTER_FIELDS)
+    if unknown:
+        raise InvalidSearchError(f"Unknown filters: {', '.join(sorted(unknown))}")
+    price = {}
+    if price_min is not None:
+        price["$gte"] = price_min
+    if price_max is not None:
+        price["$lte"] = price_max
+    if price:
+        match["price"] = price
+    if q:
+        match["$text"] = {"$search": q}
+    return match
+
+def build_hits_pipeline(match: dict, sort: SearchSort, skip: int = 0, limit: int = 20) -> List[dict]:
+    if sort == "relevance" and "$text" not in match:
+        raise InvalidSearchError("Sorting by relevance requires a text query")
+    project = {"_id": 0, **{field: 1 for field in AdSummary.model_fields}}
+    if "$text" in match:
+        project["score"] = {"$meta": "textScore"}
+    return [{"$match": match}, {"$sort": _SORTS[sort]}, {"$skip": skip}, {"$limit": limit}, {"$project": project}]
+
+def build_facets_pipeline(match: dict, facet_limit: int, facet_values: int) -> List[dict]:
+    def counts(field: str) -> List[dict]:
+        return [{"$limit": facet_limit}, {"$group": {"_id": f"${field}", "count": {"$sum": 1}}}, {"$sort": {"count": -1, "_id": 1}}, {"$limit": facet_values}]
+
+    return [
+        {"$match": match},
+        # One more than counted, to tell exactly `facet_limit` matches from more.
+        {"$limit": facet_limit + 1},
+        {"$facet": {"total": [{"$count": "count"}], **{field: counts(field) for field in FACET_FIELDS}}},
+    ]
+
+async def search_ads(
+    db: AsyncIOMotorDatabase,
+    q: Optional[str] = None,
+    filters: Optional[Dict[str, str]] = None,
+    price_min: Optional[float] = None,
+    price_max: Optional[float] = None,
+    sort: Optional[SearchSort] = None,
+    skip: int = 0,
+    limit: int = 20,
+) -> AdSearchResults:
+    """Runs a search. Raises InvalidSearchError for invalid parameters."""
+    q = (q or "").strip() or None
+    match = build_match(q=q, filters=filters, price_min=price_min, price_max=price_max)
+    hits_pipeline = build_hits_pipeline(match, sort or ("relevance" if q else "newest"), skip=skip, limit=limit)
+    facet_limit = _facet_limit()
+    facets_pipeline = build_facets_pipeline(match, facet_limit, _facet_values())
+
+    hits, facets = await asyncio.gather(
+        db.ads.aggregate(hits_pipeline).to_list(length=None),
+        db.ads.aggregate(facets_pipeline).to_list(length=None),
+    )
+    facets = facets[0] if facets else {}
+    total = facets["total"][0]["count"] if facets.get("total") else 0
+    return AdSearchResults.model_construct(
+        items=[AdSearchHit.model_construct(**hit) for hit in hits],
+        total=min(total, facet_limit),
+        total_exact=total <= facet_limit,
+        facets={field: [FacetCount.model_construct(value=entry["_id"], count=entry["count"]) for entry in facets.get(field, [])] for field in FACET_FIELDS},
+    )
@@ -0,0 +1,152 @@
+import logging
+import os
+from collections import Counter
+from datetime import datetime
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo import UpdateOne
+from typing import Dict, Iterable, Optional, Tuple
+
+from app.backend.models.stats import ActiveStats, AdStats, Stats
+from app.backend.services import job_store
+
+logger = logging.getLogger(__name__)
+
+# Dashboard statistics kept as counter documents in the `stats` collection, so
+# reading them costs the same however many ads there are:
+#
+#   {"_id": "ads", "collection": "ads", "field": None, "value": None, "count": 1200}
+#   {"_id": "ads:category:Contactos", "collection": "ads", "field": "category", "value": "Contactos", "count": 800}
+#
+# Every collection has a total, plus one counter per value of its COUNTED_FIELDS.
+# The services move the counters with `$inc` after each create, update and
+# delete, from the documents before and after the write. Counting is best
+# effort: a failed counter update is logged, not raised, and a write that lands
+# while a reconciliation runs may be miscounted. A periodic reconciliation job
+# recounts the collections with aggregations and overwrites any counter that drifted.
+#
+# Configuration:
+#   STATS_RECONCILE_SECONDS   Time between two reconciliations (default 3600)
+
+COLLECTION_NAME = "stats"
+RECONCILE_HANDLER = "reconcile_stats"
+RECONCILED_AT_ID = "reconciled_at"
+
+COUNTED_FIELDS: Dict[str, Tuple[str, ...]] = {
+    "accounts": ("is_active",),
+    "ads": ("category", "province", "account_id"),
+    "schedules": ("is_active",),
+}
+
+CounterKey = Tuple[str, Optional[str], object] # (collection, field, value); field is None for the total
+
+def _reconcile_seconds() -> int:
+    return int(os.getenv("STATS_RECONCILE_SECONDS", "3600"))
+
+def projection(collection: str) -> dict:
+    """The fields to read from a document before a write, to count it out afterwards."""
+    return {field: 1 for field in COUNTED_FIELDS[collection]}
+
+def counters(collection: str, document: Optional[dict]) -> Counter:
+    """The counters a document contributes to."""
+    if document is None:
+        return Counter()
+    return Counter([(collection, None, None)] + [(collection, field, document.get(field)) for field in COUNTED_FIELDS[collection]])
+
+def _counter_id(key: CounterKey) -> str:
+    collection, field, value = key
+    return collection if field is None else f"{collection}:{field}:{value}"
+
+async def _increment(db: AsyncIOMotorDatabase, changes: Counter):
+    operations = [
+        UpdateOne(
+            {"_id": _counter_id(key)},
+            {"$inc": {"count": delta}, "$setOnInsert": {"collection": key[0], "field": key[1], "value": key[2]}},
+            upsert=True,
+        )
+        for key, delta in changes.items() if delta
+    ]
+    if not operations:
+        return
+    try:
+        await db[COLLECTION_NAME].bulk_write(operations, ordered=False)
+    except Exception as e:
+        logger.warning(f"Could not update the statistics, the next reconciliation will correct them: {e}")
+
+async def record_changes(db: AsyncIOMotorDatabase, collection: str, changes: Iterable[Tuple[Optional[dict], Optional[dict]]]):
+    """Counts (before, after) pairs of written documents; None before a create and after a delete."""
+    total = Counter()
+    for before, after in changes:
+        total.update(counters(collection, after))
+        total.subtract(counters(collection, before))
+    await _increment(db, total)
+
+async def get_stats(db: AsyncIOMotorDatabase) -> Stats:
+    documents = await db[COLLECTION_NAME].find({}).to_list(length=None)
+    reconciled_at = None
+    totals: Dict[str, int] = {}
+    by_value: Dict[Tuple[str, str], Dict[str, int]] = {}
+    for document in documents:
+        if document["_id"] == RECONCILED_AT_ID:
+            reconciled_at = document["reconciled_at"]
+        elif document.get("field") is None:
+            totals[document["collection"]] = document["count"]
+        elif document["count"] > 0:
+            by_value.setdefault((document["collection"], document["field"]), {})[str(document["value"])] = document["count"]
+
+    return Stats(
+        accounts=ActiveStats(total=totals.get("accounts", 0), active=by_value.get(("accounts", "is_active"), {}).get("True", 0)),
+        ads=AdStats(
+            total=totals.get("ads", 0),
+            by_category=by_value.get(("ads", "category"), {}),
+            by_province=by_value.get(("ads", "province"), {}),
+            by_account=by_value.get(("ads", "account_id"), {}),
+        ),
+        schedules=ActiveStats(total=totals.get("schedules", 0), active=by_value.get(("schedules", "is_active"), {}).get("True", 0)),
+        reconciled_at=reconciled_at,
+    )
+
+async def count_actual(db: AsyncIOMotorDatabase) -> Counter:
+    """Recounts every counter from the collections themselves."""
+    actual = Counter()
+    for collection, fields in COUNTED_FIELDS.items():
+        actual[(collection, None, None)] = await db[collection].count_documents({})
+        for field in fields:
+            async for group in db[collection].aggregate([{"$group": {"_id": f"${field}", "count": {"$sum": 1}}}]):
+                actual[(collection, field, group["_id"])] = group["count"]
+    return actual
+
+@job_store.handler(RECONCILE_HANDLER)
+async def reconcile(db: AsyncIOMotorDatabase) -> dict:
+    """Overwrites the counters that drifted from the actual counts. Returns how many were corrected."""
+    actual = await count_actual(db)
+    stored = {
+        document["_id"]: document["count"]
+        async for document in db[COLLECTION_NAME].find({"_id": {"$ne": RECONCILED_AT_ID}}, {"count": 1})
+    }
+    operations = [
+        UpdateOne({"_id": _counter_id(key)}, {"$set": {"collection": key[0], "field": key[1], "value": key[2], "count": count}}, upsert=True)
+        for key, count in actual.items() if stored.get(_counter_id(key)) != count
+    ]
+    actual_ids = {_counter_id(key) for key in actual}
+    stale = [counter_id for counter_id in stored if counter_id not in actual_ids]
+    if operations:
+        await db[COLLECTION_NAME].bulk_write(operations, ordered=False)
+    if stale:
+        await db[COLLECTION_NAME].delete_many({"_id": {"$in": stale}})
+    await db[COLLECTION_NAME].replace_one({"_id": RECONCILED_AT_ID}, {"reconciled_at": datetime.utcnow()}, upsert=True)
+
+    # Counters of values that no longer exist are dropped; they only drifted if not already at zero.
+    corrected = len(operations) + sum(1 for counter_id in stale if stored[counter_id])
+    if corrected:
+        logger.warning(f"Reconciliation corrected {corrected} statistics counters.")
+    return {"corrected": corrected, "counters": len(actual)}
+
+async def schedule_reconciliation(db: AsyncIOMotorDatabase):
+    """
+    Schedules the repeating reconciliation job, with a first run right away.
+    Every process calls this on startup; an existing schedule is kept, so
+    deploys and restarts do not trigger a recount each.
+    """
+    await job_store.AsyncMongoJobStore.for_database(db).add_job(
+        RECONCILE_HANDLER, {}, datetime.utcnow(), interval_seconds=_reconcile_seconds(), job_id=RECONCILE_HANDLER, replace_existing=False,
+    )
@@ -2,9 +2,10 @@ import pytest
 import httpx
 from asgi_lifespan import LifespanManager
 from app.backend.main import app as main_app
-from app.backend.api import accounts, ads, schedules
+from app.backend.api import accounts, ads, schedules, admin, jobs, metrics, stats
 from motor.motor_asyncio import AsyncIOMotorDatabase
 import mongomock_motor
+from app.backend.services import cache
 import asyncio
 
 # --- Mocking Services ---
@@ -13,9 +14,15 @@ def mock_services(session_mocker):
     """Mocks services for the entire test session."""
     session_mocker.patch("app.backend.services.scheduler_service.initialize_scheduler", return_value=None)
     session_mocker.patch("app.backend.services.scheduler_service.shutdown_scheduler", return_value=None)
-    session_mocker.patch("app.backend.api.schedules.sched_svc.schedule_ad_posting_job", return_value=None)
-    session_mocker.patch("app.backend.api.schedules.sched_svc.remove_schedule", return_value=None)
-    session_mocker.patch("app.backend.services.automation_service.post_ad_to_wanuncios", return_value=None)
+    session_mocker.patch("app.backend.services.job_queue.start_workers", return_value=None)
+    session_mocker.patch("app.backend.services.job_queue.stop_workers", return_value=None)
+    session_mocker.patch("app.backend.services.automation_service.post_ad_to_wanuncios", return_value=True)
+
+@pytest.fixture(scope="session", autouse=True)
+def gridfs_integration():
+    """Lets GridFS buckets run on the mongomock database."""
+    with mongomock_motor.enabled_gridfs_integration():
+        yield
 
 # --- Mocking the Database ---
 @pytest.fixture(scope="session")
@@ -32,6 +39,10 @@ def override_db_dependency(mock_db):
     main_app.dependency_overrides[accounts.get_database] = override_get_database
     main_app.dependency_overrides[ads.get_database] = override_get_database
     main_app.dependency_overrides[schedules.get_database] = override_get_database
+    main_app.dependency_overrides[admin.get_database] = override_get_database
+    main_app.dependency_overrides[jobs.get_database] = override_get_database
+    main_app.dependency_overrides[metrics.get_database] = override_get_database
+    main_app.dependency_overrides[stats.get_database] = override_get_database
     yield
     main_app.dependency_overrides = {}
 
@@ -51,9 +62,16 @@ async def client(anyio_backend):
         async with httpx.AsyncClient(transport=transport, base_url="http://test") as c:
             yield c
 
+@pytest.fixture
+def admin_headers(monkeypatch):
+    """Headers that authenticate a request to the /admin endpoints."""
+    monkeypatch.setenv("ADMIN_TOKEN", "secret")
+    return {"X-Admin-Token": "secret"}
+
 @pytest.fixture(scope="function", autouse=True)
 async def clear_collections(mock_db):
-    """Clears all data from the mock database after each test."""
+    """Clears all data from the mock database and the entity caches after each test."""
     yield
+    cache.clear_all()
     for collection in await mock_db.list_collection_names():
         await mock_db[collection].delete_many({})
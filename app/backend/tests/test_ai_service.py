@@ -0,0 +1,212 @@
+import asyncio
+import json
+import threading
+import time
+import uuid
+import pytest
+
+from app.backend.services import ai_service
+
+@pytest.fixture
+def llm(monkeypatch):
+    """Replaces the LLM call with a slow fake that records the prompts and threads it ran on."""
+    monkeypatch.setenv("UNIVERSAL_KEY", "test-key")
+    calls = []
+
+    def generate(prompt, model, universal_key):
+        calls.append((prompt, threading.get_ident()))
+        time.sleep(0.05)
+        return f"Generated: {prompt}"
+
+    monkeypatch.setattr(ai_service, "_generate_sync", generate)
+    return calls
+
+@pytest.mark.asyncio
+async def test_identical_prompts_share_one_generation(client, mock_db, llm):
+    prompt = f"Coalesced ad {time.time()}"
+    texts = await asyncio.gather(*(ai_service.generate_ad_text(prompt, db=mock_db) for _ in range(5)))
+
+    assert texts == [f"Generated: {prompt}"] * 5
+    assert len(llm) == 1
+    assert llm[0][1] != threading.get_ident() # Ran off the event loop thread
+
+    # Same prompt up to whitespace: served from memory, then from Mongo once memory is cleared
+    before = ai_service.stats()
+    assert await ai_service.generate_ad_text(f"  {prompt.replace(' ', '   ')} ", db=mock_db) == texts[0]
+    ai_service._get_memory_cache().clear()
+    assert await ai_service.generate_ad_text(prompt, db=mock_db) == texts[0]
+    assert len(llm) == 1
+
+    after = ai_service.stats()
+    assert after["memory"] == before["memory"] + 1
+    assert after["persistent"] == before["persistent"] + 1
+    assert after["hit_rate"] > 0
+
+@pytest.mark.asyncio
+async def test_generate_text_endpoint_does_not_block_the_loop(client, llm, admin_headers):
+    ticks = 0
+    async def ticker():
+        nonlocal ticks
+        while True:
+            await asyncio.sleep(0.005)
+            ticks += 1
+
+    ticking = asyncio.create_task(ticker())
+    try:
+        response = await client.post("/api/ads/generate-text", json={"prompt": f"Loop ad {time.time()}"})
+    finally:
+        ticking.cancel()
+    assert response.status_code == 200
+    assert response.json()["generated_text"].startswith("Generated: Loop ad")
+    assert ticks >= 3
+
+    stats = (await client.get("/api/admin/ai-cache", headers=admin_headers)).json()
+    assert stats["generated"] >= 1
+
+@pytest.fixture
+def streaming_llm(monkeypatch):
+    """A fake streaming LLM producing five chunks 50 ms apart; returns the chunks produced so far."""
+    monkeypatch.setenv("UNIVERSAL_KEY", "test-key")
+    produced = []
+
+    def stream(prompt, model, universal_key):
+        for index in range(5):
+            time.sleep(0.05)
+            produced.append(index)
+            yield f"chunk{index} "
+
+    monkeypatch.setattr(ai_service, "_stream_sync", stream)
+    return produced
+
+def _parse_sse(body: str) -> list:
+    events = []
+    for block in body.strip().split("\n\n"):
+        fields = dict(line.split(": ", 1) for line in block.splitlines())
+        events.append((fields["event"], json.loads(fields["data"])))
+    return events
+
+@pytest.mark.asyncio
+async def test_generate_text_streams_server_sent_events(client, streaming_llm):
+    prompt = f"Streamed ad {time.time()}"
+    response = await client.post("/api/ads/generate-text", params={"stream": "true"}, json={"prompt": prompt})
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/event-stream")
+
+    events = _parse_sse(response.text)
+    assert [event for event, _ in events] == ["token"] * 5 + ["done"]
+    assert events[-1][1]["generated_text"] == "chunk0 chunk1 chunk2 chunk3 chunk4 "
+
+    # The streamed text was cached: the JSON mode now answers without generating
+    response = await client.post("/api/ads/generate-text", headers={"Accept": "application/json"}, json={"prompt": prompt})
+    assert response.json() == {"generated_text": "chunk0 chunk1 chunk2 chunk3 chunk4 "}
+    assert len(streaming_llm) == 5
+
+@pytest.mark.asyncio
+async def test_stream_yields_before_generation_ends_and_stops_when_closed(client, mock_db, streaming_llm):
+    started = time.perf_counter()
+    chunks = ai_service.stream_ad_text(f"Cancelled ad {time.time()}", db=mock_db)
+    assert await chunks.__anext__() == "chunk0 "
+    assert time.perf_counter() - started < 0.2 # Well before the 250 ms the whole text takes
+
+    await chunks.aclose()
+    await asyncio.sleep(0.2)
+    assert len(streaming_llm) < 5
+
+@pytest.mark.asyncio
+async def test_identical_streams_and_requests_share_one_generation(client, mock_db, streaming_llm):
+    prompt = f"Shared stream {time.time()}"
+
+    async def stream() -> str:
+        return "".join([chunk async for chunk in ai_service.stream_ad_text(prompt, db=mock_db)])
+
+    first = asyncio.create_task(stream())
+    await asyncio.sleep(0.08) # The first stream is under way
+    texts = await asyncio.gather(first, stream(), ai_service.generate_ad_text(prompt, db=mock_db))
+
+    assert texts == ["chunk0 chunk1 chunk2 chunk3 chunk4 "] * 3
+    assert len(streaming_llm) == 5
+    assert not ai_service._in_flight
+
+async def _create_ad(client) -> str:
+    account = await client.post("/api/accounts/", json={"email": f"batch-{uuid.uuid4()}@example.com", "wanuncios_password": "password"})
+    ad = {"account_id": account.json()["id"], "title": "Batch ad", "description": "Old", "category": "Contactos", "subcategory": "Relaciones Ocasionales", "province": "Panamá"}
+    return (await client.post("/api/ads/", json=ad)).json()["id"]
+
+@pytest.mark.asyncio
+async def test_batch_streams_results_with_bounded_concurrency_and_timeouts(client, monkeypatch):
+    monkeypatch.setenv("UNIVERSAL_KEY", "test-key")
+    monkeypatch.setenv("AI_BATCH_CONCURRENCY", "2")
+    monkeypatch.setenv("AI_BATCH_ITEM_TIMEOUT_SECONDS", "0.2")
+    running, peak = 0, 0
+    lock = threading.Lock()
+
+    def generate(prompt, model, universal_key):
+        nonlocal running, peak
+        with lock:
+            running += 1
+            peak = max(peak, running)
+        time.sleep(0.5 if "slow" in prompt else 0.02)
+        with lock:
+            running -= 1
+        return f"Generated: {prompt}"
+
+    monkeypatch.setattr(ai_service, "_generate_sync", generate)
+    ad_id = await _create_ad(client)
+    batch_id = time.time()
+    items = [{"prompt": f"Batch {batch_id} {index}"} for index in range(5)]
+    items[0]["ad_id"] = ad_id
+    items.append({"prompt": f"Batch {batch_id} slow", "ad_id": "missing"})
+
+    response = await client.post("/api/ads/generate-text/batch", json={"items": items, "write_to_ads": True})
+    assert response.status_code == 200
+    events = _parse_sse(response.text)
+    results = {data["index"]: data for event, data in events if event == "result"}
+    assert sorted(results) == list(range(6))
+    assert results[0]["generated_text"] == f"Generated: Batch {batch_id} 0"
+    assert results[5]["status"] == "timeout"
+    assert peak <= 2
+    assert events[-1] == ("done", {"total": 6, "generated": 5, "written_ad_ids": [ad_id]})
+
+    ad = (await client.get(f"/api/ads/{ad_id}")).json()
+    assert ad["description"] == f"Generated: Batch {batch_id} 0"
+    assert ad["version"] == 1
+
+@pytest.mark.asyncio
+async def test_batch_runs_as_a_job(client, mock_db, llm):
+    from app.backend.services import job_queue
+
+    ad_id = await _create_ad(client)
+    prompt = f"Queued batch {time.time()}"
+    response = await client.post("/api/ads/generate-text/batch", params={"mode": "job"}, json={"items": [{"prompt": prompt, "ad_id": ad_id}], "write_to_ads": True})
+    assert response.status_code == 202
+    batch_id, job_id = response.json()["batch_id"], response.json()["job_id"]
+    assert (await client.get(f"/api/ads/generate-text/batch/{batch_id}")).json()["status"] == "queued"
+
+    assert await job_queue.run_next(mock_db, worker="test-worker") == job_id
+    batch = (await client.get(f"/api/ads/generate-text/batch/{batch_id}")).json()
+    assert batch["status"] == "succeeded"
+    assert batch["results"] == [{"index": 0, "ad_id": ad_id, "status": "generated", "generated_text": f"Generated: {prompt}", "detail": None}]
+    assert batch["written_ad_ids"] == [ad_id]
+    assert (await client.get(f"/api/ads/{ad_id}")).json()["description"] == f"Generated: {prompt}"
+
+    assert (await client.post("/api/ads/generate-text/batch", json={"items": []})).status_code == 400
+    assert (await client.get("/api/ads/generate-text/batch/missing")).status_code == 404
+
+@pytest.mark.asyncio
+async def test_retried_batch_keeps_the_texts_generated_before(client, mock_db, llm):
+    from app.backend.services import ai_batch_service
+    from app.backend.models.generation import AdTextBatchItem
+
+    prompts = [f"Retried batch {time.time()} {index}" for index in range(2)]
+    batch = await ai_batch_service.create_batch(mock_db, [AdTextBatchItem(prompt=prompt) for prompt in prompts])
+    # The first attempt generated item 0 and failed on item 1 before the worker died
+    await mock_db.ai_batches.update_one({"_id": batch.id}, {"$set": {"status": "running", "results": [
+        {"index": 0, "ad_id": None, "status": "generated", "generated_text": "Kept", "detail": None},
+        {"index": 1, "ad_id": None, "status": "failed", "generated_text": None, "detail": "LLM down"},
+    ]}})
+
+    await ai_batch_service.run_batch(mock_db, batch.id)
+    stored = await ai_batch_service.get_batch(mock_db, batch.id)
+    assert stored.status == "succeeded"
+    assert sorted((result.index, result.generated_text) for result in stored.results) == [(0, "Kept"), (1, f"Generated: {prompts[1]}")]
+    assert [prompt for prompt, _ in llm] == [prompts[1]]
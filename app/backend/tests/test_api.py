@@ -1,5 +1,6 @@
 import pytest
 import uuid
+from datetime import datetime, timedelta
 
 BASE_URL = "http://test"
 
@@ -92,3 +93,292 @@ async def test_schedules_crud(client):
     # --- DELETE SCHEDULE ---
     response = await client.delete(f"/api/schedules/{schedule_id}")
     assert response.status_code == 204
+
+@pytest.mark.asyncio
+async def test_ads_cursor_pagination(client):
+    res_acc = await client.post("/api/accounts/", json={"email": f"test-page-{uuid.uuid4()}@example.com", "wanuncios_password": "password"})
+    account_id = res_acc.json()["id"]
+
+    created_ids = []
+    for i in range(5):
+        ad_data = { "account_id": account_id, "title": f"Page Ad {i}", "description": "d", "category": "Contactos", "subcategory": "Relaciones Ocasionales", "province": "Panamá" }
+        response = await client.post("/api/ads/", json=ad_data)
+        created_ids.append(response.json()["id"])
+
+    # --- Walk every page with the cursor returned by the previous one ---
+    seen_ids = []
+    response = await client.get("/api/ads/", params={"limit": 2})
+    while True:
+        assert response.status_code == 200
+        seen_ids.extend(ad["id"] for ad in response.json())
+        next_cursor = response.headers.get("X-Next-Cursor")
+        if not next_cursor:
+            break
+        response = await client.get("/api/ads/", params={"limit": 2, "cursor": next_cursor})
+    assert seen_ids == created_ids
+
+    # --- Offset pagination still works for old clients ---
+    response = await client.get("/api/ads/", params={"skip": 3, "limit": 2})
+    assert [ad["id"] for ad in response.json()] == created_ids[3:]
+
+    response = await client.get("/api/ads/", params={"cursor": "not-a-cursor"})
+    assert response.status_code == 400
+
+@pytest.mark.asyncio
+async def test_index_bootstrap(client, mock_db, admin_headers):
+    from app.backend.services import index_service
+
+    await index_service.ensure_indexes(mock_db)
+    second_run = await index_service.ensure_indexes(mock_db)
+    assert all(not result["created"] and not result["rebuilt"] for result in second_run.values())
+
+    indexes = await mock_db.schedules.index_information()
+    assert {"id_unique", "ad_id", "next_republish_at"} <= set(indexes)
+    assert indexes["id_unique"]["unique"] is True
+
+    # A changed definition is only reported at startup, and rebuilt through the sync endpoint
+    await mock_db.schedules.drop_index("ad_id")
+    await mock_db.schedules.create_index([("ad_id", -1)], name="ad_id")
+    assert (await index_service.ensure_indexes(mock_db))["schedules"]["mismatched"] == ["ad_id"]
+    assert index_service._index_key((await mock_db.schedules.index_information())["ad_id"]) == [("ad_id", -1)]
+    response = await client.post("/api/admin/indexes/sync", headers=admin_headers)
+    assert response.json()["schedules"]["rebuilt"] == ["ad_id"]
+    assert index_service._index_key((await mock_db.schedules.index_information())["ad_id"]) == [("ad_id", 1)]
+
+    assert (await client.get("/api/admin/indexes")).status_code == 403
+    assert (await client.post("/api/admin/indexes/sync", headers={"X-Admin-Token": "wrong"})).status_code == 403
+    response = await client.get("/api/admin/indexes", headers=admin_headers)
+    assert response.status_code == 200
+    report = {collection["name"]: collection for collection in response.json()["collections"]}
+    assert report["ads"]["missing_declared"] == []
+
+@pytest.mark.asyncio
+async def test_ads_export(client):
+    import csv
+    import io
+    import json
+
+    res_acc = await client.post("/api/accounts/", json={"email": f"test-export-{uuid.uuid4()}@example.com", "wanuncios_password": "password"})
+    account_id = res_acc.json()["id"]
+    for i in range(3):
+        ad_data = { "account_id": account_id, "title": f"Export Ad {i}", "description": "d", "category": "Contactos", "subcategory": "Relaciones Ocasionales", "province": "Panamá", "images": ["a.jpg", "b.jpg"] }
+        await client.post("/api/ads/", json=ad_data)
+
+    response = await client.get("/api/ads/export", params={"account_id": account_id})
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/x-ndjson"
+    rows = [json.loads(line) for line in response.text.splitlines()]
+    assert [row["title"] for row in rows] == ["Export Ad 0", "Export Ad 1", "Export Ad 2"]
+    assert "_id" not in rows[0]
+
+    # --- CSV, gzip-compressed on the wire ---
+    response = await client.get("/api/ads/export", params={"format": "csv", "gzip": True, "account_id": account_id})
+    assert response.status_code == 200
+    assert response.headers["content-encoding"] == "gzip"
+    records = list(csv.DictReader(io.StringIO(response.text)))
+    assert len(records) == 3
+    assert json.loads(records[0]["images"]) == ["a.jpg", "b.jpg"]
+
+@pytest.mark.asyncio
+async def test_ads_bulk(client):
+    res_acc = await client.post("/api/accounts/", json={"email": f"test-bulk-{uuid.uuid4()}@example.com", "wanuncios_password": "password"})
+    account_id = res_acc.json()["id"]
+    ad_data = { "title": "Bulk Ad", "description": "d", "category": "Contactos", "subcategory": "Relaciones Ocasionales", "province": "Panamá" }
+
+    # --- BULK CREATE: one item points to a missing account ---
+    items = [{**ad_data, "account_id": account_id}, {**ad_data, "account_id": "missing"}, {**ad_data, "account_id": account_id}]
+    response = await client.post("/api/ads/bulk", json=items)
+    assert response.status_code == 200
+    results = response.json()
+    assert [result["status"] for result in results] == ["created", "error", "created"]
+    ad_ids = [results[0]["id"], results[2]["id"]]
+
+    # --- BULK UPDATE ---
+    response = await client.patch("/api/ads/bulk", json=[{"id": ad_ids[0], "price": 10.0}, {"id": "missing", "price": 1.0}])
+    assert [result["status"] for result in response.json()] == ["updated", "not_found"]
+    response = await client.get(f"/api/ads/{ad_ids[0]}")
+    assert response.json()["price"] == 10.0
+
+    # --- BULK DELETE ---
+    response = await client.request("DELETE", "/api/ads/bulk", json={"ids": ad_ids + ["missing"]})
+    assert [result["status"] for result in response.json()] == ["deleted", "deleted", "not_found"]
+    response = await client.get(f"/api/ads/{ad_ids[1]}")
+    assert response.status_code == 404
+
+@pytest.mark.asyncio
+async def test_ads_list_projection(client):
+    res_acc = await client.post("/api/accounts/", json={"email": f"test-view-{uuid.uuid4()}@example.com", "wanuncios_password": "password"})
+    account_id = res_acc.json()["id"]
+    ad_data = { "account_id": account_id, "title": "View Ad", "description": "A long description", "category": "Contactos", "subcategory": "Relaciones Ocasionales", "province": "Panamá", "images": ["a.jpg"] }
+    ad_id = (await client.post("/api/ads/", json=ad_data)).json()["id"]
+
+    response = await client.get("/api/ads/", params={"view": "summary"})
+    assert response.status_code == 200
+    summary = response.json()[0]
+    assert summary["id"] == ad_id and summary["title"] == "View Ad"
+    assert "description" not in summary and "images" not in summary
+
+    response = await client.get("/api/ads/", params={"fields": "title,province"})
+    assert response.json() == [{"id": ad_id, "title": "View Ad", "province": "Panamá"}]
+
+    response = await client.get("/api/ads/", params={"fields": "title,nope"})
+    assert response.status_code == 400
+
+    response = await client.get("/api/accounts/", params={"view": "summary"})
+    assert "wanuncios_password" not in response.json()[0]
+
+@pytest.mark.asyncio
+async def test_ads_search_filters_and_facets(client, monkeypatch):
+    res_acc = await client.post("/api/accounts/", json={"email": f"test-search-{uuid.uuid4()}@example.com", "wanuncios_password": "password"})
+    account_id = res_acc.json()["id"]
+    ad_data = { "account_id": account_id, "title": "Search Ad", "description": "d", "category": "Contactos", "subcategory": "Relaciones Ocasionales" }
+    items = [
+        {**ad_data, "province": "Panamá", "zone": "Bella Vista", "price": 10.0},
+        {**ad_data, "province": "Panamá", "zone": "San Francisco", "price": 50.0},
+        {**ad_data, "province": "Chiriquí", "price": 30.0},
+        {**ad_data, "category": "Empleo", "subcategory": "Ventas", "province": "Panamá", "price": 20.0},
+    ]
+    ad_ids = [result["id"] for result in (await client.post("/api/ads/bulk", json=items)).json()]
+
+    response = await client.get("/api/ads/search", params={"category": "Contactos", "price_min": 20, "sort": "price_desc"})
+    assert response.status_code == 200
+    results = response.json()
+    assert [hit["id"] for hit in results["items"]] == [ad_ids[1], ad_ids[2]]
+    assert "description" not in results["items"][0] and results["items"][0]["score"] is None
+    assert results["total"] == 2 and results["total_exact"] is True
+    assert results["facets"]["province"] == [{"value": "Chiriquí", "count": 1}, {"value": "Panamá", "count": 1}]
+
+    response = await client.get("/api/ads/search", params={"province": "Panamá", "limit": 2})
+    results = response.json()
+    assert [hit["id"] for hit in results["items"]] == [ad_ids[3], ad_ids[1]]
+    assert results["total"] == 3
+    assert results["facets"]["category"] == [{"value": "Contactos", "count": 2}, {"value": "Empleo", "count": 1}]
+
+    # Exactly SEARCH_FACET_LIMIT matches are still counted exactly; one more is not
+    monkeypatch.setenv("SEARCH_FACET_LIMIT", "3")
+    results = (await client.get("/api/ads/search", params={"province": "Panamá"})).json()
+    assert results["total"] == 3 and results["total_exact"] is True
+    monkeypatch.setenv("SEARCH_FACET_LIMIT", "2")
+    results = (await client.get("/api/ads/search", params={"province": "Panamá"})).json()
+    assert results["total"] == 2 and results["total_exact"] is False
+    assert sum(entry["count"] for entry in results["facets"]["category"]) == 2
+
+    response = await client.get("/api/ads/search", params={"price_min": 50, "price_max": 10})
+    assert response.status_code == 400
+    response = await client.get("/api/ads/search", params={"sort": "relevance"})
+    assert response.status_code == 400
+
+def test_ads_search_text_pipeline(anyio_backend):
+    from app.backend.services import search_service
+
+    match = search_service.build_match(q="moto roja", filters={"province": "Panamá", "zone": None}, price_max=100)
+    assert match == {"province": "Panamá", "price": {"$lte": 100}, "$text": {"$search": "moto roja"}}
+
+    # $text has to be the first stage; hits are ranked by the text score, which is returned.
+    pipeline = search_service.build_hits_pipeline(match, "relevance", limit=5)
+    assert pipeline[0] == {"$match": match}
+    assert pipeline[1] == {"$sort": {"score": {"$meta": "textScore"}, "_id": -1}}
+    assert pipeline[-1]["$project"]["score"] == {"$meta": "textScore"}
+
+    facets = search_service.build_facets_pipeline(match, facet_limit=1000, facet_values=5)
+    assert facets[:2] == [{"$match": match}, {"$limit": 1001}]
+    assert set(facets[2]["$facet"]) == {"total", *search_service.FACET_FIELDS}
+
+@pytest.mark.asyncio
+async def test_stats_follow_writes_and_reconcile(client, mock_db, admin_headers):
+    account_id = (await client.post("/api/accounts/", json={"email": f"test-stats-{uuid.uuid4()}@example.com", "wanuncios_password": "password"})).json()["id"]
+    ad_data = { "account_id": account_id, "title": "Stats Ad", "description": "d", "category": "Contactos", "subcategory": "Relaciones Ocasionales", "province": "Panamá" }
+    ad_id = (await client.post("/api/ads/", json=ad_data)).json()["id"]
+    bulk_ids = [result["id"] for result in (await client.post("/api/ads/bulk", json=[{**ad_data, "province": "Colón"}] * 2)).json()]
+    await client.patch(f"/api/ads/{ad_id}", json={"category": "Empleo"})
+    await client.patch("/api/ads/bulk", json=[{"id": bulk_ids[0], "province": "Coclé"}])
+    await client.request("DELETE", "/api/ads/bulk", json={"ids": [bulk_ids[1]]})
+    schedule_id = (await client.post("/api/schedules/", json={"ad_id": ad_id, "republish_interval_hours": 12})).json()["id"]
+    await client.post("/api/schedules/", json={"ad_id": ad_id, "republish_interval_hours": 24})
+    await client.patch(f"/api/schedules/{schedule_id}", json={"is_active": False})
+
+    response = await client.get("/api/stats")
+    assert response.status_code == 200
+    stats = response.json()
+    assert stats["accounts"] == {"total": 1, "active": 1}
+    assert stats["ads"] == {
+        "total": 2,
+        "by_category": {"Empleo": 1, "Contactos": 1},
+        "by_province": {"Panamá": 1, "Coclé": 1},
+        "by_account": {account_id: 2},
+    }
+    assert stats["schedules"] == {"total": 2, "active": 1}
+
+    # Drift, e.g. from a write made outside the services, is corrected by the reconciliation.
+    await mock_db.ads.delete_one({"id": ad_id})
+    await mock_db.stats.update_one({"_id": "accounts"}, {"$inc": {"count": 5}})
+    response = await client.post("/api/admin/stats/reconcile", headers=admin_headers)
+    assert response.json()["corrected"] == 5
+    stats = (await client.get("/api/stats")).json()
+    assert stats["accounts"]["total"] == 1
+    assert stats["ads"]["total"] == 1 and stats["ads"]["by_category"] == {"Contactos": 1}
+    assert stats["reconciled_at"] is not None
+    assert (await client.post("/api/admin/stats/reconcile", headers=admin_headers)).json()["corrected"] == 0
+
+    # Every process schedules the reconciliation on startup without moving an existing schedule
+    from app.backend.services import stats_service
+    await stats_service.schedule_reconciliation(mock_db)
+    later = (datetime.utcnow() + timedelta(minutes=30)).replace(microsecond=0)
+    await mock_db.scheduled_jobs.update_one({"_id": stats_service.RECONCILE_HANDLER}, {"$set": {"next_run_at": later, "fence": 3}})
+    await stats_service.schedule_reconciliation(mock_db)
+    job = await mock_db.scheduled_jobs.find_one({"_id": stats_service.RECONCILE_HANDLER})
+    assert (job["next_run_at"], job["fence"], job["interval_seconds"]) == (later, 3, 3600)
+
+@pytest.mark.asyncio
+async def test_patch_returns_updated_document_and_checks_version(client):
+    res_acc = await client.post("/api/accounts/", json={"email": f"test-patch-{uuid.uuid4()}@example.com", "wanuncios_password": "password"})
+    account_id = res_acc.json()["id"]
+
+    response = await client.get(f"/api/accounts/{account_id}")
+    etag = response.headers["ETag"]
+
+    response = await client.patch(f"/api/accounts/{account_id}", json={"is_active": False}, headers={"If-Match": etag})
+    assert response.status_code == 200
+    assert response.json()["is_active"] is False
+    assert response.headers["ETag"] != etag
+
+    # --- A no-op update is not a 404 ---
+    response = await client.patch(f"/api/accounts/{account_id}", json={"is_active": False})
+    assert response.status_code == 200
+
+    # --- A stale version is rejected ---
+    response = await client.patch(f"/api/accounts/{account_id}", json={"is_active": True}, headers={"If-Match": etag})
+    assert response.status_code == 409
+
+    response = await client.patch("/api/accounts/missing", json={"is_active": True})
+    assert response.status_code == 404
+
+@pytest.mark.asyncio
+async def test_schedules_expand(client):
+    unique_email = f"test-expand-{uuid.uuid4()}@example.com"
+    res_acc = await client.post("/api/accounts/", json={"email": unique_email, "wanuncios_password": "password"})
+    account_id = res_acc.json()["id"]
+    ad_data = { "account_id": account_id, "title": "Expand Ad", "description": "d", "category": "Contactos", "subcategory": "Relaciones Ocasionales", "province": "Panamá" }
+    ad_id = (await client.post("/api/ads/", json=ad_data)).json()["id"]
+    schedule_id = (await client.post("/api/schedules/", json={"ad_id": ad_id, "republish_interval_hours": 6})).json()["id"]
+
+    response = await client.get(f"/api/schedules/{schedule_id}", params={"expand": "ad,account"})
+    assert response.status_code == 200
+    schedule = response.json()
+    assert schedule["ad"]["title"] == "Expand Ad"
+    assert schedule["account"]["email"] == unique_email
+
+    response = await client.get("/api/schedules/", params={"expand": "account"})
+    schedule = response.json()[0]
+    assert schedule["account"]["id"] == account_id and schedule["ad"] is None
+
+    response = await client.get(f"/api/ads/{ad_id}", params={"expand": "account"})
+    assert response.json()["account"]["email"] == unique_email
+
+    response = await client.get("/api/ads/", params={"expand": "schedule"})
+    assert response.status_code == 400
+
+    # --- Scheduling a missing ad does not leave an orphan schedule behind ---
+    response = await client.post("/api/schedules/", json={"ad_id": "missing", "republish_interval_hours": 6})
+    assert response.status_code == 404
+    assert len((await client.get("/api/schedules/")).json()) == 1
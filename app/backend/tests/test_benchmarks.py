@@ -0,0 +1,35 @@
+import json
+import pytest
+
+from app.backend.benchmarks import api_benchmark, image_benchmark, serialization_benchmark
+
+@pytest.mark.asyncio
+async def test_benchmark_suite_runs_every_scenario(client, mock_db):
+    results = await api_benchmark.run(ads=50, requests=10, concurrency=2, scenarios=list(api_benchmark.SCENARIOS), mongo_url=None)
+
+    assert set(results["scenarios"]) == set(api_benchmark.SCENARIOS)
+    for name, scenario in results["scenarios"].items():
+        assert scenario["errors"] == 0, (name, scenario["first_error"])
+        assert scenario["p50_ms"] <= scenario["p95_ms"] <= scenario["p99_ms"]
+
+def test_regressions_beyond_the_threshold_are_reported(anyio_backend):
+    baseline = {"scenarios": {"get": {"p95_ms": 10.0, "throughput_ops": 100.0}}}
+    within = {"scenarios": {"get": {"p95_ms": 11.0, "throughput_ops": 90.0, "errors": 0}}}
+    slower = {"scenarios": {"get": {"p95_ms": 15.0, "throughput_ops": 60.0, "errors": 0}, "new": {"p95_ms": 1.0, "throughput_ops": 1.0, "errors": 0}}}
+
+    assert api_benchmark.compare(within, baseline, threshold=0.25) == []
+    assert len(api_benchmark.compare(slower, baseline, threshold=0.25)) == 2
+
+def test_fast_serialization_matches_the_validated_path(anyio_backend):
+    page = serialization_benchmark.documents(20)
+    assert json.loads(serialization_benchmark.fast(page)) == json.loads(serialization_benchmark.validated(page))
+
+    results = serialization_benchmark.run(items=20, repeat=2)
+    assert set(results["paths"]) == {"validated", "fast"}
+
+@pytest.mark.asyncio
+async def test_image_benchmark_reports_throughput_per_core(anyio_backend):
+    pytest.importorskip("PIL")
+    results = await image_benchmark.run(count=2, width=400, height=300, worker_counts=[1])
+    assert results["runs"][0]["workers"] == 1
+    assert results["runs"][0]["images_per_second_per_core"] > 0
@@ -0,0 +1,82 @@
+import pytest
+import uuid
+
+from app.backend.services import cache
+from app.backend.services.cache import MemoryCache
+
+@pytest.mark.asyncio
+async def test_memory_cache_lru_and_ttl(anyio_backend, monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(cache.time, "monotonic", lambda: now[0])
+    lru = MemoryCache("test", max_entries=2, ttl_seconds=10)
+
+    lru.set("a", 1)
+    lru.set("b", 2)
+    assert lru.get("a") == 1 # "a" becomes the most recently used entry
+    lru.set("c", 3)
+    assert lru.get("b") is None
+    assert lru.evictions == 1
+
+    now[0] += 11
+    assert lru.get("a") is None
+    assert lru.stats()["hits"] == 1 and lru.stats()["misses"] == 2
+
+    class Incomplete(cache.Cache):
+        def get(self, key):
+            return None
+
+    with pytest.raises(TypeError): # Fails when built, not on its first set()
+        Incomplete("incomplete")
+
+@pytest.mark.asyncio
+async def test_account_reads_are_cached_and_invalidated(client, mock_db, admin_headers):
+    response = await client.post("/api/accounts/", json={"email": f"test-cache-{uuid.uuid4()}@example.com", "wanuncios_password": "password"})
+    account_id = response.json()["id"]
+
+    published = []
+    async def subscriber(name, keys):
+        published.append((name, keys))
+    cache.subscribe(subscriber)
+    try:
+        await client.get(f"/api/accounts/{account_id}")
+        hits = cache.get_cache("accounts").hits
+        await client.get(f"/api/accounts/{account_id}")
+        assert cache.get_cache("accounts").hits == hits + 1
+
+        response = await client.patch(f"/api/accounts/{account_id}", json={"is_active": False})
+        assert response.json()["is_active"] is False
+        assert ("accounts", [account_id]) in published
+        # Not cached from the update, which may race with a newer one: read again from Mongo
+        assert cache.get_cache("accounts").get(account_id) is None
+        assert (await client.get(f"/api/accounts/{account_id}")).json()["is_active"] is False
+    finally:
+        cache.unsubscribe(subscriber)
+
+    response = await client.get("/api/admin/cache", headers=admin_headers)
+    assert "accounts" in [stats["name"] for stats in response.json()]
+
+@pytest.mark.asyncio
+async def test_load_overtaken_by_an_invalidation_is_not_cached(anyio_backend):
+    import asyncio
+
+    name, key = f"test-{uuid.uuid4()}", "a"
+    loading, release = asyncio.Event(), asyncio.Event()
+
+    async def stale_loader():
+        loading.set()
+        await release.wait()
+        return "before the write"
+
+    load = asyncio.create_task(cache.get_or_load(name, key, stale_loader))
+    await loading.wait()
+    await cache.invalidate(name, key) # The write lands while the loader is suspended
+    release.set()
+    assert await load == "before the write"
+    assert cache.get_cache(name).get(key) is None
+
+    async def loader():
+        return "after the write"
+
+    assert await cache.get_or_load(name, key, loader) == "after the write"
+    assert cache.get_cache(name).get(key) == "after the write"
+    assert not cache._loading
@@ -0,0 +1,159 @@
+import asyncio
+import uuid
+import pytest
+from bson import ObjectId
+from datetime import datetime
+from pymongo.errors import AutoReconnect, OperationFailure
+
+from app.backend.api import events as events_api
+from app.backend.services import job_runs, live_events
+
+async def _create_account(client) -> str:
+    response = await client.post("/api/accounts/", json={"email": f"events-{uuid.uuid4()}@example.com", "wanuncios_password": "secret"})
+    return response.json()["id"]
+
+async def _create_ad(client, account_id: str, title: str = "Live ad") -> str:
+    ad = {"account_id": account_id, "title": title, "description": "d", "category": "Contactos", "subcategory": "Relaciones Ocasionales", "province": "Panamá"}
+    return (await client.post("/api/ads/", json=ad)).json()["id"]
+
+@pytest.mark.asyncio
+async def test_writes_are_published_to_matching_subscribers(client):
+    account_id = await _create_account(client)
+    other_account_id = await _create_account(client)
+    everything = live_events.subscribe()
+    own_ads = live_events.subscribe(collections=["ads"], account_id=account_id)
+    try:
+        ad_id = await _create_ad(client, account_id)
+        await _create_ad(client, other_account_id)
+        event = await own_ads.next(timeout=1)
+        assert (event["collection"], event["operation"], event["id"], event["account_id"]) == ("ads", "insert", ad_id, account_id)
+        assert event["document"]["title"] == "Live ad" and "description" not in event["document"]
+
+        await client.patch(f"/api/ads/{ad_id}", json={"title": "Renamed"})
+        event = await own_ads.next(timeout=1)
+        assert (event["operation"], event["document"]["title"]) == ("update", "Renamed")
+
+        await client.request("DELETE", "/api/ads/bulk", json={"ids": [ad_id]})
+        event = await own_ads.next(timeout=1)
+        assert (event["operation"], event["id"], event["document"]) == ("delete", ad_id, None)
+        assert await own_ads.next(timeout=0.05) is None # The other account's ad was filtered out
+
+        account = await client.post("/api/accounts/", json={"email": f"events-{uuid.uuid4()}@example.com", "wanuncios_password": "secret"})
+        received = []
+        while (event := await everything.next(timeout=0.05)) is not None:
+            received.append(event)
+        # Not read meanwhile: the insert, update and delete of the first ad were coalesced.
+        assert [(event["collection"], event["operation"]) for event in received] == [("ads", "delete"), ("ads", "insert"), ("accounts", "insert")]
+        assert everything.coalesced == 2
+        assert received[-1]["id"] == account.json()["id"]
+        assert "wanuncios_password" not in received[-1]["document"]
+    finally:
+        live_events.unsubscribe(everything)
+        live_events.unsubscribe(own_ads)
+
+@pytest.mark.asyncio
+async def test_publication_descriptions_and_image_changes_are_published(client, mock_db):
+    from app.backend.services import ad_service
+
+    ad_id = await _create_ad(client, await _create_account(client))
+    subscription = live_events.subscribe(collections=["ads"])
+    try:
+        await ad_service.mark_published(mock_db, ad_id, datetime.utcnow())
+        assert (await subscription.next(timeout=1))["operation"] == "update"
+        assert await ad_service.set_descriptions(mock_db, {ad_id: "Generated", "missing": "Nothing"}) == {ad_id}
+        assert (await subscription.next(timeout=1))["id"] == ad_id
+        image = "a" * 64
+        assert await ad_service.attach_image(mock_db, ad_id, image)
+        assert (await subscription.next(timeout=1))["id"] == ad_id
+        assert await ad_service.detach_image(mock_db, ad_id, image)
+        assert (await subscription.next(timeout=1))["id"] == ad_id
+        assert await subscription.next(timeout=0.05) is None
+    finally:
+        live_events.unsubscribe(subscription)
+
+@pytest.mark.asyncio
+async def test_watcher_only_drops_its_resume_token_when_it_cannot_resume(client, mock_db, monkeypatch):
+    class FailingStream:
+        def __init__(self, error):
+            self.error = error
+
+        def __aiter__(self):
+            return self
+
+        async def __anext__(self):
+            raise self.error
+
+        async def close(self):
+            pass
+
+    resumed_after = []
+    async def open_stream(db, resume_after=None):
+        resumed_after.append(resume_after)
+        if len(resumed_after) == 1:
+            return FailingStream(OperationFailure("History lost", code=286)), None
+        raise asyncio.CancelledError # Ends the watcher
+
+    monkeypatch.setattr(live_events, "_open_stream", open_stream)
+    monkeypatch.setattr(live_events, "RETRY_DELAY_SECONDS", 0)
+    change = {"_id": {"_data": "token"}, "operationType": "drop", "ns": {"coll": "ads"}}
+    with pytest.raises(asyncio.CancelledError):
+        await live_events._watch(mock_db, FailingStream(AutoReconnect("Network blip")), change)
+    # Resumed from the token after the network error, from now on once the history was lost
+    assert resumed_after == [{"_data": "token"}, None]
+
+@pytest.mark.asyncio
+async def test_slow_subscribers_get_coalesced_events_then_are_disconnected(client, mock_db):
+    account_id = await _create_account(client)
+    subscription = live_events.subscribe(collections=["ads", "job_runs"], max_pending=2)
+    ad_id = await _create_ad(client, account_id)
+    await client.patch(f"/api/ads/{ad_id}", json={"title": "Second"})
+    await client.patch(f"/api/ads/{ad_id}", json={"title": "Third"})
+    async with job_runs.record(mock_db, "queue", "publish_ad", ad_id=ad_id):
+        pass
+    assert subscription.coalesced == 2
+
+    await _create_ad(client, account_id) # A third document pending: disconnected
+    assert subscription.overflowed and subscription not in live_events._subscriptions
+    event = await subscription.next()
+    assert (event["operation"], event["document"]["title"]) == ("insert", "Third")
+    assert (await subscription.next())["collection"] == "job_runs"
+    with pytest.raises(OverflowError):
+        await subscription.next()
+
+@pytest.mark.asyncio
+async def test_change_stream_documents_become_events(client, mock_db):
+    insert = {"_id": {"_data": "1"}, "operationType": "insert", "ns": {"db": "test", "coll": "accounts"}, "fullDocument": {"_id": ObjectId(), "id": "a1", "email": "e@example.com", "wanuncios_password": "secret", "is_active": True}}
+    event = await live_events.from_change(mock_db, insert)
+    assert (event["collection"], event["operation"], event["id"], event["account_id"]) == ("accounts", "insert", "a1", "a1")
+    assert event["document"] == {"id": "a1", "email": "e@example.com", "is_active": True}
+
+    replace = {**insert, "operationType": "replace", "ns": {"coll": "ads"}, "fullDocument": {"id": "ad1", "account_id": "a1", "title": "T"}}
+    assert (await live_events.from_change(mock_db, replace))["operation"] == "update"
+
+    delete = {"operationType": "delete", "ns": {"coll": "ads"}, "documentKey": {"_id": ObjectId()}, "fullDocumentBeforeChange": {"id": "ad1", "account_id": "a1"}}
+    event = await live_events.from_change(mock_db, delete)
+    assert (event["operation"], event["id"], event["account_id"], event["document"]) == ("delete", "ad1", "a1", None)
+    del delete["fullDocumentBeforeChange"] # No pre-image: only the _id is known
+    assert (await live_events.from_change(mock_db, delete))["id"] is None
+
+    run_id = ObjectId()
+    run = {"operationType": "insert", "ns": {"coll": "job_runs"}, "fullDocument": {"_id": run_id, "handler": "publish_ad", "outcome": "failed", "account_id": "a1"}}
+    event = await live_events.from_change(mock_db, run)
+    assert (event["id"], event["account_id"], event["document"]["outcome"]) == (str(run_id), "a1", "failed")
+
+    assert await live_events.from_change(mock_db, {**insert, "ns": {"coll": "cache_invalidations"}}) is None
+    assert await live_events.from_change(mock_db, {**insert, "operationType": "drop"}) is None
+
+@pytest.mark.asyncio
+async def test_events_endpoint_streams_changes(client):
+    response = await client.get("/api/events", params={"collections": "ads,nope"})
+    assert response.status_code == 400
+
+    account_id = await _create_account(client)
+    stream = events_api._stream_events(["ads"], account_id)
+    assert await stream.__anext__() == 'event: ready\ndata: {"source": "local"}\n\n'
+    ad_id = await _create_ad(client, account_id)
+    message = await stream.__anext__()
+    assert message.startswith("event: change\n") and f'"id": "{ad_id}"' in message
+    await stream.aclose()
+    assert live_events.subscriber_count() == 0
@@ -0,0 +1,182 @@
+import hashlib
+import io
+import os
+import uuid
+import pytest
+
+async def create_ad(client) -> str:
+    account = await client.post("/api/accounts/", json={"email": f"images-{uuid.uuid4()}@example.com", "wanuncios_password": "password"})
+    ad = {"account_id": account.json()["id"], "title": "Image ad", "description": "d", "category": "Contactos", "subcategory": "Relaciones Ocasionales", "province": "Panamá"}
+    return (await client.post("/api/ads/", json=ad)).json()["id"]
+
+async def chunked(content: bytes, size: int = 64 * 1024):
+    for start in range(0, len(content), size):
+        yield content[start:start + size]
+
+@pytest.mark.asyncio
+async def test_images_are_deduplicated_and_streamed_with_ranges(client, mock_db):
+    content = os.urandom(600 * 1024) # Several GridFS chunks
+    sha256 = hashlib.sha256(content).hexdigest()
+    first_ad, second_ad = await create_ad(client), await create_ad(client)
+
+    response = await client.post(f"/api/ads/{first_ad}/images", content=chunked(content), headers={"Content-Type": "image/jpeg"})
+    assert response.status_code == 201
+    assert response.json()["sha256"] == sha256 and response.json()["created"] is True
+    response = await client.post(f"/api/ads/{second_ad}/images", content=content, headers={"Content-Type": "image/jpeg"})
+    assert response.json()["created"] is False
+    assert await mock_db["images.files"].count_documents({}) == 1
+
+    ad = (await client.get(f"/api/ads/{first_ad}")).json()
+    assert ad["images"] == [sha256] and ad["version"] == 1
+    listed = (await client.get(f"/api/ads/{first_ad}/images")).json()
+    assert [(image["sha256"], image["length"], image["content_type"]) for image in listed] == [(sha256, len(content), "image/jpeg")]
+
+    url = f"/api/ads/{first_ad}/images/{sha256}"
+    response = await client.get(url)
+    assert response.status_code == 200 and response.content == content
+    assert response.headers["content-type"] == "image/jpeg"
+    assert response.headers["etag"] == f'"{sha256}"'
+
+    response = await client.get(url, headers={"Range": "bytes=262100-262199"}) # Spans two chunks
+    assert response.status_code == 206
+    assert response.content == content[262100:262200]
+    assert response.headers["content-range"] == f"bytes 262100-262199/{len(content)}"
+    assert (await client.get(url, headers={"Range": "bytes=-10"})).content == content[-10:]
+    assert (await client.get(url, headers={"Range": f"bytes={len(content)}-"})).status_code == 416
+    assert (await client.get(url, headers={"If-None-Match": f'"{sha256}"'})).status_code == 304
+
+    # Removed from one ad the image stays for the other; deleting the last ad deletes it
+    assert (await client.delete(url)).status_code == 204
+    assert (await client.get(url)).status_code == 404
+    assert await mock_db["images.files"].count_documents({}) == 1
+    assert (await client.delete(f"/api/ads/{second_ad}")).status_code == 204
+    assert await mock_db["images.files"].count_documents({}) == 0
+    assert await mock_db["images.chunks"].count_documents({}) == 0
+
+@pytest.mark.asyncio
+async def test_invalid_uploads_are_refused(client, mock_db, monkeypatch):
+    ad_id = await create_ad(client)
+    assert (await client.post(f"/api/ads/{ad_id}/images", content=b"text", headers={"Content-Type": "text/plain"})).status_code == 415
+    assert (await client.post("/api/ads/missing/images", content=b"x", headers={"Content-Type": "image/png"})).status_code == 404
+
+    monkeypatch.setenv("IMAGE_MAX_BYTES", "1000")
+    response = await client.post(f"/api/ads/{ad_id}/images", content=chunked(os.urandom(5000), size=500), headers={"Content-Type": "image/png"})
+    assert response.status_code == 413
+    assert await mock_db["images.files"].count_documents({}) == 0
+    assert await mock_db["images.chunks"].count_documents({}) == 0
+
+@pytest.mark.asyncio
+async def test_images_are_referenced_before_a_duplicate_is_dropped(client, mock_db):
+    from app.backend.services import ad_service, image_service
+
+    content = os.urandom(1000)
+    first_ad, second_ad = await create_ad(client), await create_ad(client)
+    await client.post(f"/api/ads/{first_ad}/images", content=content, headers={"Content-Type": "image/png"})
+
+    async def reference_then_detach_the_other(sha256: str) -> bool:
+        # The only other reference goes away while the duplicate is uploaded
+        assert await ad_service.attach_image(mock_db, second_ad, sha256)
+        return await ad_service.detach_image(mock_db, first_ad, sha256)
+
+    image, created = await image_service.store_image(mock_db, chunked(content), "image/png", reference=reference_then_detach_the_other)
+    assert not created
+    assert (await client.get(f"/api/ads/{second_ad}/images/{image['sha256']}")).content == content
+
+    # The images of an ad only change through the image endpoints
+    assert (await client.patch(f"/api/ads/{second_ad}", json={"images": ["0" * 64]})).status_code == 400
+    assert (await client.patch("/api/ads/bulk", json=[{"id": second_ad, "images": []}])).json()[0]["status"] == "error"
+    assert (await client.get(f"/api/ads/{second_ad}")).json()["images"] == [image["sha256"]]
+
+@pytest.mark.asyncio
+async def test_images_are_only_referenced_once_stored(client, mock_db, monkeypatch):
+    from motor.motor_asyncio import AsyncIOMotorGridIn
+    from app.backend.services import ad_service, image_service
+
+    ad_id = await create_ad(client)
+    references = []
+    async def reference(sha256: str) -> bool:
+        references.append(sha256)
+        return await ad_service.attach_image(mock_db, ad_id, sha256)
+
+    async def failing_close(self):
+        raise OSError("connection reset")
+    with monkeypatch.context() as patched:
+        patched.setattr(AsyncIOMotorGridIn, "close", failing_close)
+        with pytest.raises(OSError):
+            await image_service.store_image(mock_db, chunked(os.urandom(1000)), "image/png", reference=reference)
+    assert references == [] and (await client.get(f"/api/ads/{ad_id}")).json()["images"] == []
+
+    # A duplicate whose stored copy is deleted as unreferenced meanwhile is stored after all
+    content = os.urandom(1000)
+    stored, _ = await image_service.store_image(mock_db, chunked(content), "image/png")
+    async def reference_while_deleted(sha256: str) -> bool:
+        await image_service.delete_unreferenced(mock_db, [sha256])
+        return await reference(sha256)
+    image, created = await image_service.store_image(mock_db, chunked(content), "image/png", reference=reference_while_deleted)
+    assert created and image["sha256"] == stored["sha256"]
+    assert (await client.get(f"/api/ads/{ad_id}/images/{image['sha256']}")).content == content
+
+def photo(width: int, height: int) -> bytes:
+    """A JPEG with EXIF metadata, rotated by its orientation tag like phone photos are."""
+    Image = pytest.importorskip("PIL.Image")
+    image = Image.new("RGB", (width, height), (200, 30, 30))
+    exif = Image.Exif()
+    exif[0x0112] = 6 # Orientation: rotate 90° clockwise to display
+    exif[0x010F] = "Test camera" # Make
+    output = io.BytesIO()
+    image.save(output, format="JPEG", exif=exif)
+    return output.getvalue()
+
+@pytest.mark.asyncio
+async def test_variants_are_resized_stripped_and_derived_once(client, mock_db, monkeypatch):
+    Image = pytest.importorskip("PIL.Image")
+
+    content = photo(2400, 1200)
+    first_ad, second_ad = await create_ad(client), await create_ad(client)
+    uploaded = (await client.post(f"/api/ads/{first_ad}/images", content=content, headers={"Content-Type": "image/jpeg"})).json()
+    variants = uploaded["variants"]
+    assert set(variants) == {"display", "medium", "thumb"}
+    assert (variants["display"]["width"], variants["display"]["height"]) == (800, 1600) # Orientation applied
+    assert (variants["thumb"]["width"], variants["thumb"]["height"]) == (100, 200)
+
+    await client.post(f"/api/ads/{second_ad}/images", content=content, headers={"Content-Type": "image/jpeg"})
+    assert await mock_db["image_variants.files"].count_documents({}) == 3
+
+    url = f"/api/ads/{first_ad}/images/{uploaded['sha256']}"
+    thumbnail = await client.get(variants["thumb"]["url"])
+    assert thumbnail.headers["content-type"] == "image/jpeg"
+    with Image.open(io.BytesIO(thumbnail.content)) as image:
+        assert image.size == (100, 200)
+        assert len(image.getexif()) == 0
+
+    default = await client.get(url)
+    assert default.headers["content-length"] == str(variants["display"]["length"])
+    assert default.headers["etag"] != f'"{uploaded["sha256"]}"'
+    assert (await client.get(url, params={"variant": "original"})).status_code == 403 # It still has its EXIF
+    monkeypatch.setenv("ADMIN_TOKEN", "secret")
+    original = await client.get(url, params={"variant": "original"}, headers={"X-Admin-Token": "secret"})
+    assert original.content == content and original.headers["cache-control"].startswith("private")
+    assert (await client.get(url, params={"variant": "huge"})).status_code == 400
+
+    listed = (await client.get(f"/api/ads/{first_ad}/images")).json()
+    assert set(listed[0]["variants"]) == {"display", "medium", "thumb"}
+
+    await client.delete(f"/api/ads/{first_ad}")
+    await client.delete(f"/api/ads/{second_ad}")
+    assert await mock_db["image_variants.files"].count_documents({}) == 0
+
+@pytest.mark.asyncio
+async def test_upload_succeeds_when_the_process_pool_breaks(client, mock_db, monkeypatch):
+    pytest.importorskip("PIL.Image")
+    from concurrent.futures.process import BrokenProcessPool
+    from app.backend.services import image_processing
+
+    async def broken(data, specs=None):
+        raise BrokenProcessPool("A worker died")
+
+    monkeypatch.setattr(image_processing, "derive_variants", broken)
+    ad_id = await create_ad(client)
+    response = await client.post(f"/api/ads/{ad_id}/images", content=photo(400, 300), headers={"Content-Type": "image/jpeg"})
+    assert response.status_code == 201 and response.json()["variants"] == {}
+    # Without variants the original, with its metadata, is not served instead
+    assert (await client.get(response.json()["url"])).status_code == 404
@@ -0,0 +1,49 @@
+import pytest
+import uuid
+from types import SimpleNamespace
+
+from app.backend.services import metrics, mongo_monitoring
+
+def test_histogram_renders_cumulative_buckets(anyio_backend):
+    histogram = metrics.Histogram("test_latency_seconds", "Test histogram.", ("route",), buckets=(0.1, 1.0))
+    for value in (0.05, 0.5, 0.5, 3.0):
+        histogram.observe("/a", value=value)
+
+    rendered = histogram.render()
+    assert 'test_latency_seconds_bucket{route="/a",le="0.1"} 1' in rendered
+    assert 'test_latency_seconds_bucket{route="/a",le="1"} 3' in rendered
+    assert 'test_latency_seconds_bucket{route="/a",le="+Inf"} 4' in rendered
+    assert 'test_latency_seconds_count{route="/a"} 4' in rendered
+    assert 'test_latency_seconds_sum{route="/a"} 4.05' in rendered
+
+    with pytest.raises(TypeError): # A metric type must render its samples
+        metrics.Metric("test_incomplete", "Incomplete metric.")
+
+def test_command_listener_times_commands_by_collection(anyio_backend):
+    listener = mongo_monitoring.CommandMetricsListener()
+    before = mongo_monitoring.COMMAND_FAILURES.get("ads", "find")
+    for outcome in ("succeeded", "failed"):
+        started = SimpleNamespace(command_name="find", command={"find": "ads", "filter": {}}, connection_id=("localhost", 27017), request_id=7)
+        listener.started(started)
+        getattr(listener, outcome)(SimpleNamespace(command_name="find", connection_id=("localhost", 27017), request_id=7, duration_micros=1500))
+
+    assert mongo_monitoring.COMMAND_FAILURES.get("ads", "find") == before + 1
+    assert 'mongodb_command_duration_seconds_bucket{collection="ads",command="find",le="0.0025"}' in metrics.render()
+
+@pytest.mark.asyncio
+async def test_metrics_endpoint_reports_route_templates(client):
+    res_acc = await client.post("/api/accounts/", json={"email": f"test-metrics-{uuid.uuid4()}@example.com", "wanuncios_password": "password"})
+    await client.get(f"/api/accounts/{res_acc.json()['id']}")
+    await client.get("/api/accounts/missing")
+    await client.get("/api/ads/ads") # An id equal to a literal segment
+
+    response = await client.get("/metrics")
+    assert response.status_code == 200
+    body = response.text
+    assert 'http_requests_total{method="GET",route="/api/accounts/{account_id}",status="200"}' in body
+    assert 'http_requests_total{method="GET",route="/api/accounts/{account_id}",status="404"}' in body
+    assert "missing" not in body
+    assert 'http_requests_total{method="GET",route="/api/ads/{ad_id}",status="404"}' in body
+    assert 'http_request_duration_seconds_bucket{method="POST",route="/api/accounts/",le="+Inf"}' in body
+    assert 'job_queue_jobs{status="queued"} 0' in body
+    assert "http_requests_in_flight 1" in body # The scrape itself
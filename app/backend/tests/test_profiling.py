@@ -0,0 +1,61 @@
+import asyncio
+import time
+import pytest
+
+from app.backend.main import app as main_app
+from app.backend.services import profiling
+
+def busy_wait(seconds: float):
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        pass
+
+@pytest.mark.asyncio
+async def test_sampling_profiler_attributes_samples_to_the_task(client):
+    profiler = profiling.SamplingProfiler(asyncio.current_task(), interval=0.001)
+    profiler.start()
+    busy_wait(0.05)
+    await asyncio.sleep(0.02)
+    stacks = profiler.stop()
+
+    assert any("busy_wait" in stack for stack in stacks)
+    assert "busy_wait" in profiling.collapse(stacks)
+
+@pytest.mark.asyncio
+async def test_profiling_requires_the_admin_token(client, monkeypatch):
+    monkeypatch.setenv("ADMIN_TOKEN", "secret")
+
+    response = await client.get("/api/ads/", headers={"X-Profile": "inline"})
+    assert response.status_code == 403
+    response = await client.get("/api/ads/", headers={"X-Profile": "inline", "X-Admin-Token": "wrong"})
+    assert response.status_code == 403
+
+    response = await client.get("/api/ads/", headers={"X-Admin-Token": "secret"})
+    assert response.status_code == 200 and response.json() == []
+    assert "X-Profile-Id" not in response.headers
+
+    # Values other than the documented ones do not ask for a profile
+    for params, headers in (({"profile": "0"}, {}), ({"profile": "false"}, {}), ({}, {"X-Profile": "off"})):
+        response = await client.get("/api/ads/", params=params, headers=headers)
+        assert response.status_code == 200 and "X-Profile-Id" not in response.headers
+
+@pytest.mark.asyncio
+async def test_profiled_request_inline_and_saved(client, mock_db, monkeypatch):
+    monkeypatch.setenv("ADMIN_TOKEN", "secret")
+    monkeypatch.setattr(main_app, "mongodb", mock_db, raising=False)
+    headers = {"X-Admin-Token": "secret"}
+
+    response = await client.get("/api/ads/", params={"profile": "inline"}, headers=headers)
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+    assert response.headers["X-Profile-Status"] == "200"
+    assert int(response.headers["X-Profile-Samples"]) >= 0
+
+    response = await client.get("/api/ads/", headers={**headers, "X-Profile": "1"})
+    assert response.status_code == 200 and response.json() == []
+    profile_id = response.headers["X-Profile-Id"]
+
+    [listed] = (await client.get("/api/admin/profiles", headers=headers)).json()
+    assert listed["id"] == profile_id and listed["path"] == "/api/ads/" and listed["status"] == 200
+    assert (await client.get(f"/api/admin/profiles/{profile_id}", headers=headers)).status_code == 200
+    assert (await client.get(f"/api/admin/profiles/{profile_id}")).status_code == 403
@@ -0,0 +1,253 @@
+import asyncio
+import pytest
+import uuid
+from datetime import datetime, timedelta
+
+from app.backend.services import automation_service, scheduler_service
+
+async def create_due_schedule(client, mock_db, hours_overdue: int = 1) -> str:
+    res_acc = await client.post("/api/accounts/", json={"email": f"test-sweep-{uuid.uuid4()}@example.com", "wanuncios_password": "password"})
+    ad_data = { "account_id": res_acc.json()["id"], "title": "Sweep Ad", "description": "d", "category": "Contactos", "subcategory": "Relaciones Ocasionales", "province": "Panamá" }
+    ad_id = (await client.post("/api/ads/", json=ad_data)).json()["id"]
+    schedule_id = (await client.post("/api/schedules/", json={"ad_id": ad_id, "republish_interval_hours": 12})).json()["id"]
+    await mock_db.schedules.update_one({"id": schedule_id}, {"$set": {"next_republish_at": datetime.utcnow() - timedelta(hours=hours_overdue)}})
+    return schedule_id
+
+@pytest.mark.asyncio
+async def test_due_schedules_are_claimed_once(client, mock_db):
+    schedule_id = await create_due_schedule(client, mock_db)
+    await client.post("/api/schedules/", json={"ad_id": "missing", "republish_interval_hours": 1}) # Never due
+
+    now = datetime.utcnow()
+    claimed = await scheduler_service.claim_due_schedules(mock_db, now, limit=10)
+    assert [schedule["id"] for schedule in claimed] == [schedule_id]
+    assert await scheduler_service.claim_due_schedules(mock_db, now, limit=10) == []
+
+    stored = await mock_db.schedules.find_one({"id": schedule_id})
+    assert stored["next_republish_at"] > now
+
+    response = await client.get(f"/api/schedules/{schedule_id}")
+    assert response.json()["next_republish_at"] == stored["next_republish_at"].isoformat()
+
+@pytest.mark.asyncio
+async def test_sweep_posts_due_ads(client, mock_db):
+    await create_due_schedule(client, mock_db)
+    automation_service.post_ad_to_wanuncios.reset_mock()
+
+    assert await scheduler_service.sweep(mock_db) == 1
+    await asyncio.gather(*scheduler_service._running)
+
+    automation_service.post_ad_to_wanuncios.assert_awaited_once()
+    account, ad = automation_service.post_ad_to_wanuncios.await_args.args
+    assert ad.title == "Sweep Ad" and account.id == ad.account_id
+
+@pytest.mark.asyncio
+async def test_job_store_claims_one_off_and_repeating_jobs(client, mock_db):
+    from app.backend.services import job_store
+
+    store = job_store.AsyncMongoJobStore.for_database(mock_db)
+    now = datetime.utcnow()
+    one_off = await store.add_job("publish_ad", {"ad_id": "a"}, run_at=now - timedelta(seconds=1))
+    repeating = await store.add_job("publish_ad", {"ad_id": "b"}, run_at=now - timedelta(seconds=1), interval_seconds=60)
+    await store.add_job("publish_ad", {"ad_id": "c"}, run_at=now + timedelta(hours=1))
+
+    claimed = await store.claim_due_jobs(now, limit=10)
+    assert {job["_id"] for job in claimed} == {one_off, repeating}
+    assert await store.claim_due_jobs(now, limit=10) == []
+
+    # A claimed one-off job is kept until its run ends, and claimed again if it never does
+    [claimed_one_off] = [job for job in claimed if job["_id"] == one_off]
+    assert (await store.get_job(one_off))["next_run_at"] > now
+    assert (await store.get_job(repeating))["next_run_at"] > now
+    assert await store.get_next_run_time() > now
+    later = now + timedelta(hours=2)
+    [reclaimed] = [job for job in await store.claim_due_jobs(later, limit=10) if job["_id"] == one_off]
+    assert not await store.finish_job(claimed_one_off) # The stale claim leaves the new one alone
+
+    with pytest.raises(scheduler_service.PublishError): # Ad "a" does not exist
+        await job_store.run_job(mock_db, reclaimed)
+    assert await store.get_job(one_off) is None # Failed runs end too
+    assert await store.get_job(repeating) is not None
+
+    # A job whose handler no longer exists is dropped, even a repeating one
+    await mock_db.scheduled_jobs.insert_one({"_id": "orphan", "handler": "removed", "kwargs": {}, "next_run_at": later, "interval_seconds": 60})
+    [orphan] = [job for job in await store.claim_due_jobs(later, limit=10) if job["_id"] == "orphan"]
+    await job_store.run_job(mock_db, orphan)
+    assert await store.get_job("orphan") is None
+
+@pytest.mark.asyncio
+async def test_publish_later_stores_a_compact_job(client, mock_db):
+    schedule_id = await create_due_schedule(client, mock_db)
+    ad_id = (await mock_db.schedules.find_one({"id": schedule_id}))["ad_id"]
+
+    run_at = (datetime.utcnow() + timedelta(hours=2)).replace(microsecond=0)
+    response = await client.post(f"/api/ads/{ad_id}/publish", params={"run_at": run_at.isoformat()})
+    assert response.status_code == 202
+
+    job = await mock_db.scheduled_jobs.find_one({"_id": response.json()["job_id"]})
+    assert job["handler"] == "publish_ad"
+    assert job["kwargs"] == {"ad_id": ad_id}
+    assert job["next_run_at"] == run_at
+
+@pytest.mark.asyncio
+async def test_scheduler_lease_hands_over_with_a_newer_token(client, mock_db):
+    from app.backend.services import leases
+
+    token = await leases.acquire(mock_db, "scheduler", "worker-a", ttl_seconds=60)
+    assert token is not None
+    assert await leases.acquire(mock_db, "scheduler", "worker-b", ttl_seconds=60) is None
+    assert await leases.acquire(mock_db, "scheduler", "worker-a", ttl_seconds=60) == token
+    assert await leases.renew(mock_db, "scheduler", "worker-a", token, ttl_seconds=60)
+
+    # worker-a dies: once its lease has expired, worker-b takes over with a newer token
+    await mock_db.leases.update_one({"_id": "scheduler"}, {"$set": {"expires_at": datetime.utcnow() - timedelta(seconds=1)}})
+    new_token = await leases.acquire(mock_db, "scheduler", "worker-b", ttl_seconds=60)
+    assert new_token == token + 1
+    assert not await leases.renew(mock_db, "scheduler", "worker-a", token, ttl_seconds=60)
+
+    assert await leases.release(mock_db, "scheduler", "worker-b", new_token)
+    assert await leases.acquire(mock_db, "scheduler", "worker-a", ttl_seconds=60) == new_token + 1
+
+@pytest.mark.asyncio
+async def test_stale_leader_cannot_claim_behind_a_newer_one(client, mock_db):
+    schedule_id = await create_due_schedule(client, mock_db)
+    now = datetime.utcnow()
+    assert len(await scheduler_service.claim_due_schedules(mock_db, now, limit=10, fence=2)) == 1
+
+    # Due again, but claimed before under token 2: the old leader with token 1 is fenced off
+    await mock_db.schedules.update_one({"id": schedule_id}, {"$set": {"next_republish_at": now - timedelta(minutes=1)}})
+    assert await scheduler_service.claim_due_schedules(mock_db, now, limit=10, fence=1) == []
+    assert len(await scheduler_service.claim_due_schedules(mock_db, now, limit=10, fence=2)) == 1
+
+@pytest.mark.asyncio
+async def test_publish_is_queued_and_run_by_a_worker(client, mock_db):
+    from app.backend.services import job_queue
+
+    schedule_id = await create_due_schedule(client, mock_db)
+    ad_id = (await mock_db.schedules.find_one({"id": schedule_id}))["ad_id"]
+    automation_service.post_ad_to_wanuncios.reset_mock()
+
+    response = await client.post(f"/api/ads/{ad_id}/publish")
+    assert response.status_code == 202
+    job_id = response.json()["job_id"]
+    assert (await client.get(f"/api/jobs/{job_id}")).json()["status"] == "queued"
+    automation_service.post_ad_to_wanuncios.assert_not_awaited()
+
+    assert await job_queue.run_next(mock_db, worker="test-worker") == job_id
+    assert await job_queue.run_next(mock_db, worker="test-worker") is None
+    automation_service.post_ad_to_wanuncios.assert_awaited_once()
+
+    job = (await client.get(f"/api/jobs/{job_id}")).json()
+    assert job["status"] == "succeeded" and job["attempts"] == 1 and job["worker"] == "test-worker"
+    assert (await client.get("/api/jobs/missing")).status_code == 404
+
+@pytest.mark.asyncio
+async def test_publish_is_refused_when_the_queue_is_full(client, mock_db, monkeypatch):
+    from app.backend.services import job_queue
+
+    monkeypatch.setenv("JOB_QUEUE_MAX_PENDING", "1")
+    schedule_id = await create_due_schedule(client, mock_db)
+    ad_id = (await mock_db.schedules.find_one({"id": schedule_id}))["ad_id"]
+
+    assert (await client.post(f"/api/ads/{ad_id}/publish")).status_code == 202
+    response = await client.post(f"/api/ads/{ad_id}/publish")
+    assert response.status_code == 429
+    assert "Retry-After" in response.headers
+
+    await job_queue.run_next(mock_db)
+    assert (await client.post(f"/api/ads/{ad_id}/publish")).status_code == 202
+
+@pytest.mark.asyncio
+async def test_abandoned_job_is_run_again(client, mock_db):
+    from app.backend.services import job_queue
+
+    job = await job_queue.enqueue(mock_db, "publish_ad", {"ad_id": "missing"})
+    claimed = await job_queue.claim_next(mock_db, worker="dead-worker")
+    assert claimed["_id"] == job.id
+    assert await job_queue.claim_next(mock_db, worker="other-worker") is None
+
+    await mock_db.jobs.update_one({"_id": job.id}, {"$set": {"lease_expires_at": datetime.utcnow() - timedelta(seconds=1)}})
+    assert await job_queue.run_next(mock_db, worker="other-worker") == job.id
+    stored = await job_queue.get_job(mock_db, job.id)
+    assert stored.status == "failed" and stored.attempts == 2
+    assert stored.error.startswith("PublishError")
+
+@pytest.mark.asyncio
+async def test_running_job_keeps_its_lease_and_stops_once_it_is_lost(client, mock_db, monkeypatch):
+    from app.backend.services import job_queue, job_store
+
+    monkeypatch.setenv("JOB_TIMEOUT_SECONDS", "0.3")
+    started, release = asyncio.Event(), asyncio.Event()
+
+    @job_store.handler("test_slow")
+    async def slow(db):
+        started.set()
+        await release.wait()
+
+    job = await job_queue.enqueue(mock_db, "test_slow", {})
+    run = asyncio.create_task(job_queue.run_next(mock_db, worker="test-worker"))
+    await started.wait()
+    await asyncio.sleep(0.5) # Past the first lease: renewed while the handler runs
+    assert await job_queue.claim_next(mock_db, worker="other-worker") is None
+    release.set()
+    assert await run == job.id
+    assert (await job_queue.get_job(mock_db, job.id)).status == "succeeded"
+
+    # A claim taken over meanwhile cancels the handler and leaves the new claim alone
+    started.clear()
+    release.clear()
+    job = await job_queue.enqueue(mock_db, "test_slow", {})
+    run = asyncio.create_task(job_queue.run_next(mock_db, worker="test-worker"))
+    await started.wait()
+    await mock_db.jobs.update_one({"_id": job.id}, {"$inc": {"attempts": 1}})
+    assert await asyncio.wait_for(run, timeout=1) == job.id
+    stored = await job_queue.get_job(mock_db, job.id)
+    assert stored.status == "running" and stored.attempts == 2
+
+@pytest.mark.asyncio
+async def test_runs_are_recorded_with_percentiles(client, mock_db):
+    schedule_id = await create_due_schedule(client, mock_db)
+    schedule = await mock_db.schedules.find_one({"id": schedule_id})
+    ad = await mock_db.ads.find_one({"id": schedule["ad_id"]})
+
+    await scheduler_service.run_schedule(mock_db, schedule)
+    automation_service.post_ad_to_wanuncios.return_value = False
+    try:
+        with pytest.raises(scheduler_service.PublishError):
+            await scheduler_service.run_schedule(mock_db, schedule)
+    finally:
+        automation_service.post_ad_to_wanuncios.return_value = True
+
+    runs = await mock_db.job_runs.find({}).sort("started_at", 1).to_list(length=None)
+    assert [run["outcome"] for run in runs] == ["succeeded", "failed"]
+    assert runs[1]["error_class"] == "PublishError"
+    assert runs[0]["account_id"] == ad["account_id"] and runs[0]["duration_ms"] >= 0
+    assert (await client.get(f"/api/ads/{ad['id']}")).json()["last_published_at"] is not None
+
+    response = await client.get("/api/job-runs/stats", params={"group_by": "account"})
+    assert response.status_code == 200
+    [stats] = response.json()["groups"]
+    assert stats["id"] == ad["account_id"]
+    assert stats["runs"] == 2 and stats["failure_rate"] == 0.5
+    assert stats["p50_ms"] <= stats["p95_ms"] <= stats["p99_ms"]
+
+    [stats] = (await client.get("/api/job-runs/stats")).json()["groups"]
+    assert stats["id"] == schedule_id
+
+@pytest.mark.asyncio
+async def test_cancelled_runs_are_not_recorded(client, mock_db):
+    from app.backend.services import job_runs
+
+    started = asyncio.Event()
+
+    async def run():
+        async with job_runs.record(mock_db, "timed", "test_cancelled"):
+            started.set()
+            await asyncio.Event().wait()
+
+    task = asyncio.create_task(run())
+    await started.wait()
+    task.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await task
+    assert await mock_db.job_runs.count_documents({"handler": "test_cancelled"}) == 0